@@ -2,3 +2,5 @@
 """Pydialect: build languages on Python."""
 
 __version__ = '0.1.2'
+
+from .batch import import_many  # noqa: F401
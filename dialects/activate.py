@@ -2,8 +2,14 @@
 """Install the Pydialect import hook.
 
 Reloading this module refreshes the import hook to the start of ``sys.meta_path``.
+
+Dialect modules can also be loaded lazily, with ``importlib.util.LazyLoader``:
+macro expansion and execution are then deferred until the first attribute
+access on the module. This is opt-in, per package; see ``lazy_load``.
 """
 
+__all__ = ["lazy_load", "lazy_macropy", "prefetch"]
+
 from . import importer
 import sys
 
@@ -19,3 +25,58 @@ if j > -1:
     sys.meta_path.pop(j)
 
 sys.meta_path.insert(0, importer.DialectFinder)
+
+def lazy_load(*packages):
+    """Load the dialect modules in ``packages`` (and their subpackages) lazily.
+
+    E.g. ``lazy_load("myapp.commands")`` defers the expansion and execution of
+    each dialect module ``myapp.commands.*`` until something accesses an attribute
+    of it. Modules that do not use a dialect are not affected.
+
+    As with any lazy loading, import-time side effects are deferred too, and
+    import errors surface only at first use. Only modules imported after this
+    call are affected.
+    """
+    importer.DialectFinder.lazy_packages.update(packages)
+
+def lazy_macropy():
+    """Install MacroPy's import hook only when a module that uses macros is imported.
+
+    Importing ``macropy.activate`` up front costs startup time even for programs
+    that never import a module with macros. With this, the dialect importer
+    installs MacroPy's hook on demand, when it finds a (non-dialect) module
+    whose source mentions macros. (Dialect modules are macro-expanded by the
+    dialect importer itself, which loads MacroPy only when it has to.)
+
+    Standard library modules are not scanned, and other modules only up to
+    their first 64 KiB; see the README.
+
+    The ``pydialect`` bootstrapper does this.
+    """
+    importer.DialectFinder.macropy_on_demand = True
+
+def prefetch(workers=None):
+    """Compile the imports of dialect modules speculatively, in a pool of worker processes.
+
+    When a dialect module has been loaded, the dialect modules it imports are
+    expanded in the background right away, so that they are ready (also in the
+    compile cache) when the import reaches them. See ``dialects.prefetch``.
+
+    ``workers``: number of worker processes; default one per CPU core.
+    """
+    from .prefetch import Prefetcher
+    importer.DialectFinder.prefetcher = Prefetcher(workers)
+
+def _activate_macropy():
+    """Install MacroPy's import hook now (if MacroPy is installed), and ours before it.
+
+    For processes that exist to expand dialect modules (the worker processes,
+    the server): a dialect definition, or a macro module, may itself use macros.
+    """
+    import importlib
+    importer.DialectFinder.macropy_on_demand = False  # importing MacroPy goes through ``find_spec``
+    try:
+        import macropy.activate  # noqa: F401
+    except ImportError:
+        pass
+    importlib.reload(sys.modules[__name__])  # back to the start of sys.meta_path
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Importing a set of dialect modules, expanding them in parallel."""
+
+__all__ = ["import_many"]
+
+import importlib
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+def import_many(names, workers=None):
+    """Import the modules ``names``, expanding the dialect modules among them in parallel.
+
+    First, the dialect modules among ``names`` are found (without importing
+    anything). Those that are not up to date in the compile cache are run
+    through the import-time pipeline (source transform, AST transform, macro
+    expansion, compilation) in a pool of worker processes; see
+    ``DialectFinder.compile_module``. The code objects are sent back (with
+    ``marshal``) to the dialect importer's in-memory table, and also stored in
+    the compile cache.
+
+    Then the modules are executed in this thread, one at a time, each after
+    those of the other modules in ``names`` that it imports at module level
+    (otherwise in the given order). Since the expensive part is done, this is
+    just the execution of the module bodies.
+
+    ``workers``: number of worker processes; default one per CPU core.
+    No processes are started if there is nothing to expand (e.g. all of the
+    modules are already in the compile cache).
+
+    Returns the list of the imported modules, in the order of ``names``.
+    Import errors are raised as usual; a module that fails to expand in a worker
+    is expanded again when imported, to report the error.
+
+    The dialect import hook must be installed (``import dialects.activate``).
+    Requires Python 3.7+ (for the worker pool); as with ``dialects.prefetch``,
+    a main program run directly by ``python3`` must guard its top level with
+    ``if __name__ == '__main__':``.
+    """
+    names = list(names)
+    imports = _compile(names, workers)
+
+    # Dependency order: postorder DFS over the module-level imports within the batch.
+    batch = set(names)
+    order = []
+    visited = set()
+    def visit(name):
+        if name in visited:
+            return
+        visited.add(name)
+        for other in imports.get(name, ()):
+            if other in batch:
+                visit(other)
+        order.append(name)
+    for name in names:
+        visit(name)
+
+    modules = {}
+    for name in order:
+        modules[name] = importlib.import_module(name)
+    return [modules[name] for name in names]
+
+def _compile(names, workers):
+    """Expand the dialect modules among ``names`` in parallel. Return ``{name: imported module names}``."""
+    from . import cache
+    from .importer import DialectFinder, detect_dialect
+    from .prefetch import _locate, module_imports
+    todo = []
+    imports = {}
+    for name in names:
+        if name in sys.modules:
+            continue
+        spec = _locate(name)
+        if spec is None or not spec.has_location or not spec.origin.endswith(".py"):
+            continue
+        dialect_name = detect_dialect(spec.origin)
+        if not isinstance(dialect_name, str):
+            continue
+        st = os.stat(spec.origin)  # before loading, like ``DialectFinder.load_code``
+        code = cache.load(spec.origin, dialect_name, name)
+        if code is not None:  # up to date in the cache; the import just loads it
+            DialectFinder._add_compiled(name, spec.origin, dialect_name, (st.st_mtime_ns, st.st_size), code)
+            imports[name] = module_imports(code, spec.parent)
+        else:
+            todo.append(name)
+    if not todo:
+        return imports
+
+    import concurrent.futures
+    import marshal
+    import multiprocessing
+    from .prefetch import _init_worker, _prefetch
+    workers = min(workers or os.cpu_count() or 1, len(todo))
+    logger.info("Expanding %d dialect modules in %d processes", len(todo), workers)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=_init_worker,
+                                                initargs=(list(sys.path), sys.dont_write_bytecode,
+                                                          cache.backend)) as pool:
+        for fullname, entry, names_imported in pool.map(_prefetch, todo):
+            if entry is not None:
+                origin, dialect_name, version, data = entry
+                DialectFinder._add_compiled(fullname, origin, dialect_name, version, marshal.loads(data))
+            imports[fullname] = names_imported
+    return imports
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""setuptools integration: ship pre-expanded dialect modules in built distributions.
+
+Provides a ``build_py`` command that, after the usual build step, compiles the
+dialect modules of the package into the compile cache inside the build
+directory (``__pycache__``, see ``dialects.cache``). The cache files then get
+included in wheels, so installed code starts without any macro expansion, and
+works even if the install location is read-only.
+
+Usage, in the ``setup.py`` of a package written in a dialect::
+
+    from setuptools import setup
+    from dialects.build import build_py
+
+    setup(...,
+          cmdclass={"build_py": build_py})
+
+Pydialect, the dialects used, and the macro libraries they depend on must be
+installed at build time (e.g. list them in ``setup_requires``, or in the
+``build-system.requires`` of ``pyproject.toml``). The cache entries record
+the versions of everything they depend on, so if the runtime environment
+differs, the affected modules are simply expanded again at import time.
+"""
+
+__all__ = ["build_py"]
+
+from setuptools.command.build_py import build_py as _build_py
+from distutils.errors import DistutilsError  # after setuptools, which may provide distutils
+
+class build_py(_build_py):
+    """``build_py`` that also precompiles the dialect modules it builds."""
+
+    def run(self):
+        super().run()
+        if not self.dry_run:
+            self.precompile_dialects()
+
+    def precompile_dialects(self):
+        """Compile the dialect modules in the build directory into ``__pycache__``."""
+        from .cache import PycacheStore
+        from .precompile import precompile
+        sources = [fn for fn in self.get_outputs(include_bytecode=False) if fn.endswith(".py")]
+        if not sources:
+            return
+        self.announce("precompiling dialect modules", level=2)
+        # Always into __pycache__, regardless of any cache directory set in the environment;
+        # that's the only place the installed modules will look for it.
+        fails = precompile(sources, verbose=self.verbose, backend=PycacheStore())
+        if fails:
+            raise DistutilsError("{} dialect module(s) failed to compile".format(fails))
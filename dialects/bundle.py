@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Bundle a program into a single-file zipapp of precompiled code objects.
+
+Starting from an entry module, finds the transitive closure of the modules it
+imports (using stdlib's ``modulefinder``, with dialect modules compiled by the
+Pydialect pipeline so that their imports can be seen), and writes a zipapp
+containing the code objects of all non-stdlib modules, plus a small launcher.
+
+At startup, the launcher reads all code objects with a single read from the
+archive, and installs a meta-path finder that serves them, so there is no
+per-module filesystem search and no macro expansion. Neither Pydialect nor
+MacroPy need to be installed where the bundle runs.
+
+Limitations:
+
+  - The bundle runs only on the same Python version (bytecode compatibility)
+    that created it.
+  - Extension modules cannot be imported from a zip file; they are left out
+    (with a warning), and must be installed where the bundle runs.
+  - Imports ``modulefinder`` cannot see (e.g. ``importlib.import_module``
+    with a computed name) are not followed.
+
+Usage::
+
+    pydialect --bundle app.pyz -m mymodule
+    pydialect --bundle app.pyz myscript.py
+"""
+
+__all__ = ["find_closure", "bundle"]
+
+import importlib.util
+import logging
+import marshal
+import modulefinder
+import os
+import sysconfig
+import zipfile
+
+from . import cache
+from .importer import DialectFinder, detect_dialect, _UNDECIDED
+
+logger = logging.getLogger(__name__)
+
+_BUNDLE_DATA = "__pydialect_bundle__.marshal"
+
+# Module type of Python source files, as reported by ``modulefinder``. Before
+# Python 3.8, ``modulefinder`` used the (same-valued) constants of ``imp``.
+_PY_SOURCE = getattr(modulefinder, "_PY_SOURCE", 1)
+
+# The launcher must run on a bare Python, so it only uses the stdlib.
+_LAUNCHER = '''\
+# -*- coding: utf-8 -*-
+"""Launcher for a Pydialect bundle."""
+
+import importlib
+import importlib.util
+import marshal
+import os
+import sys
+from importlib.machinery import ModuleSpec
+
+class BundleFinder:
+    def __init__(self, archive, modules):
+        self.archive = archive
+        self.modules = modules
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname not in self.modules:
+            return None
+        is_package, relpath, code = self.modules[fullname]
+        spec = ModuleSpec(fullname, self, origin=os.path.join(self.archive, relpath), is_package=is_package)
+        spec.has_location = True
+        if is_package:
+            spec.submodule_search_locations = [os.path.join(self.archive, os.path.dirname(relpath))]
+        return spec
+
+    def create_module(self, spec):
+        pass
+
+    def exec_module(self, module):
+        exec(self.modules[module.__spec__.name][2], module.__dict__)
+
+def main():
+    archive = os.path.dirname(__file__)
+    data = __loader__.get_data(os.path.join(archive, "{datafile}"))
+    magic, entry, modules = marshal.loads(data)
+    if magic != importlib.util.MAGIC_NUMBER:
+        sys.exit("This bundle was made for another Python version")
+    finder = BundleFinder(archive, modules)
+    sys.meta_path.insert(0, finder)
+    parent = entry.rpartition(".")[0]
+    if parent:  # like "python3 -m", initialize the parent packages first
+        importlib.import_module(parent)
+    spec = finder.find_spec(entry)
+    module = importlib.util.module_from_spec(spec)
+    module.__name__ = "__main__"
+    module.__package__ = parent if not modules[entry][0] else entry
+    sys.modules["__main__"] = module
+    sys.argv[0] = archive
+    exec(modules[entry][2], module.__dict__)
+
+main()
+'''.replace("{datafile}", _BUNDLE_DATA)
+
+class _DialectModuleFinder(modulefinder.ModuleFinder):
+    """``ModuleFinder`` that compiles dialect modules using the Pydialect pipeline."""
+
+    def load_module(self, fqname, fp, pathname, file_info):
+        if file_info[2] == _PY_SOURCE:
+            code = self._dialect_code(fqname, pathname)
+            if code is not None:
+                m = self.add_module(fqname)
+                m.__file__ = pathname
+                m.__code__ = code
+                self.scan_code(code, m)
+                return m
+        return super().load_module(fqname, fp, pathname, file_info)
+
+    def _dialect_code(self, fqname, pathname):
+        """Return the expanded code object of a dialect module, or ``None`` if ``pathname`` is not one."""
+        dialect_name = detect_dialect(pathname)
+        if dialect_name is None:
+            return None
+        if dialect_name is not _UNDECIDED:
+            code = cache.load(pathname, dialect_name, fqname)
+            if code is not None:
+                return code
+        spec = importlib.util.spec_from_file_location(fqname, pathname)
+        result = DialectFinder.expand_module(spec)
+        return result[1] if result is not None else None
+
+def _is_stdlib(filename):
+    paths = sysconfig.get_paths()
+    stdlib = os.path.join(os.path.realpath(paths["stdlib"]), "")
+    site = [os.path.join(os.path.realpath(paths[x]), "") for x in ("purelib", "platlib")]
+    filename = os.path.realpath(filename)
+    return filename.startswith(stdlib) and not any(filename.startswith(x) for x in site)
+
+def find_closure(entry, script=None, path=None):
+    """Find the modules the program ``entry`` consists of, and compile them.
+
+    ``entry``: name of the entry module (as in ``python3 -m entry``).
+
+    ``script``: if given, the path of the entry script (as in ``python3 script.py``);
+    then the entry module is named ``__main__``, and ``entry`` is ignored.
+
+    ``path``: module search path; default ``sys.path``.
+
+    Returns ``(entry, modules)``, where ``modules`` is a dict
+    ``{fullname: (is_package, filename, code)}`` of all non-stdlib
+    modules (the entry module included).
+    """
+    import dialects.activate  # dialect and macro modules may themselves use dialects and macros
+    dialects.activate._activate_macropy()
+    finder = _DialectModuleFinder(path=path)
+    if script is not None:
+        finder.run_script(script)
+        entry = "__main__"
+    else:
+        finder.import_hook(entry)
+        m = finder.modules[entry]
+        if m.__path__:  # like "python3 -m package"
+            entry = "{}.__main__".format(entry)
+            finder.import_hook(entry)
+    modules = {}
+    for name, m in finder.modules.items():
+        if not m.__file__:  # builtin, or namespace package
+            continue
+        if _is_stdlib(m.__file__):
+            continue
+        if m.__code__ is None:
+            logger.warning("Module '{}' ({}) is not Python source, leaving it out of the bundle".format(name, m.__file__))
+            continue
+        modules[name] = (bool(m.__path__), m.__file__, m.__code__)
+    missing = sorted(finder.badmodules)
+    if missing:
+        logger.info("Imports that could not be resolved (possibly optional): {}".format(", ".join(missing)))
+    return entry, modules
+
+def bundle(outfile, entry, script=None, path=None, interpreter="/usr/bin/env python3"):
+    """Write the program ``entry`` (or ``script``) as a zipapp into ``outfile``.
+
+    ``entry``, ``script``, ``path``: see ``find_closure``.
+
+    ``interpreter``: for the shebang line; ``None`` to omit it.
+
+    Returns the number of modules in the bundle.
+    """
+    entry, modules = find_closure(entry, script, path)
+    packed = {}
+    for name, (is_package, filename, code) in modules.items():
+        relpath = os.path.join(*name.split(".")) + ("/__init__.py" if is_package else ".py")
+        packed[name] = (is_package, relpath, code)
+    data = marshal.dumps((importlib.util.MAGIC_NUMBER, entry, packed))
+    with open(outfile, "wb") as f:
+        if interpreter:
+            f.write("#!{}\n".format(interpreter).encode("utf-8"))
+        # Stored, not compressed, so that startup does not need to decompress.
+        with zipfile.ZipFile(f, "w", compression=zipfile.ZIP_STORED) as z:
+            z.writestr("__main__.py", _LAUNCHER)
+            z.writestr(_BUNDLE_DATA, data)
+    if interpreter:
+        os.chmod(outfile, os.stat(outfile).st_mode | 0o111)
+    return len(packed)
@@ -0,0 +1,710 @@
+# -*- coding: utf-8 -*-
+"""Persistent cache of dialect-expanded code objects.
+
+The final code object of a dialect module (after the source transform, the
+AST transform, macro expansion and compilation) is stored, using ``marshal``,
+in the ``__pycache__`` directory next to the source file, much like Python
+itself does for ``.pyc`` files. The cache file name carries a dialect-specific
+tag, e.g. ``mymod.cpython-37.dialect-lispython.pyc``, so it never collides
+with the standard bytecode cache.
+
+The expanded code depends on more than the source of the module itself, so
+each cache entry also records its dependencies:
+
+  - The toolchain: the Python version, and the versions of Pydialect and MacroPy.
+  - The dialect module, and the modules that define its transformers
+    (the dialect template usually lives in one of these).
+  - The macro modules whose macros were used in the module, and the modules
+    that implement those macros (for a macro package, all of its submodules).
+
+Each file dependency is recorded as its mtime, size and SHA-256 hash. An entry
+is valid only if none of its dependencies have changed. When the mtime or size
+of a file differs from what was recorded, the file is hashed, so that a mere
+touch (or a fresh checkout) does not invalidate the cache, while an actual
+change always does.
+
+The cache is written only if ``sys.dont_write_bytecode`` is false. Writes are
+atomic, so that several processes can safely share the cache.
+
+Instead of ``__pycache__``, the cache can live in a directory of its own (see
+``ContentStore``), which is useful for sharing the cache between processes and
+machines. Set the environment variable ``PYDIALECT_CACHE_DIR``, or assign to
+``dialects.cache.backend``. To prune such a cache, run::
+
+    python3 -m dialects.cache prune DIR --max-size 500M
+
+Alternatively, all entries can be kept in a single pack file (see ``PackStore``),
+selected by ``PYDIALECT_CACHE_PACK``. To compact a pack file, run::
+
+    python3 -m dialects.cache compact PACKFILE
+"""
+
+__all__ = ["cache_path", "load", "store", "toolchain", "fingerprint",
+           "PycacheStore", "ContentStore", "PackStore"]
+
+import importlib.util
+import logging
+import marshal
+import mmap
+import os
+import struct
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Format version of our cache files; the Python bytecode version is also
+# part of the magic, because marshal's format depends on it.
+_MAGIC = b"PYD\x02" + importlib.util.MAGIC_NUMBER
+
+def cache_path(filename, dialect_name):
+    """Return the cache file path for the source file ``filename`` in dialect ``dialect_name``.
+
+    Return ``None`` if caching is not possible (``sys.implementation.cache_tag``
+    is ``None``).
+
+    Respects ``sys.pycache_prefix`` (Python 3.8+), like ``.pyc`` files do.
+    """
+    try:
+        pyc = importlib.util.cache_from_source(filename)
+    except (NotImplementedError, ValueError):
+        return None
+    base, _ = os.path.splitext(pyc)
+    return "{}.dialect-{}.pyc".format(base, dialect_name)
+
+_toolchain = None
+def toolchain():
+    """Return a description of the toolchain that produces the expanded code.
+
+    A cache entry made by a different toolchain is never used.
+    """
+    global _toolchain
+    if _toolchain is None:
+        from . import __version__ as dialects_version
+        try:
+            import macropy
+        except ImportError:
+            macropy_version = None
+        else:
+            macropy_version = getattr(macropy, "__version__", "unknown")
+        # Bytecode compatibility is covered by the magic number; the AST only
+        # changes between minor versions, so e.g. a wheel with precompiled
+        # modules remains valid across bugfix releases of Python.
+        _toolchain = (sys.version_info[:2], dialects_version, macropy_version)
+    return _toolchain
+
+# (path, mtime_ns, size) -> hex digest; each file version is hashed only once per process.
+_digests = {}
+
+def fingerprint(path, st=None):
+    """Return ``(mtime_ns, size, sha256)`` of the file ``path``.
+
+    ``st``: ``os.stat_result`` of ``path``, if already available.
+
+    Raises ``OSError`` if the file cannot be read.
+    """
+    if st is None:
+        st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    digest = _digests.get(key)
+    if digest is None:
+        import hashlib  # deferred, like ``tempfile``; not needed by programs that use no dialects
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        _digests[key] = digest
+    return (st.st_mtime_ns, st.st_size, digest)
+
+def _is_fresh(path, recorded, st=None):
+    """Return whether the file ``path`` still matches the ``recorded`` fingerprint."""
+    mtime, size, digest = recorded
+    try:
+        if st is None:
+            st = os.stat(path)
+        if (st.st_mtime_ns, st.st_size) == (mtime, size):
+            return True
+        return st.st_size == size and fingerprint(path, st)[2] == digest
+    except OSError:
+        return False
+
+def _module_is_fresh(dep):
+    """Return whether the recorded module dependency ``dep`` is still valid."""
+    name, path, recorded = dep
+    if os.path.exists(path):
+        return _is_fresh(path, recorded)
+    # The file has moved (e.g. the code was installed somewhere else after it
+    # was compiled), so look the module up by name, and compare contents.
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        return False
+    if spec is None or not spec.has_location:
+        return False
+    return _is_fresh(spec.origin, recorded)
+
+def module_dependency(module):
+    """Return the dependency record for the module object ``module``.
+
+    Return ``None`` if the module has no source file (e.g. a builtin).
+    """
+    path = getattr(module, "__file__", None)
+    if not path:
+        return None
+    try:
+        return (module.__name__, path, fingerprint(path))
+    except OSError:
+        return None
+
+def content_key(filename, dialect_name, fullname):
+    """Return a location-independent key for the entry for ``filename`` in dialect ``dialect_name``.
+
+    The key is the SHA-256 (as a hex string) of the toolchain, the source of
+    the dialect module, the source of the module itself, and its full name
+    ``fullname`` (the same source, e.g. with relative macro-imports, may
+    expand differently in another package). Return ``None`` if the files
+    cannot be read.
+    """
+    try:
+        source = fingerprint(filename)
+        spec = importlib.util.find_spec(dialect_name)
+        dialect = fingerprint(spec.origin) if spec is not None and spec.has_location else None
+    except (OSError, ImportError, ValueError):
+        return None
+    import hashlib
+    h = hashlib.sha256()
+    h.update(repr((toolchain(), dialect_name, dialect and dialect[2], fullname, source[2])).encode("utf-8"))
+    return h.hexdigest()
+
+class PycacheStore:
+    """Cache backend that stores each entry in ``__pycache__``, next to its source file.
+
+    This is the default backend.
+    """
+    def key(self, filename, dialect_name, fullname):
+        """Return the key of the entry for ``filename`` (module ``fullname``) in dialect ``dialect_name``, or ``None``."""
+        return cache_path(filename, dialect_name)
+
+    def get(self, key):
+        """Return the raw data of the entry ``key``, or ``None`` if there is no such entry."""
+        try:
+            with open(key, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key, data, mode):
+        """Atomically publish ``data`` as the entry ``key``, with file permissions ``mode``."""
+        _write_atomic(key, data, mode)
+
+class ContentStore:
+    """Content-addressed cache backend, in a directory of its own.
+
+    The key of an entry is a hash of the source and the full name of the module,
+    the source of the dialect module, and the toolchain, so the entry does not
+    depend on where the source file is. The same directory can thus be shared
+    by several processes, and even several machines (e.g. a volume mounted by
+    several nodes, or a cache baked into a container image at build time). The directory may be read-only;
+    then the cache is only read.
+
+    Entries are published atomically without locking, by renaming a complete
+    temporary file into place. The key does not cover the macro modules and
+    other dependencies (those are only known after expansion), so an entry
+    whose dependencies have changed is stale; it is replaced when the module
+    is compiled again. Whichever of several concurrent writers wins, readers
+    validate the dependencies of the entry they get.
+
+    ``max_size``: if given, the maximum total size of the cache, in bytes.
+    When exceeded, the least recently used entries are evicted. (Each hit
+    updates the mtime of the entry, which is used as the time of last use.)
+    """
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None  # running estimate of the total size
+
+    def key(self, filename, dialect_name, fullname):
+        return content_key(filename, dialect_name, fullname)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:  # read-only cache
+            pass
+        return data
+
+    def put(self, key, data, mode):
+        path = self._path(key)
+        try:
+            old_size = os.stat(path).st_size  # a stale entry, being replaced
+        except OSError:
+            old_size = 0
+        _write_atomic(path, data, mode)
+        if self.max_size is not None:
+            if self._size is None:
+                self._size = sum(size for path, size, mtime in self.entries())
+            else:
+                self._size += len(data) - old_size
+            if self._size > self.max_size:
+                # Leave some headroom, so that we won't need to evict at each write.
+                self._size = self.prune(max_size=int(0.9 * self.max_size))
+
+    def entries(self):
+        """Iterate over ``(path, size, mtime)`` of all entries in the cache."""
+        try:
+            subdirs = os.listdir(self.directory)
+        except OSError:
+            return
+        for subdir in subdirs:
+            subpath = os.path.join(self.directory, subdir)
+            if len(subdir) != 2 or not os.path.isdir(subpath):
+                continue
+            for fn in os.listdir(subpath):
+                if fn.startswith("."):  # temporary file of a writer
+                    continue
+                path = os.path.join(subpath, fn)
+                try:
+                    st = os.stat(path)
+                except OSError:  # evicted by someone else
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def prune(self, max_size=None, max_age=None):
+        """Evict entries from the cache.
+
+        ``max_size``: evict least recently used entries until the total size
+        in bytes is at most this.
+
+        ``max_age``: evict entries not used during this many seconds.
+
+        Also removes leftover temporary files of crashed writers.
+
+        Returns the total size of the remaining entries, in bytes.
+        """
+        now = time.time()
+        self._remove_stale_temporaries(now)
+        entries = sorted(self.entries(), key=lambda entry: entry[2], reverse=True)  # most recent first
+        total = 0
+        for path, size, mtime in entries:
+            if (max_age is not None and now - mtime > max_age) or \
+               (max_size is not None and total + size > max_size):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                continue
+            total += size
+        return total
+
+    def _remove_stale_temporaries(self, now, grace=3600):
+        try:
+            subdirs = os.listdir(self.directory)
+        except OSError:
+            return
+        for subdir in subdirs:
+            subpath = os.path.join(self.directory, subdir)
+            if not os.path.isdir(subpath):
+                continue
+            for fn in os.listdir(subpath):
+                path = os.path.join(subpath, fn)
+                try:
+                    if fn.startswith(".") and fn.endswith(".tmp") and now - os.stat(path).st_mtime > grace:
+                        os.unlink(path)
+                except OSError:
+                    pass
+
+class PackStore:
+    """Content-addressed cache backend that keeps all entries in a single pack file.
+
+    With one file per module, a cold start performs thousands of small file
+    lookups. A pack file is opened once; the index is memory-mapped, so
+    a lookup is a hash probe into the mapping, and a hit is handed to
+    ``marshal.loads`` directly from the mapped buffer, without copying.
+
+    Keys are the same as for ``ContentStore``. The file layout is::
+
+        header: magic (8 bytes), number of index slots (uint64), reserved (16 bytes)
+        index:  slots, each: SHA-256 key (32 bytes), offset (uint64), length (uint64)
+        data:   the entries, back to back
+
+    The index is an open-addressing hash table with linear probing; an all-zero
+    key marks an empty slot. New entries are appended to the end of the file,
+    and then entered into the index (key last, so that lock-free readers never
+    see a half-written slot). A stale entry (see ``ContentStore``) is replaced
+    by appending the new data, and then pointing its slot to it; the old data
+    remains in the file until the pack is compacted. Writers serialize on an ``fcntl`` lock of the
+    pack file. When the index becomes too full, new entries are not stored
+    until the pack is compacted (see ``compact``), which is an offline
+    operation (no other process may be writing to the pack meanwhile).
+
+    ``slots``: number of index slots for a newly created pack file.
+    """
+    _magic = b"PYDPACK\x01"
+    _header = struct.Struct("<8sQ16x")
+    _slot = struct.Struct("<32sQQ")
+    _max_load = 0.75
+
+    def __init__(self, path, slots=4096):
+        self.path = path
+        self.slots = slots
+        self._map = None
+        self._nslots = None
+
+    def key(self, filename, dialect_name, fullname):
+        return content_key(filename, dialect_name, fullname)
+
+    def __getstate__(self):
+        # The mapping can't be pickled (e.g. to send the backend to worker processes);
+        # the copy maps the file again when first used.
+        state = dict(self.__dict__)
+        state["_map"] = state["_nslots"] = None
+        return state
+
+    def _open(self, size=0):
+        """Map the pack file (again, if it has grown past ``size``). Return the mapping or ``None``."""
+        if self._map is not None and len(self._map) >= size:
+            return self._map
+        try:
+            with open(self.path, "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):  # missing or empty file
+            return None
+        magic, nslots = self._header.unpack_from(m, 0)
+        if magic != self._magic:
+            logger.warning("%s is not a Pydialect pack file, ignoring", self.path)
+            return None
+        # We never close the old mapping; memoryviews into it may still be alive.
+        self._map, self._nslots = m, nslots
+        return m
+
+    @classmethod
+    def _probe(cls, buf, nslots, digest):
+        """Find ``digest`` in the index in ``buf``.
+
+        Return ``(slot_offset, offset, length)``; ``offset`` is ``None`` if the
+        key is not present, and then ``slot_offset`` is the first empty slot
+        (``None`` if the index is full).
+        """
+        empty = bytes(32)
+        i = int.from_bytes(digest[:8], "little") % nslots
+        for _ in range(nslots):
+            pos = cls._header.size + i * cls._slot.size
+            k, offset, length = cls._slot.unpack_from(buf, pos)
+            if k == digest:
+                return pos, offset, length
+            if k == empty:
+                return pos, None, None
+            i = (i + 1) % nslots
+        return None, None, None
+
+    def get(self, key):
+        m = self._open()
+        if m is None:
+            return None
+        _, offset, length = self._probe(m, self._nslots, bytes.fromhex(key))
+        if offset is None:
+            return None
+        m = self._open(offset + length)  # appended after we mapped the file?
+        if m is None or offset + length > len(m):
+            return None
+        return memoryview(m)[offset:offset + length]
+
+    def put(self, key, data, mode):
+        digest = bytes.fromhex(key)
+        if not os.path.exists(self.path):
+            self._create(self.path, self.slots, mode)
+        with open(self.path, "r+b") as f:
+            _lock(f)
+            index = f.read(self._header.size)
+            magic, nslots = self._header.unpack(index)
+            if magic != self._magic:
+                return
+            index += f.read(nslots * self._slot.size)
+            count = sum(1 for i in range(nslots)
+                        if self._slot.unpack_from(index, self._header.size + i * self._slot.size)[0] != bytes(32))
+            slot, offset, length = self._probe(index, nslots, digest)
+            replace = offset is not None  # a stale entry
+            if not replace and (slot is None or count + 1 > self._max_load * nslots):
+                logger.info("Index of pack file %s is full; compact it to add entries", self.path)
+                return
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            # A reader racing with the replacement of an entry may see the new offset
+            # with the old length, or vice versa; ``load`` then finds the entry corrupt
+            # or stale, i.e. at worst it is a miss.
+            f.seek(slot + 32)
+            f.write(struct.pack("<QQ", offset, len(data)))
+            f.flush()
+            if not replace:
+                f.seek(slot)
+                f.write(digest)
+                f.flush()
+            # the lock is released when the file is closed
+
+    @classmethod
+    def _create(cls, path, nslots, mode, entries=()):
+        """Atomically create a pack file at ``path``, containing ``entries``.
+
+        ``entries``: iterable of ``(digest, data)``.
+
+        If the file already exists (e.g. created concurrently), it is left alone,
+        unless ``entries`` is given, in which case it is replaced.
+        """
+        index = bytearray(cls._header.size + nslots * cls._slot.size)
+        cls._header.pack_into(index, 0, cls._magic, nslots)
+        blobs = []
+        offset = len(index)
+        for digest, data in entries:
+            slot, _, _ = cls._probe(index, nslots, digest)
+            cls._slot.pack_into(index, slot, digest, offset, len(data))
+            blobs.append(data)
+            offset += len(data)
+        dirname = os.path.dirname(path) or "."
+        os.makedirs(dirname, exist_ok=True)
+        import tempfile
+        fd, tmppath = tempfile.mkstemp(dir=dirname, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                os.chmod(tmppath, mode)
+                f.write(index)
+                for data in blobs:
+                    f.write(data)
+            if blobs:
+                os.replace(tmppath, path)
+            else:
+                try:
+                    os.link(tmppath, path)  # fails if someone else created it first
+                except FileExistsError:
+                    pass
+                os.unlink(tmppath)
+        except BaseException:
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+            raise
+
+    def compact(self, slots=None):
+        """Rewrite the pack file, dropping unusable entries and resizing the index.
+
+        Entries made by a different toolchain (e.g. after a Python upgrade)
+        are dropped, as is the old data of replaced entries. ``slots``: size of the new index; by default, enough for
+        twice the number of remaining entries.
+
+        This is an offline operation; no other process may write to the pack meanwhile.
+
+        Returns the number of entries in the new pack.
+        """
+        m = self._open()
+        if m is None:
+            return 0
+        entries = []
+        for i in range(self._nslots):
+            digest, offset, length = self._slot.unpack_from(m, self._header.size + i * self._slot.size)
+            if digest == bytes(32):
+                continue
+            data = bytes(m[offset:offset + length])
+            if _entry_toolchain(data) == toolchain():
+                entries.append((digest, data))
+        nslots = slots or max(self.slots, 2 * len(entries))
+        mode = os.stat(self.path).st_mode & 0o666
+        self._create(self.path, nslots, mode, entries)
+        self._map = None
+        return len(entries)
+
+def _lock(f):
+    """Take an exclusive lock on the open file ``f`` until it is closed (no-op if unsupported)."""
+    try:
+        import fcntl
+    except ImportError:  # not POSIX
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+def _entry_toolchain(data):
+    """Return the toolchain recorded in the raw cache entry ``data``, or ``None`` if unreadable."""
+    if data[:len(_MAGIC)] != _MAGIC:
+        return None
+    try:
+        return marshal.loads(data[len(_MAGIC):])[0]
+    except (EOFError, ValueError, TypeError, IndexError):
+        return None
+
+def _default_backend():
+    """Create the cache backend specified by the environment.
+
+    ``PYDIALECT_CACHE_PACK``: use a ``PackStore`` in this file instead of ``__pycache__``.
+
+    ``PYDIALECT_CACHE_DIR``: use a ``ContentStore`` in this directory instead of ``__pycache__``.
+
+    ``PYDIALECT_CACHE_SIZE``: maximum size of the ``ContentStore``, in bytes
+    (suffixes ``K``, ``M``, ``G`` are accepted).
+    """
+    pack = os.environ.get("PYDIALECT_CACHE_PACK")
+    if pack:
+        return PackStore(pack)
+    directory = os.environ.get("PYDIALECT_CACHE_DIR")
+    if not directory:
+        return PycacheStore()
+    max_size = os.environ.get("PYDIALECT_CACHE_SIZE")
+    return ContentStore(directory, parse_size(max_size) if max_size else None)
+
+def parse_size(text):
+    """Parse a size in bytes, such as ``"500M"``."""
+    text = text.strip().upper()
+    multipliers = {"K": 2**10, "M": 2**20, "G": 2**30}
+    if text and text[-1] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(text)
+
+# The cache backend in use. Can be replaced at run time, e.g.
+#   dialects.cache.backend = dialects.cache.ContentStore("/var/cache/myapp", max_size=2**30)
+backend = _default_backend()
+
+def load(filename, dialect_name, fullname):
+    """Return the cached code object for ``filename`` (module ``fullname``), or ``None`` on a miss.
+
+    A stale entry (changed source, dependency or toolchain) counts as a miss.
+    """
+    key = backend.key(filename, dialect_name, fullname)
+    if key is None:
+        return None
+    data = backend.get(key)
+    if data is None:
+        return None
+    if data[:len(_MAGIC)] != _MAGIC:
+        logger.debug("Bad magic in cache entry %s, ignoring", key)
+        return None
+    try:
+        tools, source, deps, code = marshal.loads(data[len(_MAGIC):])
+    except (EOFError, ValueError, TypeError):
+        logger.debug("Corrupt cache entry %s, ignoring", key)
+        return None
+    if tools != toolchain():
+        logger.debug("Cache entry %s made by a different toolchain", key)
+        return None
+    if not _is_fresh(filename, source):
+        return None
+    for dep in deps:
+        if not _module_is_fresh(dep):
+            logger.info("Dependency '%s' of %s has changed", dep[0], filename)
+            return None
+    if code.co_filename != filename:  # compiled elsewhere (shared cache, or moved tree)
+        code = _relocate(code, filename)
+    return code
+
+def _relocate(code, filename):
+    """Return ``code`` with ``co_filename`` set to ``filename``, recursively.
+
+    Requires Python 3.8+ (``code.replace``); on older Pythons, ``code`` is
+    returned as-is, and tracebacks will show the filename it was compiled from.
+    """
+    if not hasattr(code, "replace"):
+        return code
+    consts = tuple(_relocate(c, filename) if isinstance(c, type(code)) else c
+                   for c in code.co_consts)
+    return code.replace(co_filename=filename, co_consts=consts)
+
+def store(filename, dialect_name, fullname, code, source_stat, modules):
+    """Save the code object ``code`` for ``filename`` (module ``fullname``) into the cache.
+
+    ``source_stat``: ``os.stat_result`` of the source file, taken **before**
+    the source was read, so that a file modified while being compiled is not
+    mistaken as up to date.
+
+    ``modules``: iterable of module objects the expanded code depends on,
+    such as the dialect module and the macro modules.
+
+    Failures (e.g. a read-only filesystem) are logged and otherwise ignored.
+    """
+    if sys.dont_write_bytecode:
+        return
+    try:
+        source = fingerprint(filename)
+    except OSError:
+        return
+    if source[:2] != (source_stat.st_mtime_ns, source_stat.st_size):
+        logger.debug("Source file %s changed while compiling, not caching", filename)
+        return
+    key = backend.key(filename, dialect_name, fullname)
+    if key is None:
+        return
+    deps = {}
+    for module in modules:
+        dep = module_dependency(module)
+        if dep is not None:
+            deps[dep[0]] = dep
+    deps = tuple(deps[name] for name in sorted(deps))
+    data = _MAGIC + marshal.dumps((toolchain(), source, deps, code))
+    try:
+        backend.put(key, data, source_stat.st_mode & 0o666)
+    except OSError as err:
+        logger.debug("Could not write cache entry %s: %s", key, err)
+
+def _write_atomic(path, data, mode=0o644):
+    """Write ``data`` into ``path`` atomically.
+
+    The data goes into a temporary file in the same directory, which is then
+    renamed over ``path``. Readers thus see either the old or the new complete
+    file, never a partially written one.
+
+    ``mode``: permission bits for the new file (like ``.pyc`` files, we use those
+    of the source file).
+    """
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, exist_ok=True)
+    import tempfile
+    fd, tmppath = tempfile.mkstemp(dir=dirname, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.chmod(tmppath, mode)
+            f.write(data)
+        os.replace(tmppath, path)
+    except BaseException:
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+        raise
+
+def main():
+    """Command-line interface for managing a ``ContentStore`` or a ``PackStore``."""
+    import argparse
+    parser = argparse.ArgumentParser(description="""Manage a Pydialect compile cache directory or pack file.""")
+    subparsers = parser.add_subparsers(dest="command")
+    prune = subparsers.add_parser("prune", help="evict least recently used entries")
+    prune.add_argument(dest="directory", type=str, metavar="dir",
+                       help="cache directory (default: $PYDIALECT_CACHE_DIR)", nargs="?",
+                       default=os.environ.get("PYDIALECT_CACHE_DIR"))
+    prune.add_argument("--max-size", dest="max_size", type=parse_size, default=None, metavar="size",
+                       help="evict until at most this many bytes (suffixes K, M, G accepted)")
+    prune.add_argument("--max-age", dest="max_age", type=float, default=None, metavar="days",
+                       help="evict entries not used during this many days")
+    compact = subparsers.add_parser("compact", help="compact a pack file")
+    compact.add_argument(dest="packfile", type=str, metavar="packfile",
+                         help="pack file (default: $PYDIALECT_CACHE_PACK)", nargs="?",
+                         default=os.environ.get("PYDIALECT_CACHE_PACK"))
+    compact.add_argument("--slots", dest="slots", type=int, default=None, metavar="n",
+                         help="number of index slots (default: twice the number of entries)")
+    opts = parser.parse_args()
+
+    if opts.command == "compact" and opts.packfile:
+        n = PackStore(opts.packfile).compact(slots=opts.slots)
+        print("{}: {} entries".format(opts.packfile, n))
+        return
+    if opts.command != "prune" or not opts.directory:
+        parser.print_help()
+        sys.exit(2)
+    max_age = opts.max_age * 86400 if opts.max_age is not None else None
+    total = ContentStore(opts.directory).prune(max_size=opts.max_size, max_age=max_age)
+    print("{}: {} bytes in cache".format(opts.directory, total))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Export dialect modules as plain Python source.
+
+Runs the import-time pipeline (source transform, AST transform, macro
+expansion) on each dialect module in a source tree, and writes the final AST
+back out as Python source, into a mirror tree. Other files are copied as-is.
+The lang-import has become the ``__lang__`` assignment, so the exported tree
+runs under plain ``python3``: no ``dialects.activate``, no MacroPy import
+hook, and no source scanning at import time. (Any run-time libraries the
+expanded code refers to, such as ``unpythonic``, are of course still needed.)
+
+For each exported dialect module ``mod.py``, a line map ``mod.py.linemap.json``
+is written next to it, mapping the lines of the exported source back to the
+lines of the original source::
+
+    {"source": "/path/to/original/mod.py",
+     "lines": [1, 1, 3, null, ...]}
+
+where item ``k`` is the original line number of line ``k + 1`` of the exported
+file (``null`` if not known).
+
+Usage::
+
+    python3 -m dialects.export -o OUTDIR path...
+
+Each path (a directory or a file) is mirrored into ``OUTDIR`` under its own name.
+
+Requires Python 3.9+ (``ast.unparse``), or MacroPy (``macropy.core.unparse``).
+"""
+
+__all__ = ["export_module", "export"]
+
+import ast
+import importlib.util
+import json
+import os
+import shutil
+import sys
+
+from .precompile import find_modules
+
+def _unparse(tree):
+    """Convert the AST ``tree`` to source code."""
+    if hasattr(ast, "unparse"):  # Python 3.9+
+        return ast.unparse(tree)
+    try:
+        from macropy.core import unparse
+    except ImportError:
+        raise ImportError("exporting needs ast.unparse (Python 3.9+) or MacroPy") from None
+    return unparse(tree)
+
+def _statements(tree):
+    """Iterate over the statement nodes in ``tree``.
+
+    The order is breadth-first; what matters is that it is the same for two
+    trees that have the same structure.
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.stmt):
+            yield node
+
+def make_linemap(tree, source):
+    """Map the lines of ``source``, unparsed from ``tree``, back to the line numbers in ``tree``.
+
+    Returns a list, where item ``k`` is the line number in ``tree`` that
+    corresponds to line ``k + 1`` of ``source``, or ``None`` if not known.
+    Lines inside a multi-line statement map to the line of that statement.
+    """
+    nlines = source.count("\n") + 1
+    lines = [None] * nlines
+    # The unparsed source has the same statement structure as the tree it came from.
+    for new, old in zip(_statements(ast.parse(source)), _statements(tree)):
+        if type(new) is not type(old):
+            break
+        k = new.lineno - 1
+        if lines[k] is None:
+            lines[k] = getattr(old, "lineno", None)
+    for k in range(1, nlines):  # continuation lines
+        if lines[k] is None:
+            lines[k] = lines[k - 1]
+    return lines
+
+def export_module(fullname, filename, outfile):
+    """Export the module ``fullname`` (source file ``filename``) as plain Python into ``outfile``.
+
+    If the module does not use a dialect, it is copied as-is.
+
+    Returns the name of the dialect, or ``None`` if the module does not use one.
+    """
+    from .importer import DialectFinder
+    is_package = os.path.basename(filename) == "__init__.py"
+    locations = [os.path.dirname(filename)] if is_package else None
+    spec = importlib.util.spec_from_file_location(fullname, filename,
+                                                  submodule_search_locations=locations)
+    result = DialectFinder.expand_module(spec)
+    os.makedirs(os.path.dirname(outfile) or ".", exist_ok=True)
+    if result is None:
+        shutil.copy2(filename, outfile)
+        return None
+    dialect_name, code, tree = result
+    source = _unparse(tree)
+    header = "# Generated by Pydialect from {} (dialect '{}'). Do not edit.\n".format(filename, dialect_name)
+    with open(outfile, "w", encoding="utf-8") as f:
+        f.write(header)
+        f.write(source)
+        f.write("\n")
+    linemap = [None] + make_linemap(tree, source)  # the header line has no counterpart
+    with open(outfile + ".linemap.json", "w", encoding="utf-8") as f:
+        json.dump({"source": filename, "lines": linemap}, f)
+    return dialect_name
+
+def export(paths, outdir, verbose=True, file=None):
+    """Export the source trees ``paths`` into ``outdir``.
+
+    Each path is a directory or a single file, which is mirrored into
+    ``outdir`` under its own name (e.g. ``src/mypackage`` is exported as
+    ``outdir/mypackage``). Everything but ``__pycache__`` is copied; dialect
+    modules are expanded.
+
+    Returns the number of modules that failed to export.
+    """
+    file = file or sys.stdout
+    for _, _, root in find_modules(paths):  # the dialect and macro modules must be importable
+        if root not in sys.path:
+            sys.path.insert(0, root)
+    import dialects.activate  # dialect and macro modules may themselves use dialects and macros
+    dialects.activate._activate_macropy()
+
+    fails = 0
+    for path in paths:
+        base = os.path.dirname(os.path.abspath(path))
+        if os.path.isdir(path):
+            files = []
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = sorted(d for d in dirnames if not d.startswith(".") and d != "__pycache__")
+                files.extend(os.path.join(dirpath, fn) for fn in sorted(filenames))
+        else:
+            files = [path]
+        for filename in files:
+            outfile = os.path.join(outdir, os.path.relpath(os.path.abspath(filename), base))
+            if not filename.endswith(".py"):
+                os.makedirs(os.path.dirname(outfile), exist_ok=True)
+                shutil.copy2(filename, outfile)
+                continue
+            (fullname, filename, _), = find_modules([filename])
+            try:
+                dialect_name = export_module(fullname, filename, outfile)
+            except Exception as err:
+                fails += 1
+                print("FAILED    {} ({}): {}: {}".format(fullname, filename, type(err).__name__, err), file=file)
+                continue
+            if verbose and dialect_name:
+                print("exported  {} ({}) -> {}".format(fullname, dialect_name, outfile), file=file)
+    return fails
+
+def main():
+    """Handle command-line arguments and run the exporter."""
+    import argparse
+    parser = argparse.ArgumentParser(description="""Export Pydialect dialect modules as plain Python source.""")
+    parser.add_argument(dest='paths', nargs='+', type=str, metavar='path',
+                        help='directory (mirrored recursively) or .py file')
+    parser.add_argument('-o', '--output', dest='outdir', type=str, required=True, metavar='dir',
+                        help='output directory')
+    parser.add_argument('-q', '--quiet', dest='verbose', action="store_false", default=True,
+                        help='report only failures')
+    opts = parser.parse_args()
+    fails = export(opts.paths, opts.outdir, verbose=opts.verbose)
+    sys.exit(1 if fails else 0)
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,168 @@
 # -*- coding: utf-8 -*-
 """Importer for Python dialects."""
 
-__all__ = ["DialectFinder"]
+__all__ = ["DialectFinder", "detect_dialect"]
 
-import ast
 import importlib
 from importlib.util import spec_from_loader
 import logging
+import mmap
+import os
 import sys
 import re
+import threading
 
-try:
-    import macropy.core
-except ImportError:
-    macropy = None
+from . import cache
 
 logger = logging.getLogger(__name__)
 
-# This is essentially a copy of ``macropy.core.import_hooks.MacroLoader``, copied to
+# Detecting the lang-import.
+#
+# The lang-import may only be preceded by the module docstring (and comments),
+# so whether a module uses a dialect can be decided by looking at the start of
+# the file. We do this at the bytes level, so that the sources of modules that
+# do not use a dialect never need to be read in full, or decoded.
+#
+# The header (docstring and lang-import) of a dialect module must be valid
+# standard Python, because we only rely on the literal text "from __lang__ import xxx".
+# Anything fancier than a plain string literal as the docstring (which is legal
+# Python, but unusual) makes the detector give up, and the caller falls back to
+# scanning the full source text.
+
+_DETECT_PREFIX_SIZE = 8192  # bytes; read this much first, mmap the file if it's not enough
+_UNDECIDED = object()  # sentinel: the detector could not decide, scan the full source
+_NEED_MORE = object()  # sentinel: the header extends past the end of the prefix that was read
+
+_blank_lines = re.compile(rb"(?:[ \t\f]*(?:#[^\r\n]*)?(?:\r\n|\r|\n))*[ \t\f]*")
+_string_start = re.compile(rb"[rRuU]?(\"\"\"|\'\'\'|\"|\')")
+_string_ends = {b'"""': re.compile(rb'(?:[^"\\]|\\.|"(?!""))*"""', re.DOTALL),
+                b"'''": re.compile(rb"(?:[^'\\]|\\.|'(?!''))*'''", re.DOTALL),
+                b'"': re.compile(rb'(?:[^"\\\r\n]|\\.)*"', re.DOTALL),
+                b"'": re.compile(rb"(?:[^'\\\r\n]|\\.)*'", re.DOTALL)}
+_rest_of_line = re.compile(rb"[ \t\f]*(?:#[^\r\n]*)?(?:\r\n|\r|\n)")
+_lang_import_text = "from __lang__ import"
+_lang_name = re.compile(rb"\s+([0-9a-zA-Z_]+)[ \t\f]*(?:\r\n|\r|\n|\Z)")
+
+def _scan_header(buf, complete):
+    """Find the dialect name in the header of the module source ``buf`` (bytes-like).
+
+    ``complete``: whether ``buf`` contains the whole file, or just a prefix of it.
+
+    Return the dialect name, ``None`` if the module does not use a dialect,
+    ``_UNDECIDED`` if the header is too unusual for us to parse, or
+    ``_NEED_MORE`` if ``buf`` is an incomplete prefix that ends too early.
+    """
+    def need_more_or(result, pos):  # past the end of an incomplete prefix, we can't tell yet
+        return _NEED_MORE if not complete and pos >= len(buf) else result
+    def line_ends_after(pos):
+        return buf.find(b"\n", pos) != -1 or buf.find(b"\r", pos) != -1
+    pos = 3 if buf[:3] == b"\xef\xbb\xbf" else 0  # UTF-8 BOM
+    pos = _blank_lines.match(buf, pos).end()
+    if buf[pos:pos + 1] == b"#":  # a comment at the end of the buffer
+        return need_more_or(None, len(buf))
+    m = _string_start.match(buf, pos)
+    if m:  # module docstring
+        end = _string_ends[m.group(1)].match(buf, m.end())
+        if not end:  # unterminated, or maybe just not all read yet
+            return need_more_or(_UNDECIDED, len(buf))
+        eol = _rest_of_line.match(buf, end.end())
+        if not eol:  # something else after the string on the same line
+            return need_more_or(_UNDECIDED, len(buf) if not line_ends_after(end.end()) else 0)
+        pos = _blank_lines.match(buf, eol.end()).end()
+    if pos >= len(buf) or buf[pos:pos + 1] == b"#":  # EOF, or a comment at EOF
+        return need_more_or(None, len(buf))
+    lang_import = b"from __lang__ import"
+    if buf[pos:pos + len(lang_import)] != lang_import:
+        if not lang_import.startswith(bytes(buf[pos:pos + len(lang_import)])):
+            return None
+        return need_more_or(None, pos + len(lang_import))
+    m = _lang_name.match(buf, pos + len(lang_import))
+    if not complete and (not m or m.group(0)[-1:] not in (b"\r", b"\n")) and not line_ends_after(pos):
+        return _NEED_MORE
+    if not m:
+        msg = "Expected exactly one lang-import with one dialect name"
+        logger.error(msg)
+        raise SyntaxError(msg)
+    return m.group(1).decode("ascii")
+
+def detect_dialect(filename):
+    """Return the name of the dialect the module source file ``filename`` uses.
+
+    Return ``None`` if it does not use a dialect. Only the start of the file
+    is read; large files are memory-mapped, so that only the pages covering
+    the header are actually touched.
+
+    If the header is too unusual to be decided at the bytes level, return the
+    special value ``dialects.importer._UNDECIDED``; the caller should then
+    check the full source text.
+
+    Raise ``SyntaxError`` if the lang-import is malformed.
+    """
+    with open(filename, "rb") as f:
+        prefix = f.read(_DETECT_PREFIX_SIZE)
+        complete = len(prefix) < _DETECT_PREFIX_SIZE
+        result = _scan_header(prefix, complete)
+        if result is not _NEED_MORE:
+            return result
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return _scan_header(buf, complete=True)
+
+# This started as a copy of ``macropy.core.import_hooks.MacroLoader``, copied to
 # make sure that the implementation won't go out of sync with our ``DialectFinder``.
 # The export machinery has been removed as unnecessary for language experimentation;
 # but is trivial to add back if needed (see the sources of MacroPy 1.1.0b2).
+#
+# Unlike MacroLoader, the loader does the expensive part: the import-time pipeline
+# (source transform, AST transform, macro expansion, compilation) runs lazily, on
+# the first ``get_code`` (which ``exec_module`` calls), not when the module is found.
 class DialectLoader:
-    def __init__(self, nomacro_spec, code, tree):
+    def __init__(self, nomacro_spec, dialect_name, source=None, source_stat=None):
         self.nomacro_spec = nomacro_spec
-        self.code = code
-        self.tree = tree
+        # The pydialect bootstrapper renames the spec (and sets ``self.name``) to
+        # "__main__"; the pipeline needs the module's real name.
+        self.fullname = nomacro_spec.name
+        self.dialect_name = dialect_name
+        self.source = source  # if already read by the finder
+        self.source_stat = source_stat  # of the source file, taken before reading ``source``
+        self.code = None
+        self.tree = None
 
     def create_module(self, spec):
         pass
 
     def exec_module(self, module):
-        exec(self.code, module.__dict__)
+        code = self.get_code(self.fullname)
+        if not DialectFinder.retain_trees:
+            # The loader stays reachable via ``module.__spec__.loader`` for the life
+            # of the process, and the expanded AST is typically many times larger
+            # than the source. If needed later, see ``get_tree``.
+            self.code = self.tree = None
+        DialectFinder._release_compiled(self, code)
+        exec(code, module.__dict__)
+
+    def get_code(self, fullname):
+        if self.code is None:
+            self.code, self.tree = DialectFinder.load_code(self)
+            self.source = None
+        return self.code
+
+    def get_tree(self, fullname):
+        """Return the final AST of the module (after the dialect transforms and macro expansion).
+
+        The tree is kept after the module is executed only if
+        ``DialectFinder.retain_trees`` is set; otherwise (and if the module
+        was loaded from the compile cache) it is expanded again on demand.
+        """
+        if self.tree is not None:
+            return self.tree
+        result = DialectFinder.expand_module(self.nomacro_spec)
+        tree = result[2] if result is not None else None
+        if DialectFinder.retain_trees:
+            self.tree = tree
+        return tree
+
+    def get_source(self, fullname):
+        return self.nomacro_spec.loader.get_source(self.fullname)
 
     def get_filename(self, fullname):
         return self.nomacro_spec.loader.get_filename(fullname)
@@ -39,7 +170,86 @@ class DialectLoader:
     def is_package(self, fullname):
         return self.nomacro_spec.loader.is_package(fullname)
 
+# MacroPy is loaded on demand, on the first expansion that needs it, so that
+# programs whose imports are all cache hits (or pure source transforms) never
+# pay for importing it.
+_macropy = None
+def _load_macropy():
+    """Import and return ``macropy.core``, or ``None`` if MacroPy is not installed."""
+    global _macropy
+    if _macropy is None:
+        try:
+            import macropy.core.macros
+            _macropy = macropy.core
+        except ImportError:
+            _macropy = False
+    return _macropy or None
+
+def _macro_finder():
+    """Return MacroPy's import hook, or ``None`` if MacroPy has not been loaded.
+
+    This does not import MacroPy; if it has not been loaded, its import hook
+    cannot be in ``sys.meta_path``.
+    """
+    import_hooks = sys.modules.get("macropy.core.import_hooks")
+    return getattr(import_hooks, "MacroFinder", None)
+
+def _has_macro_imports(body):
+    """Return whether the module body ``body`` has MacroPy macro imports (``from foo import macros, ...``)."""
+    import ast
+    return any(type(stmt) is ast.ImportFrom and stmt.names[0].name == "macros" for stmt in body)
+
+def _macro_implementation_modules(module):
+    """Return the modules the macros exported by the macro module ``module`` depend on.
+
+    Often a macro module just re-exports macros implemented elsewhere, and
+    the functions registered as macros are thin wrappers around the actual
+    syntax transformers (e.g. ``unpythonic.syntax``). So besides the modules
+    where the registered functions are defined, if the macro module (or such
+    a module) is a package, all of its submodules that are loaded are included.
+    """
+    registry = getattr(module, "macros", None)
+    out = []
+    def add(impl):
+        if impl is module or impl in out:
+            return
+        out.append(impl)
+    for kind in ("expr", "block", "decorator"):
+        # In MacroPy 1.1, these are ``Macros.Registry`` objects, each holding a dict.
+        for f in getattr(getattr(registry, kind, None), "registry", {}).values():
+            impl = sys.modules.get(getattr(f, "__module__", None))
+            if impl is not None:
+                add(impl)
+    for package in [module] + out:
+        if hasattr(package, "__path__"):
+            prefix = package.__name__ + "."
+            for name, submodule in list(sys.modules.items()):
+                if name.startswith(prefix) and submodule is not None:
+                    add(submodule)
+    return out
+
 # barebones unpythonic.misc.call but let's not depend on a library we don't otherwise need
+# Deciding whether to install MacroPy's import hook on demand (see ``DialectFinder._nondialect_result``),
+# a non-dialect module is scanned for macros only this far (bytes); and not at all if it is in
+# the standard library, which does not use MacroPy.
+_MACRO_SCAN_SIZE = 65536
+_stdlib_dirs = None  # (stdlib directories, site-packages directories), looked up when first needed
+
+def _in_stdlib(filename):
+    """Return whether the file ``filename`` is in the standard library (and not in site-packages)."""
+    global _stdlib_dirs
+    if _stdlib_dirs is None:
+        _stdlib_dirs = ((), ())  # meanwhile; importing ``sysconfig`` (and its data) comes back here
+        import sysconfig
+        paths = sysconfig.get_paths()
+        def dirs(*names):
+            return tuple({os.path.join(os.path.normcase(os.path.abspath(paths[name])), "")
+                          for name in names if name in paths})
+        _stdlib_dirs = (dirs("stdlib", "platstdlib"), dirs("purelib", "platlib"))
+    stdlib, site = _stdlib_dirs
+    filename = os.path.normcase(filename)
+    return filename.startswith(stdlib) and not filename.startswith(site)
+
 def singleton(cls):
     return cls()
 
@@ -49,27 +259,77 @@ def singleton(cls):
 #   inside standard-ish Python modules that can be found/loaded using the
 #   standard mechanisms.
 #
-# - Macro expansion is performed already at the finder step, because in order to
-#   detect whether to use the macro loader, the input must be scanned for macros.
-#   We could dispatch to a custom loader immediately after detecting that the
-#   module uses a dialect, but have chosen to just inherit this design.
+# Unlike MacroPy's MacroFinder, the finder only detects whether the module uses
+# a dialect, and dispatches to our loader; macro expansion is performed by the
+# loader. So merely finding a module (``importlib.util.find_spec``, test
+# collection, IDE probes) is cheap.
+#
+# Unlike MacroPy's MacroFinder, when the module turns out not to use a dialect,
+# we hand the spec we already found back to the import system, so that the
+# standard finders don't have to search the path again. This is only done when
+# none of the finders we skipped would have wanted to process the module.
+# We also remember modules already known not to use a dialect, and whether they
+# mention macros (for the rest of the session, as long as the source file is not
+# modified), so that repeated lookups (reloads, ``importlib.util.find_spec``
+# probes) need not read the source.
 
 @singleton
 class DialectFinder:
     """Importer that matches any module that has a 'from __lang__ import xxx'."""
 
+    def __init__(self):
+        # (fullname, origin, mtime) -> whether the source of this non-dialect module mentions
+        # macros (``None`` if not scanned yet); see ``_nondialect_result``
+        self._nondialect = {}
+        # Dialect modules in these packages are loaded lazily; see ``dialects.activate.lazy_load``.
+        self.lazy_packages = set()
+        # Install MacroPy's import hook when first needed; see ``dialects.activate.lazy_macropy``.
+        self.macropy_on_demand = False
+        # (fullname, origin, dialect_name) -> ((mtime_ns, size), code): modules compiled (or
+        # loaded from the cache, or sent by a worker process) in this process, and not executed
+        # yet. Shared by all threads; loading such a module costs a stat and a dictionary lookup.
+        # The entry is dropped when the module is executed; see ``_release_compiled``.
+        self._compiled = {}
+        # fullname -> lock, so that concurrent imports of a module compile it only once.
+        self._compile_locks = {}
+        self._compile_locks_lock = threading.Lock()
+        # Whether loaders keep the final AST of a dialect module after executing it;
+        # for debugging and introspection (see ``DialectLoader.get_tree``).
+        self.retain_trees = False
+        # Compiles the imports of dialect modules in the background; see ``dialects.activate.prefetch``.
+        self.prefetcher = None
+        # Expand the modules of dialects that support it one top-level statement at a time,
+        # reusing unchanged statements on re-expansion. For development; see ``dialects.incremental``.
+        self.incremental = False
+
+    def _is_lazy(self, fullname):
+        """Return whether the dialect module ``fullname`` should be loaded lazily."""
+        parts = fullname.split(".")
+        return any(".".join(parts[:k]) in self.lazy_packages for k in range(1, len(parts) + 1))
+
+    def _dialect_spec(self, fullname, loader):
+        """Make the spec for a dialect module, wrapping its loader in a ``LazyLoader`` if configured."""
+        spec = spec_from_loader(fullname, loader)
+        if self._is_lazy(fullname):
+            # Made from the DialectLoader, so that the spec gets the origin and
+            # package information, which LazyLoader does not provide.
+            from importlib.util import LazyLoader  # Python 3.5+
+            spec.loader = LazyLoader(loader)
+        return spec
+
     def _find_spec_nomacro(self, fullname, path, target=None):
         """Try to find the original, non macro-expanded module using all the
         remaining meta_path finders (except MacroPy's, to avoid handling
         macros twice).
         """
         spec = None
+        macro_finder = _macro_finder()
         for finder in sys.meta_path:
             # when testing with pytest, it installs a finder that for
             # some yet unknown reasons makes macros expansion
             # fail. For now it will just avoid using it and pass to
             # the next one
-            if finder is self or (macropy and finder is macropy.core.import_hooks.MacroFinder) or \
+            if finder is self or (macro_finder and finder is macro_finder) or \
                'pytest' in finder.__module__:
                 continue
             if hasattr(finder, 'find_spec'):
@@ -80,17 +340,122 @@ class DialectFinder:
                 break
         return spec
 
-    def expand_macros(self, source_code, filename, fullname, spec, lang_module):
+    def _nondialect_result(self, spec, key, source=None):
+        """Return what ``find_spec`` should return for the non-dialect module ``spec``.
+
+        That is ``spec`` itself, so that the standard finders need not search the
+        path again, unless one of the finders skipped by ``_find_spec_nomacro``
+        would process the module; then ``None``, to let the import system ask it.
+        This is decided at each lookup, since it depends on the finders currently
+        in ``sys.meta_path``.
+
+        The MacroPy finder only cares about modules that mention macros (see
+        ``_mentions_macros``). If ``macropy_on_demand`` is enabled, and the
+        module mentions macros, MacroPy's import hook is installed first. For
+        this, only the first ``_MACRO_SCAN_SIZE`` bytes of the module are scanned.
+        """
+        if any('pytest' in finder.__module__ for finder in sys.meta_path if finder is not self):
+            return None
+        if self._macropy_needed(spec) and self._mentions_macros(spec, key, source, _MACRO_SCAN_SIZE):
+            self._activate_macropy()
+        macro_finder = _macro_finder()
+        if macro_finder is not None and macro_finder in sys.meta_path and \
+           self._mentions_macros(spec, key, source):
+            return None
+        return spec
+
+    def _mentions_macros(self, spec, key, source=None, limit=None):
+        """Return whether the non-dialect module ``spec`` mentions macros.
+
+        ``source``: the source text, if already read. If ``None``, the source
+        file is scanned (as bytes, without decoding).
+
+        ``limit``: if not ``None``, scan at most this many bytes of the source file.
+
+        The result is remembered in the negative cache under ``key`` (if not
+        ``None``), unless only a part of the file was scanned and no mention found.
+        """
+        mentions = self._nondialect.get(key) if key is not None else None
+        if mentions is None:
+            if source is None and spec.has_location and spec.origin.endswith(".py"):
+                try:
+                    with open(spec.origin, "rb") as f:
+                        data = f.read(-1 if limit is None else limit)
+                        mentions = b"macros" in data
+                        if not mentions and len(data) == limit and f.read(1):
+                            return False  # may still mention them further on
+                except OSError:
+                    mentions = False
+            else:
+                if source is None:
+                    try:
+                        source = spec.loader.get_source(spec.name)
+                    except Exception:  # MacroPy's finder would skip the module, too
+                        pass
+                mentions = bool(source) and "macros" in source
+            if key is not None:
+                self._nondialect[key] = mentions
+        return mentions
+
+    def _macropy_needed(self, spec):
+        """Return whether MacroPy's import hook must be installed, if the non-dialect module ``spec`` uses macros.
+
+        Only if ``macropy_on_demand`` is enabled, and the hook is not installed
+        yet. MacroPy's own modules never need it (and they are imported while
+        activating it), nor do the modules of the standard library.
+        """
+        if not self.macropy_on_demand or _macro_finder() is not None:
+            return False
+        if spec.name == "macropy" or spec.name.startswith("macropy."):
+            return False
+        return not (spec.has_location and _in_stdlib(spec.origin))
+
+    def _activate_macropy(self):
+        """Install MacroPy's import hook, just after us in ``sys.meta_path``.
+
+        Being called from ``find_spec``, the import system then tries MacroPy's
+        finder next, for the module being imported.
+        """
+        logger.info("Module uses macros, activating MacroPy")
+        self.macropy_on_demand = False  # importing MacroPy goes through ``find_spec``, too
+        try:
+            import macropy.activate  # noqa: F401, inserts the hook at the start of sys.meta_path
+        except ImportError:
+            return
+        macro_finder = _macro_finder()
+        if macro_finder in sys.meta_path:
+            sys.meta_path.remove(macro_finder)
+        sys.meta_path.insert(sys.meta_path.index(self) + 1 if self in sys.meta_path else 0, macro_finder)
+
+    def _nondialect_key(self, fullname, spec):
+        """Return the negative cache key for ``spec``, or ``None`` if it can't be cached."""
+        if not spec.has_location:
+            return None
+        try:
+            mtime = os.stat(spec.origin).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+        return (fullname, spec.origin, mtime)
+
+    def expand_macros(self, source_code, filename, fullname, spec, lang_module, deps=None):
         """Parse, apply AST transforms, and compile.
 
         Parses the source_code, applies the ast_transformer of the dialect,
         and macro-expands the resulting AST if it has macros. Then compiles
         the final AST.
 
+        If ``deps`` is given, the macro modules used by the expansion are
+        appended to it.
+
+        If the dialect sets ``incremental``, and incremental expansion is enabled
+        (``self.incremental``), the module body is expanded one top-level
+        statement at a time; see ``dialects.incremental``.
+
         Returns both the compiled new AST, and the raw new AST.
         """
-        logger.info('Parse in file {} (module {})'.format(filename, fullname))
-        tree = ast.parse(source_code)
+        import ast  # deferred, so that loading the import hook stays cheap
+        logger.info('Parse in file %s (module %s)', filename, fullname)
+        tree = ast.parse(source_code, filename)
 
         if not (isinstance(tree, ast.Module) and tree.body):
             msg = "Expected a Module node with at least one statement or expression in file {} (module {})".format(filename, fullname)
@@ -126,63 +491,235 @@ class DialectFinder:
             logger.error(msg)
             raise SyntaxError(msg)
 
+        if self.incremental and getattr(lang_module, "incremental", False):
+            from . import incremental
+            def expand_body(body, deps):
+                module = ast.Module(body=body)
+                if "type_ignores" in ast.Module._fields:  # Python 3.8+
+                    module.type_ignores = []
+                return self._expand_tree(module, [], body, source_code, filename, fullname,
+                                         spec, lang_module, deps).body
+            tree.body = preamble + incremental.expand(source_code, filename, fullname, thebody,
+                                                      deps if deps is not None else [lang_module],
+                                                      expand_body)
+            new_tree = tree
+        else:
+            new_tree = self._expand_tree(tree, preamble, thebody, source_code, filename, fullname,
+                                         spec, lang_module, deps)
+
+        try:
+            # MacroPy uses the old tree here as input to compile(), but it doesn't matter,
+            # since ``ModuleExpansionContext.expand_macros`` mutates the tree in-place.
+            logger.info('Compile file %s (module %s)', filename, fullname)
+            return compile(new_tree, filename, "exec"), new_tree
+        except Exception:
+            logger.error("Error while compiling file %s (module %s)", filename, fullname)
+            raise
+
+    def _expand_tree(self, tree, preamble, thebody, source_code, filename, fullname, spec, lang_module, deps):
+        """Apply the dialect's AST transforms to ``thebody``, and macro-expand.
+
+        ``tree`` is the ``ast.Module`` to expand; its body is set to ``preamble``
+        followed by the transformed ``thebody``. Return the final tree.
+        """
+        if hasattr(lang_module, "ast_passes"):
+            from . import passes
+            logger.info('Dialect AST passes in file %s (module %s)', filename, fullname)
+            pipeline = passes.pipeline(lang_module)
+            thebody = pipeline.run(thebody)
+            if logger.isEnabledFor(logging.DEBUG):  # formatting the timings is not free
+                logger.debug('AST pass timings for dialect %s so far: %s', lang_module.__name__, pipeline.format_timings())
         if hasattr(lang_module, "ast_transformer"):
-            logger.info('Dialect AST transform in file {} (module {})'.format(filename, fullname))
+            logger.info('Dialect AST transform in file %s (module %s)', filename, fullname)
             thebody = lang_module.ast_transformer(thebody)
         tree.body = preamble + thebody
 
         # detect macros **after** any dialect-level whole-module transform
         new_tree = tree
+        macropy = _load_macropy() if _has_macro_imports(tree.body) else None
         if macropy:
-            logger.info('Detect macros in file {} (module {})'.format(filename, fullname))
-            bindings = macropy.core.macros.detect_macros(tree, spec.name,
+            logger.info('Detect macros in file %s (module %s)', filename, fullname)
+            bindings = macropy.macros.detect_macros(tree, spec.name,
                                                          spec.parent,
                                                          spec.name)
             if bindings:  # expand macros
-                logger.info('Expand macros in file {} (module {})'.format(filename, fullname))
+                logger.info('Expand macros in file %s (module %s)', filename, fullname)
                 modules = []
                 for mod, bind in bindings:
                     modules.append((importlib.import_module(mod), bind))
-                new_tree = macropy.core.macros.ModuleExpansionContext(
+                if deps is not None:
+                    for module, bind in modules:
+                        deps.append(module)
+                        deps.extend(_macro_implementation_modules(module))
+                new_tree = macropy.macros.ModuleExpansionContext(
                     tree, source_code, modules).expand_macros()
 
-        try:
-            # MacroPy uses the old tree here as input to compile(), but it doesn't matter,
-            # since ``ModuleExpansionContext.expand_macros`` mutates the tree in-place.
-            logger.info('Compile file {} (module {})'.format(filename, fullname))
-            return compile(new_tree, filename, "exec"), new_tree
-        except Exception:
-            logger.error("Error while compiling file {} (module {})".format(filename, fullname))
-            raise
+        return new_tree
 
     def find_spec(self, fullname, path, target=None):
         spec = self._find_spec_nomacro(fullname, path, target)
-        if spec is None or not (hasattr(spec.loader, 'get_source') and
-                                callable(spec.loader.get_source)):  # noqa: E128
+        if spec is None:
             if fullname != 'org':
                 # stdlib pickle.py at line 94 contains a ``from
                 # org.python.core for Jython which is always failing,
                 # of course
-                logger.debug('Failed finding spec for {}'.format(fullname))
+                logger.debug('Failed finding spec for %s', fullname)
             return
+        if not (hasattr(spec.loader, 'get_source') and
+                callable(spec.loader.get_source)):  # noqa: E128
+            # namespace package, or a loader that has no sources to look at
+            return self._nondialect_result(spec, None, source="")
         origin = spec.origin
         if origin == 'builtin':
-            return
+            return spec
+        key = self._nondialect_key(fullname, spec)
+        if key is not None and key in self._nondialect:
+            return self._nondialect_result(spec, key)
+        # Look at the start of the file, to avoid reading the full source of
+        # modules that do not use a dialect.
+        dialect_name = _UNDECIDED
+        if spec.has_location:
+            try:
+                dialect_name = detect_dialect(origin)
+            except OSError:
+                pass
+        if dialect_name is None:  # this module does not use a dialect
+            if key is not None:
+                self._nondialect.setdefault(key, None)  # not scanned for macros yet
+            return self._nondialect_result(spec, key)
+
+        if dialect_name is not _UNDECIDED:  # dialect module; leave the rest to the loader
+            return self._dialect_spec(fullname, DialectLoader(spec, dialect_name))
+
+        # Not a plain source file, or a weird header; check the full text.
+        source_stat = None
+        if spec.has_location:
+            try:
+                source_stat = os.stat(origin)  # before reading, see ``cache.store``
+            except OSError:
+                pass
         try:
             source = spec.loader.get_source(fullname)
         except ImportError:
-            logger.debug('Loader for {} was unable to find the sources'.format(fullname))
+            logger.debug('Loader for %s was unable to find the sources', fullname)
             return
         except Exception:
-            logger.error('Loader for {} raised an error'.format(fullname))
+            logger.error('Loader for %s raised an error', fullname)
             return
         if not source:  # some loaders may return None for the sources, without raising an exception
-            logger.debug('Loader returned empty sources for {}'.format(fullname))
-            return
+            logger.debug('Loader returned empty sources for %s', fullname)
+            return self._nondialect_result(spec, None, source="")
+
+        dialect_name = self._detect_dialect_in_text(source)
+        if dialect_name is None:  # this module does not use a dialect
+            return self._nondialect_result(spec, key, source)
+
+        # Unlike macropy.core.import_hooks.MacroLoader, which exits at this point if there
+        # were no macros, we always process the module (because it was explicitly tagged
+        # as a dialect, and pure source-transform dialects are also allowed).
+
+        loader = DialectLoader(spec, dialect_name, source, source_stat)
+        return self._dialect_spec(fullname, loader)
+
+    def load_code(self, loader):
+        """Compile the module of the ``DialectLoader`` ``loader``, or load it from the cache.
+
+        Thread-safe: if several threads load the same module at once, one compiles
+        it, and the others wait for and share the result.
 
-        lang_import = "from __lang__ import"
-        if lang_import not in source:
-            return  # this module does not use a dialect
+        Returns both the code object and the final AST (``None`` if the module
+        was not compiled now).
+        """
+        spec, fullname, dialect_name = loader.nomacro_spec, loader.fullname, loader.dialect_name
+        source, source_stat = loader.source, loader.source_stat
+        if source is None and spec.has_location:
+            try:
+                source_stat = os.stat(spec.origin)  # before reading, see ``cache.store``
+            except OSError:
+                pass
+        if source_stat is None:  # can't tell whether a previous result is still valid
+            return self._load_code(loader, source, source_stat)
+        key = (fullname, spec.origin, dialect_name)
+        version = (source_stat.st_mtime_ns, source_stat.st_size)
+        entry = self._compiled.get(key)
+        if entry is not None and entry[0] == version:  # fast path, no locking
+            return entry[1], None
+        if self.prefetcher is not None:  # if a worker is already compiling it, let it finish
+            self.prefetcher.wait(fullname)
+            entry = self._compiled.get(key)
+            if entry is not None and entry[0] == version:
+                return entry[1], None
+        # Note there is no global lock around macro expansion: expanding a module may
+        # import other (dialect) modules, possibly being loaded by other threads, so a
+        # global lock could deadlock against the import system's per-module locks.
+        with self._compile_lock(fullname):
+            entry = self._compiled.get(key)
+            if entry is not None and entry[0] == version:  # another thread just compiled it
+                return entry[1], None
+            code, tree = self._load_code(loader, source, source_stat)
+            self._compiled[key] = (version, code)
+        if self.prefetcher is not None:
+            self.prefetcher.schedule(code, spec.parent)
+        return code, tree
+
+    def _compile_lock(self, fullname):
+        """Return the lock that serializes compiling the module ``fullname``."""
+        with self._compile_locks_lock:
+            return self._compile_locks.setdefault(fullname, threading.RLock())
+
+    def _add_compiled(self, fullname, origin, dialect_name, version, code):
+        """Add a module compiled elsewhere (e.g. by a prefetch worker) to the in-memory table.
+
+        ``version`` is ``(mtime_ns, size)`` of the source file it was compiled from.
+        """
+        # No locking: the caller may be a thread that the compiling thread waits for.
+        key = (fullname, origin, dialect_name)
+        entry = self._compiled.get(key)
+        if entry is None or entry[0] != version:
+            self._compiled[key] = (version, code)
+
+    def _release_compiled(self, loader, code):
+        """Drop the in-memory entry of the module of ``loader``, if it holds ``code``.
+
+        Called when the module is executed. From then on, the import system
+        finds the module in ``sys.modules``, so the entry would only keep the
+        code object alive for the life of the process. A newer entry (e.g. from
+        a background compile of an edited source) is kept.
+        """
+        key = (loader.fullname, loader.nomacro_spec.origin, loader.dialect_name)
+        entry = self._compiled.get(key)
+        if entry is not None and entry[1] is code:
+            self._compiled.pop(key, None)
+
+    def invalidate(self, names=None):
+        """Forget the in-memory compiled code of the modules ``names`` (default all).
+
+        The in-memory table is validated against the module's own source file
+        only; call this when something else the expansion depends on (such as
+        the dialect module) has been reloaded. The compile cache checks all
+        dependencies, so it needs no invalidation.
+        """
+        for key in list(self._compiled):
+            if names is None or key[0] in names:
+                self._compiled.pop(key, None)
+
+    def _load_code(self, loader, source, source_stat):
+        spec, fullname, dialect_name = loader.nomacro_spec, loader.fullname, loader.dialect_name
+        # If there is an up-to-date expansion in the bytecode cache, we don't
+        # need the source at all (not even the dialect module).
+        if source_stat is not None:
+            code = cache.load(spec.origin, dialect_name, fullname)
+            if code is not None:
+                logger.info("Loading module '%s' (dialect '%s') from cache", fullname, dialect_name)
+                return code, None
+        if source is None:
+            source = spec.loader.get_source(fullname)
+        return self._transform_and_compile(fullname, spec, dialect_name, source, source_stat)
+
+    def _detect_dialect_in_text(self, source):
+        """Return the dialect name in the lang-import in the full source text, or ``None``."""
+        if _lang_import_text not in source:
+            return None
 
         # Detect the dialect... ugh!
         #   - At this point, the input is text.
@@ -198,37 +735,98 @@ class DialectFinder:
             msg = "Expected exactly one lang-import with one dialect name"
             logger.error(msg)
             raise SyntaxError(msg)
-        dialect_name = matches[0]
+        return matches[0]
 
+    def _transform_and_compile(self, fullname, spec, dialect_name, source, source_stat):
+        """Run the dialect's transformers and the macro expander, and compile.
+
+        Store the result in the cache, if ``source_stat`` (of the source file,
+        taken before reading ``source``) is given.
+
+        Returns both the code object and the final AST.
+        """
         try:
-            logger.info("Detected dialect '{}' in module '{}', loading dialect".format(dialect_name, fullname))
+            logger.info("Detected dialect '%s' in module '%s', loading dialect", dialect_name, fullname)
             lang_module = importlib.import_module(dialect_name)
         except ImportError as err:
             msg = "Could not import dialect module '{}'".format(dialect_name)
             logger.error(msg)
             raise ImportError(msg) from err
-        if not any(hasattr(lang_module, x) for x in ("source_transformer", "ast_transformer")):
+        if not any(hasattr(lang_module, x) for x in ("source_transformer", "ast_passes", "ast_transformer")):
             msg = "Module '{}' has no dialect transformers".format(dialect_name)
             logger.error(msg)
             raise ImportError(msg)
 
         if hasattr(lang_module, "source_transformer"):
-            logger.info('Dialect source transform in {}'.format(fullname))
+            logger.info('Dialect source transform in %s', fullname)
             source = lang_module.source_transformer(source)
             if not source:
                 msg = "Empty source text after dialect source transform in {}".format(fullname)
                 logger.error(msg)
                 raise SyntaxError(msg)
-            if lang_import not in source:  # preserve invariant
+            if _lang_import_text not in source:  # preserve invariant
                 msg = 'Dialect source transform for {} should not delete the lang-import'.format(fullname)
                 logger.error(msg)
                 raise RuntimeError(msg)
 
-        code, tree = self.expand_macros(source, origin, fullname, spec, lang_module)
+        transformers = [getattr(lang_module, x, None) for x in ("source_transformer", "ast_transformer")]
+        transformers.extend(type(p) for p in getattr(lang_module, "ast_passes", ()))
+        deps = [lang_module] + [sys.modules[f.__module__]
+                                for f in transformers
+                                if f is not None and getattr(f, "__module__", None) in sys.modules]
+        code, tree = self.expand_macros(source, spec.origin, fullname, spec, lang_module, deps)
+        if source_stat is not None:
+            cache.store(spec.origin, dialect_name, fullname, code, source_stat, deps)
+        return code, tree
 
-        # Unlike macropy.core.import_hooks.MacroLoader, which exits at this point if there
-        # were no macros, we always process the module (because it was explicitly tagged
-        # as a dialect, and pure source-transform dialects are also allowed).
+    def compile_module(self, spec, force=False):
+        """Compile the module described by ``spec`` into the cache, without executing it.
+
+        This is the import-time pipeline, run ahead of time; see ``dialects.precompile``.
+        The module must be a source file (``spec.has_location``).
 
-        loader = DialectLoader(spec, code, tree)
-        return spec_from_loader(fullname, loader)
+        ``force``: if ``True``, compile even if the cache is already up to date.
+
+        Return ``"compiled"``, ``"cached"`` (was already up to date), or ``None``
+        if the module does not use a dialect. Errors are raised as usual.
+        """
+        fullname, origin = spec.name, spec.origin
+        source_stat = os.stat(origin)
+        dialect_name = detect_dialect(origin)
+        source = None
+        if dialect_name is _UNDECIDED:
+            source = spec.loader.get_source(fullname)
+            dialect_name = self._detect_dialect_in_text(source or "")
+        if dialect_name is None:
+            return None
+        key = (fullname, origin, dialect_name)
+        version = (source_stat.st_mtime_ns, source_stat.st_size)
+        with self._compile_lock(fullname):
+            if not force and cache.load(origin, dialect_name, fullname) is not None:
+                return "cached"
+            if source is None:
+                source = spec.loader.get_source(fullname)
+            code, tree = self._transform_and_compile(fullname, spec, dialect_name, source, source_stat)
+            # If the module is imported later in this process, no need to load it from the cache.
+            self._compiled[key] = (version, code)
+        return "compiled"
+
+    def expand_module(self, spec):
+        """Run the import-time pipeline on the module described by ``spec``, and return the result.
+
+        The module is not executed, and the cache is neither used nor updated.
+        This is useful for tools that need the final AST; see ``dialects.export``.
+        The module must be a source file (``spec.has_location``).
+
+        Returns ``(dialect_name, code, tree)``, where ``tree`` is the final AST,
+        or ``None`` if the module does not use a dialect.
+        """
+        fullname = spec.name
+        dialect_name = detect_dialect(spec.origin)
+        source = spec.loader.get_source(fullname)
+        if dialect_name is _UNDECIDED:
+            dialect_name = self._detect_dialect_in_text(source or "")
+        if dialect_name is None:
+            return None
+        code, tree = self._transform_and_compile(fullname, spec, dialect_name, source, None)
+        return dialect_name, code, tree
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Incremental expansion of dialect modules, one top-level statement at a time.
+
+Normally, the dialect transforms and macro expansion run on the whole module
+at once, so changing one ``def`` in a long module re-expands all of it. A
+dialect whose transforms are *statement-local* can declare that it supports
+incremental expansion::
+
+    incremental = True
+
+in the dialect module. This is a development feature, so it must also be
+enabled in the process, by setting ``DialectFinder.incremental = True``
+(``pydialect --watch`` does this). Then each top-level statement of the user
+module (after the source transform) is expanded separately, as if it was alone
+in the module, and the results are kept in memory. When the module is expanded
+again (e.g. on ``importlib.reload``), only the statements whose source text has
+changed are expanded again; the others are reused. The module is then compiled
+from the reassembled tree.
+
+The first expansion of a module is slower than a whole-module expansion, since
+the dialect pipeline runs once per statement; it pays off when the module is
+edited and expanded again, and again.
+
+Statement-local means that the expansion of a statement must not depend on
+the other statements of the module. This is typically the case for dialects
+that splice the module body into a template of imports and block macros that
+each transform definitions independently, like ``lispython``. Specifically:
+
+  - The macro-imports of the user module (``from foo import macros, ...``)
+    are included in the expansion of every statement.
+  - The imports the dialect injects (at the start of the expansion of each
+    statement, possibly after ``pass`` statements, which are dropped) are
+    hoisted to the start of the module body, and duplicates are removed; so,
+    like with a whole-module template, they run once, before the user code.
+
+A statement is identified by its source text (including any comments and blank
+lines up to the next statement). A stored expansion is reused only if the
+dialect fingerprint (the toolchain, and the dialect module and the modules
+defining its transformers; see ``dialects.cache``) and the macro modules used
+by the expansion are unchanged. If the statement has moved, the line numbers
+of its expansion are shifted to match.
+
+Only the expansions of the latest version of each module are kept, pickled,
+so that the memory use stays at a fraction of the size of the expanded trees;
+and only for the ``max_modules`` most recently expanded modules. To release
+them all, call ``clear``.
+"""
+
+__all__ = ["expand", "clear", "max_modules"]
+
+import ast
+from collections import OrderedDict
+import logging
+import pickle
+import sys
+import threading
+
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+# Keep the expansions of at most this many modules (least recently expanded are dropped).
+max_modules = 256
+
+# (fullname, filename) -> (dialect fingerprint, {segment text: (first line, pickled expansion, macro deps)})
+_segments = OrderedDict()
+_segments_lock = threading.Lock()
+
+def clear():
+    """Forget all stored expansions."""
+    with _segments_lock:
+        _segments.clear()
+
+def _is_macro_import(stmt):
+    return type(stmt) is ast.ImportFrom and stmt.names[0].name == "macros"
+
+def _first_line(stmt):
+    """Return the first line of the top-level statement ``stmt``, including its decorators."""
+    return min([stmt.lineno] + [d.lineno for d in getattr(stmt, "decorator_list", ())])
+
+def _split(body, lines):
+    """Split ``body`` into segments, each a run of statements starting on the same line.
+
+    Return a list of ``(first line, source text, statements)``. The text of a
+    segment extends up to the start of the next one.
+    """
+    starts, groups = [], []
+    for stmt in body:
+        start = _first_line(stmt)
+        if starts and starts[-1] == start:  # a; b
+            groups[-1].append(stmt)
+        else:
+            starts.append(start)
+            groups.append([stmt])
+    out = []
+    for k, (start, stmts) in enumerate(zip(starts, groups)):
+        end = starts[k + 1] - 1 if k + 1 < len(starts) else len(lines)
+        out.append((start, "".join(lines[start - 1:end]), stmts))
+    return out
+
+def _dependency(module):
+    dep = cache.module_dependency(module)
+    return dep if dep is not None else (module.__name__, None, None)
+
+def _is_current(dep, memo):
+    """Return whether the macro module dependency record ``dep`` matches the loaded module."""
+    name = dep[0]
+    if name not in memo:
+        module = sys.modules.get(name)
+        memo[name] = _dependency(module) if module is not None else None
+    return memo[name] == dep
+
+def expand(source_code, filename, fullname, body, deps, expand_body):
+    """Expand the module body ``body`` (minus docstring and lang-import) incrementally.
+
+    ``source_code``: the source text ``body`` was parsed from (after the source transform).
+
+    ``deps``: list of the modules the expansion depends on (the dialect module
+    and the modules of its transformers); the macro modules used are appended to it.
+
+    ``expand_body``: function ``(statements, deps) -> statements`` that runs
+    the dialect transforms and macro expansion on a module body, appending the
+    macro modules used to ``deps``.
+
+    Return the new module body.
+    """
+    macro_imports = [stmt for stmt in body if _is_macro_import(stmt)]
+    segments = _split([stmt for stmt in body if not _is_macro_import(stmt)],
+                      source_code.splitlines(True))
+
+    # The expansion of each statement depends on the macro-imports, too.
+    fingerprint = (cache.toolchain(), tuple(_dependency(m) for m in deps),
+                   tuple(ast.dump(stmt) for stmt in macro_imports))
+    key = (fullname, filename)
+    with _segments_lock:
+        old_fingerprint, old = _segments.get(key, (None, {}))
+    if old_fingerprint != fingerprint:
+        old = {}
+    new = {}
+
+    memo = {}
+    expanded = []
+    nreused = 0
+    for start, text, stmts in segments:
+        entry = old.get(text)
+        if entry is not None and all(_is_current(dep, memo) for dep in entry[2]):
+            stored_start, data, macro_deps = entry
+            result = pickle.loads(data)
+            if start != stored_start:
+                for stmt in result:
+                    ast.increment_lineno(stmt, start - stored_start)
+            deps.extend(sys.modules[dep[0]] for dep in macro_deps)
+            nreused += 1
+        else:
+            segment_deps = []
+            # Copies of the macro-imports, since the expansion may modify them.
+            result = expand_body(pickle.loads(pickle.dumps(macro_imports)) + stmts, segment_deps)
+            deps.extend(segment_deps)
+            macro_deps = tuple(_dependency(m) for m in segment_deps)
+            try:
+                entry = (start, pickle.dumps(result, pickle.HIGHEST_PROTOCOL), macro_deps)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                logger.debug("Could not store the expansion of line %d of %s", start, filename)
+                entry = None
+        if entry is not None:
+            new[text] = entry
+        expanded.append((stmts, result))
+    with _segments_lock:
+        _segments[key] = (fingerprint, new)
+        _segments.move_to_end(key)
+        while len(_segments) > max_modules:
+            _segments.popitem(last=False)
+    logger.info("Incremental expansion of %s: %d of %d statements reused", filename, nreused, len(segments))
+
+    # Reassemble. The imports at the start of each expansion (other than the
+    # statement's own) were injected by the dialect; hoist them. A template
+    # (see ``dialects.util``) leaves a ``pass`` in place of each macro-import
+    # it had; skip those, too, so that its imports are found after them.
+    hoisted, rest, seen = [], [], set()
+    for stmts, result in expanded:
+        own = {ast.dump(stmt) for stmt in stmts if type(stmt) is not ast.Pass}
+        k = 0
+        while k < len(result) and type(result[k]) in (ast.Import, ast.ImportFrom, ast.Pass):
+            if type(result[k]) is not ast.Pass:
+                dump = ast.dump(result[k])
+                if dump in own:
+                    break
+                if dump not in seen:
+                    seen.add(dump)
+                    hoisted.append(result[k])
+            k += 1
+        rest.extend(result[k:])
+    return hoisted + rest
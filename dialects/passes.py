@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""AST pass pipelines for dialects.
+
+A dialect may declare, in addition to (or instead of) an ``ast_transformer``,
+an ordered list of AST passes::
+
+    from dialects.passes import Rewriter
+
+    class FoldConstants(Rewriter):
+        def visit_BinOp(self, node):
+            ...
+            return node
+
+    class RenameBuiltins(Rewriter):
+        def visit_Name(self, node):
+            ...
+            return node
+
+    ast_passes = [FoldConstants(), RenameBuiltins()]
+
+The dialect importer runs the passes on the module body (minus the module
+docstring and the lang-import), before the ``ast_transformer``, if any.
+
+Consecutive *fusable* passes are fused: they run together in a single
+traversal of the tree, each node being handed to each pass in turn. For this
+to give the same result as running them one after another, a fusable pass must
+be *local*: how it rewrites a node may depend only on that node and its
+subtree, and it must not care whether the other passes have rewritten the
+subtree already. Passes that need the whole tree (e.g. an analysis followed by
+a rewrite) set ``fusable = False`` (and may override ``run``); they get a
+traversal of their own.
+
+The traversal is iterative, so there is no recursion limit on nesting depth.
+
+Per-pass timings are collected by each ``Pipeline``; the dialect importer keeps
+one pipeline per dialect, see ``pipeline`` and ``report``. Timing each visitor
+call separately has a cost, so by default the timings are per traversal (for
+fused passes, the total of the group). To time each pass separately, set
+``dialects.passes.profile = True``, or the environment variable
+``PYDIALECT_PROFILE_PASSES`` (to any nonempty value).
+"""
+
+__all__ = ["Rewriter", "Pipeline", "pipeline", "report"]
+
+import os
+import time
+from ast import AST
+
+profile = bool(os.environ.get("PYDIALECT_PROFILE_PASSES"))
+
+class Rewriter:
+    """Base class for AST passes.
+
+    Define methods ``visit_<classname>(self, node)``, as in ``ast.NodeTransformer``.
+    The class name can be that of any base class of the node type, too (e.g.
+    ``visit_stmt``, ``visit_expr``, ``visit_AST``); when several match, they are
+    all called, the most specific one first.
+
+    Unlike in ``ast.NodeTransformer``, a visitor does not recurse into the
+    children; the engine visits every node, in postorder (children first), so
+    when a node is visited, its subtree has already been rewritten.
+
+    A visitor returns what should replace the node:
+
+        - ``node`` itself, possibly modified in place,
+        - a new node, which the remaining passes (if fused) then see in its place
+          (but whose children are not visited again),
+        - ``None``, to delete the node, or a list of nodes; only allowed when
+          ``node`` is an item of a list, such as a statement in a body.
+
+    ``begin`` and ``end`` are called before and after each traversal.
+    """
+    fusable = True
+
+    @property
+    def name(self):
+        """Name of the pass, for reports."""
+        return type(self).__name__
+
+    def begin(self, body):
+        """Called with the module body before the traversal."""
+        pass
+
+    def end(self, body):
+        """Called with the module body after the traversal. Return the (possibly new) body."""
+        return body
+
+    def run(self, body):
+        """Run this pass alone on the module body (a ``list`` of statements). Return the new body."""
+        return _Traversal([self]).run(body)
+
+class _Traversal:
+    """One traversal of the tree, running the passes ``passes`` fused."""
+
+    def __init__(self, passes, timings=None):
+        self.passes = passes
+        self.timings = timings  # pass name -> seconds, to time each visitor call; or None
+        self._visitors = {}  # node type -> [(pass index, visitor)]
+
+    def visitors(self, cls):
+        """Return the visitors of all passes for the node type ``cls``, in order of passes."""
+        out = self._visitors.get(cls)
+        if out is None:
+            out = []
+            for k, p in enumerate(self.passes):
+                for base in cls.__mro__:
+                    method = getattr(p, "visit_{}".format(base.__name__), None)
+                    if method is not None:
+                        out.append((k, method))
+            self._visitors[cls] = out
+        return out
+
+    def apply(self, node, first=0):
+        """Apply the visitors of passes ``first``, ``first + 1``, ... to ``node``. Return the result."""
+        timings = self.timings
+        for k, method in self.visitors(type(node)):
+            if k < first:
+                continue
+            if timings is not None:
+                t0 = time.perf_counter()
+                result = method(node)
+                name = self.passes[k].name
+                timings[name] = timings.get(name, 0.0) + (time.perf_counter() - t0)
+            else:
+                result = method(node)
+            if result is node:
+                continue
+            if result is None:
+                return None
+            if isinstance(result, list):  # the remaining passes see each new node
+                out = []
+                for item in result:
+                    _extend(out, self.apply(item, k + 1))
+                return out
+            return self.apply(result, k + 1)
+        return node
+
+    def run(self, body):
+        for p in self.passes:
+            p.begin(body)
+        # Postorder: order the nodes so that each comes after its descendants.
+        order = []
+        stack = list(body)
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            for field in node._fields:
+                value = getattr(node, field, None)
+                if isinstance(value, list):
+                    stack.extend(item for item in value if isinstance(item, AST))
+                elif isinstance(value, AST):
+                    stack.append(value)
+        # id(node) -> results of rewriting it, for nodes that were replaced, until
+        # the parent collects them. A list, because a node may appear in the tree
+        # more than once (e.g. ``ast.Load()``).
+        results = {}
+        table = self._visitors
+        for node in reversed(order):
+            if results:  # some child may have been replaced
+                for field in node._fields:
+                    value = getattr(node, field, None)
+                    if isinstance(value, list):
+                        _replace_items(value, results)
+                    elif isinstance(value, AST) and id(value) in results:
+                        result = _pop_result(results, value)
+                        if not isinstance(result, AST):
+                            raise TypeError("{}.{} is not in a list; it can only be replaced by a node, got {!r}".format(
+                                            type(node).__name__, field, result))
+                        setattr(node, field, result)
+            cls = type(node)
+            if table[cls] if cls in table else self.visitors(cls):
+                result = self.apply(node)
+                if result is not node:
+                    results.setdefault(id(node), []).append(result)
+        body = list(body)
+        if results:
+            _replace_items(body, results)
+        for p in self.passes:
+            body = p.end(body)
+        return body
+
+def _pop_result(results, node):
+    pending = results[id(node)]
+    result = pending.pop()
+    if not pending:
+        del results[id(node)]
+    return result
+
+def _extend(out, result):
+    if result is None:
+        return
+    if isinstance(result, list):
+        out.extend(result)
+    else:
+        out.append(result)
+
+def _replace_items(lst, results):
+    """Replace, in place, those nodes in ``lst`` that have been rewritten with their results."""
+    if not any(id(item) in results for item in lst):
+        return
+    new = []
+    for item in lst:
+        if isinstance(item, AST) and id(item) in results:
+            _extend(new, _pop_result(results, item))
+        else:
+            new.append(item)
+    lst[:] = new
+
+class Pipeline:
+    """An ordered list of AST passes (``Rewriter`` instances), with consecutive fusable passes fused.
+
+    ``timings`` is a dict that accumulates, over all runs, the time taken by
+    each pass (or, when not profiling, by each fused group of passes, named
+    ``"a+b+c"``).
+    """
+
+    def __init__(self, passes):
+        self.passes = list(passes)
+        self.groups = []  # lists of passes; each group is one traversal
+        for p in self.passes:
+            if getattr(p, "fusable", False) and self.groups and getattr(self.groups[-1][-1], "fusable", False):
+                self.groups[-1].append(p)
+            else:
+                self.groups.append([p])
+        self.timings = {}
+
+    def run(self, body):
+        """Run the passes on the module body (a ``list`` of statements). Return the new body."""
+        for group in self.groups:
+            name = "+".join(p.name for p in group)
+            t0 = time.perf_counter()
+            if len(group) == 1 and not getattr(group[0], "fusable", False):
+                body = group[0].run(body)
+            elif profile:
+                pass_times = {}
+                body = _Traversal(group, pass_times).run(body)
+                for k, t in pass_times.items():
+                    self.timings[k] = self.timings.get(k, 0.0) + t
+                # Whatever remains is the cost of the traversal itself.
+                name = "{} (traversal)".format(name)
+                t0 += sum(pass_times.values())
+            else:
+                body = _Traversal(group).run(body)
+            self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - t0)
+        return body
+
+    def format_timings(self):
+        """Return the timings as a human-readable string, slowest first."""
+        items = sorted(self.timings.items(), key=lambda item: -item[1])
+        return ", ".join("{} {:0.1f} ms".format(name, 1000 * t) for name, t in items)
+
+# dialect module name -> (its ast_passes, Pipeline)
+_pipelines = {}
+
+def pipeline(lang_module):
+    """Return the ``Pipeline`` for the ``ast_passes`` of the dialect module ``lang_module``.
+
+    The pipeline is made once per dialect (unless its ``ast_passes`` changes),
+    so its timings accumulate over all modules using the dialect.
+    """
+    passes = lang_module.ast_passes
+    entry = _pipelines.get(lang_module.__name__)
+    if entry is None or entry[0] is not passes:
+        entry = (passes, Pipeline(passes))
+        _pipelines[lang_module.__name__] = entry
+    return entry[1]
+
+def report():
+    """Return the accumulated pass timings of all dialects, as a human-readable string."""
+    return "\n".join("{}: {}".format(name, p.format_timings())
+                     for name, (_, p) in sorted(_pipelines.items()))
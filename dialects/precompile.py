@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Ahead-of-time compilation of dialect modules into the compile cache.
+
+Like stdlib's ``compileall``, but for modules that use a dialect: walk source
+trees, find the modules that have a lang-import, and run the full import-time
+pipeline (source transform, AST transform, macro expansion, compilation) on
+them, in parallel, storing the results into the compile cache (see
+``dialects.cache``). This allows warming the cache e.g. at image build time,
+instead of at the first import in production.
+
+Usage::
+
+    python3 -m dialects.precompile [-j N] [-f] [-q] path...
+    pydialect --precompile path...
+
+Each path is a directory (searched recursively) or a ``.py`` file. The module
+name of each file is determined from the package structure (``__init__.py``
+files) around it, and the directory containing its top-level package is added
+to ``sys.path`` in the worker processes.
+
+Note that although the modules are not executed, macro expansion imports the
+dialect modules and macro modules they use, and hence also their parent packages.
+"""
+
+__all__ = ["find_modules", "compile_file", "precompile"]
+
+import concurrent.futures
+import importlib.util
+import os
+import sys
+import time
+import traceback
+
+def _module_name(filename):
+    """Return ``(fullname, root)`` for the source file ``filename``.
+
+    ``root`` is the directory that would have to be on ``sys.path`` for
+    the module to be importable under the name ``fullname``.
+    """
+    path = os.path.abspath(filename)
+    head, tail = os.path.split(path)
+    parts = [] if tail == "__init__.py" else [os.path.splitext(tail)[0]]
+    while os.path.isfile(os.path.join(head, "__init__.py")):
+        head, pkg = os.path.split(head)
+        parts.insert(0, pkg)
+    return ".".join(parts), head
+
+def find_modules(paths):
+    """Find the Python source files in ``paths``.
+
+    ``paths``: iterable of directories (searched recursively) and ``.py`` files.
+
+    Returns a list of ``(fullname, filename, root)``; see ``_module_name``.
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, files in os.walk(path):
+                dirnames[:] = sorted(d for d in dirnames if not d.startswith(".") and d != "__pycache__")
+                filenames.extend(os.path.join(dirpath, fn) for fn in sorted(files) if fn.endswith(".py"))
+        else:
+            filenames.append(path)
+    out = []
+    for filename in filenames:
+        fullname, root = _module_name(filename)
+        out.append((fullname, os.path.abspath(filename), root))
+    return out
+
+def _init_worker(roots, backend):
+    """Set up a worker process: make the source trees importable, enable dialects and MacroPy."""
+    for root in reversed(roots):
+        if root not in sys.path:
+            sys.path.insert(0, root)
+    sys.dont_write_bytecode = False  # writing the cache is the whole point
+    if backend is not None:
+        from . import cache
+        cache.backend = backend
+    import dialects.activate  # dialect and macro modules may themselves use dialects and macros
+    dialects.activate._activate_macropy()
+
+def compile_file(fullname, filename, force=False):
+    """Compile one module into the cache.
+
+    Returns ``(fullname, filename, status, seconds, error)``, where ``status``
+    is one of ``"compiled"``, ``"cached"``, ``None`` (not a dialect module),
+    or ``"failed"``, in which case ``error`` is the formatted traceback.
+    """
+    from .importer import DialectFinder
+    t0 = time.time()
+    try:
+        is_package = os.path.basename(filename) == "__init__.py"
+        locations = [os.path.dirname(filename)] if is_package else None
+        spec = importlib.util.spec_from_file_location(fullname, filename,
+                                                      submodule_search_locations=locations)
+        status = DialectFinder.compile_module(spec, force=force)
+        error = None
+    except Exception:
+        status = "failed"
+        error = traceback.format_exc()
+    return fullname, filename, status, time.time() - t0, error
+
+def precompile(paths, workers=None, force=False, verbose=True, file=None, backend=None):
+    """Compile the dialect modules in ``paths`` into the cache, using a process pool.
+
+    ``paths``: see ``find_modules``.
+
+    ``workers``: number of worker processes; default one per CPU core.
+
+    ``force``: compile even the modules whose cache is already up to date.
+
+    ``verbose``: if ``True``, report each dialect module with its timing.
+    Failures are always reported.
+
+    ``file``: where to write the report; default ``sys.stdout``.
+
+    ``backend``: the cache backend to compile into (see ``dialects.cache``);
+    default is whatever the environment selects.
+
+    Returns the number of modules that failed to compile.
+    """
+    file = file or sys.stdout
+    modules = find_modules(paths)
+    roots = sorted(set(root for _, _, root in modules))
+    fails = 0
+    compiled = 0
+    t0 = time.time()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                initializer=_init_worker,
+                                                initargs=(roots, backend)) as pool:
+        futures = [pool.submit(compile_file, fullname, filename, force)
+                   for fullname, filename, _ in modules]
+        for future in concurrent.futures.as_completed(futures):
+            fullname, filename, status, dt, error = future.result()
+            if status == "failed":
+                fails += 1
+                print("FAILED    {:8.3f}s  {} ({})".format(dt, fullname, filename), file=file)
+                print(error, file=file)
+            elif status is not None:
+                compiled += status == "compiled"
+                if verbose:
+                    print("{:9s} {:8.3f}s  {} ({})".format(status, dt, fullname, filename), file=file)
+    if verbose:
+        print("{} modules scanned, {} compiled, {} failed, in {:0.3f}s".format(len(modules), compiled,
+                                                                            fails, time.time() - t0),
+              file=file)
+    return fails
+
+def main():
+    """Handle command-line arguments and run the precompiler."""
+    import argparse
+    parser = argparse.ArgumentParser(description="""Precompile Pydialect dialect modules into the compile cache.""")
+    parser.add_argument(dest='paths', nargs='+', type=str, metavar='path',
+                        help='directory (searched recursively) or .py file')
+    parser.add_argument('-j', '--workers', dest='workers', type=int, default=None, metavar='N',
+                        help='number of worker processes (default: one per CPU core)')
+    parser.add_argument('-f', '--force', dest='force', action="store_true", default=False,
+                        help='compile even if the cache is up to date')
+    parser.add_argument('-q', '--quiet', dest='verbose', action="store_false", default=True,
+                        help='report only failures')
+    opts = parser.parse_args()
+    fails = precompile(opts.paths, workers=opts.workers, force=opts.force, verbose=opts.verbose)
+    sys.exit(1 if fails else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""Speculative background compilation of the imports of dialect modules.
+
+When the dialect importer has loaded a dialect module (compiled it, or loaded
+it from the compile cache), the module's code already tells which modules it is
+about to import. With prefetching enabled (``dialects.activate.prefetch``),
+those imports are handed to a pool of worker processes right away: each worker
+finds the module (without importing anything), and if it is a dialect module,
+runs the import-time pipeline on it (see ``DialectFinder.compile_module``),
+storing the result into the compile cache. The code object is sent back to
+the importing process, into the dialect importer's in-memory table, and the
+imports of the prefetched module are prefetched in turn.
+
+So while the main thread executes a module, the modules it imports are being
+expanded in parallel; when the import reaches one of them, it is ready (or the
+import waits for the worker already compiling it, instead of compiling it again).
+
+Only the module-level imports of dialect modules are followed; imports inside
+functions, and the imports of modules that do not use a dialect, are not.
+Failures in the workers are ignored; the error then occurs, and is reported as
+usual, when the module is actually imported.
+
+The workers are started with the ``spawn`` method, so that they do not inherit
+the (possibly half-done) import state of the importing process. Only a few jobs
+are queued in the pool at a time, so that a program that exits early does not
+wait for speculative work it no longer needs.
+"""
+
+__all__ = ["Prefetcher", "module_imports"]
+
+import collections
+import concurrent.futures
+import dis
+import importlib.machinery
+import importlib.util
+import logging
+import marshal
+import multiprocessing
+import os
+import sys
+import threading
+
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+def module_imports(code, package):
+    """Return the absolute names of the modules the module-level code ``code`` imports.
+
+    Relative imports are resolved against ``package``. For ``from a import b``,
+    both ``a`` and ``a.b`` are returned (``b`` may be a submodule); for
+    ``import a.b``, both ``a`` and ``a.b``.
+    """
+    out = []
+    instructions = list(dis.get_instructions(code))
+    for k, instruction in enumerate(instructions):
+        if instruction.opname != "IMPORT_NAME":
+            continue
+        # The level and the fromlist are pushed just before the IMPORT_NAME.
+        level = instructions[k - 2].argval if k >= 2 else 0
+        fromlist = instructions[k - 1].argval if k >= 1 else None
+        if not isinstance(level, int):
+            level = 0
+        name = instruction.argval
+        if level:
+            try:
+                name = importlib.util.resolve_name("." * level + name, package)
+            except (ValueError, ImportError):  # e.g. relative import outside a package
+                continue
+            if name.endswith("."):  # from . import x
+                name = name[:-1]
+        parts = name.split(".")
+        out.extend(".".join(parts[:j]) for j in range(1, len(parts) + 1))
+        if isinstance(fromlist, tuple):
+            out.extend("{}.{}".format(name, item) for item in fromlist if item != "*")
+    return out
+
+def _locate(fullname):
+    """Find the spec of the module ``fullname`` on the file system, without importing anything.
+
+    Return ``None`` if not found.
+    """
+    path = None
+    parts = fullname.split(".")
+    for j in range(1, len(parts) + 1):
+        spec = importlib.machinery.PathFinder.find_spec(".".join(parts[:j]), path)
+        if spec is None:
+            return None
+        if j < len(parts):
+            path = spec.submodule_search_locations
+            if path is None:  # not a package
+                return None
+    return spec
+
+def _init_worker(path, dont_write_bytecode, backend):
+    """Set up a worker process like the importing process."""
+    sys.path[:] = path
+    sys.dont_write_bytecode = dont_write_bytecode
+    cache.backend = backend
+    import dialects.activate  # dialect and macro modules may themselves use dialects and macros
+    dialects.activate._activate_macropy()
+
+def _prefetch(fullname):
+    """Compile the module ``fullname`` (in a worker), if it is a dialect module.
+
+    Returns ``(fullname, entry, imports)``, where ``entry`` is ``None`` if there
+    is nothing to send back (not a dialect module, failed, or was already in
+    the compile cache), else ``(origin, dialect_name, version, marshalled code)``.
+    ``imports`` are the module-level imports of the module, if it is a dialect module.
+    """
+    from .importer import DialectFinder, detect_dialect
+    spec = _locate(fullname)
+    if spec is None or not spec.has_location or not spec.origin.endswith(".py"):
+        return fullname, None, ()
+    dialect_name = detect_dialect(spec.origin)
+    if not isinstance(dialect_name, str):  # not a dialect module, or can't tell from the header
+        return fullname, None, ()
+    try:
+        status = DialectFinder.compile_module(spec)
+    except Exception as err:
+        logger.debug("Could not prefetch '%s': %s", fullname, err)
+        return fullname, None, ()
+    entry = DialectFinder._compiled.get((fullname, spec.origin, dialect_name))
+    if status == "compiled" and entry is not None:
+        version, code = entry
+        result = (spec.origin, dialect_name, version, marshal.dumps(code))
+    else:  # up to date in the cache; the importing process will load it from there
+        code = cache.load(spec.origin, dialect_name, fullname)
+        result = None
+    imports = module_imports(code, spec.parent) if code is not None else ()
+    return fullname, result, imports
+
+class Prefetcher:
+    """Compile the imports of dialect modules in a pool of worker processes.
+
+    ``workers``: number of worker processes; default one per CPU core.
+    The pool is started when first needed.
+
+    Requires Python 3.7+. A main program run directly by ``python3`` (not by
+    the ``pydialect`` bootstrapper) must guard its top level with
+    ``if __name__ == '__main__':``, as usual with ``multiprocessing``.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+        self._lock = threading.RLock()  # a future's callback may run in the thread that submits it
+        self._queue = collections.deque()  # names not yet submitted
+        self._pending = {}  # fullname -> (future, event set when its result has been stored)
+        self._seen = set()  # names already queued once
+        self._closed = False
+
+    def schedule(self, code, package):
+        """Prefetch the modules imported by the module-level code ``code`` of a module in ``package``."""
+        try:
+            self.schedule_names(module_imports(code, package))
+        except Exception as err:  # prefetching is only an optimization; never fail the import
+            self._disable(err)
+
+    def schedule_names(self, names):
+        """Prefetch the modules ``names`` (absolute names), unless already loaded or seen."""
+        with self._lock:
+            for name in names:
+                if name not in self._seen and name not in sys.modules:
+                    self._seen.add(name)
+                    self._queue.append(name)
+            self._submit()
+
+    def _submit(self):
+        """Submit queued names, keeping a few jobs per worker in the pool. Call with the lock held."""
+        while self._queue and not self._closed and len(self._pending) < 2 * self.workers:
+            name = self._queue.popleft()
+            if name in sys.modules:
+                continue
+            try:
+                if self._pool is None:
+                    self._pool = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker,
+                        initargs=(list(sys.path), sys.dont_write_bytecode, cache.backend))
+                future = self._pool.submit(_prefetch, name)
+            except RuntimeError:  # interpreter shutting down
+                self._closed = True
+                return
+            except Exception as err:  # e.g. the cache backend can't be sent to the workers
+                self._disable(err)
+                return
+            self._pending[name] = (future, threading.Event())
+            future.add_done_callback(lambda future, name=name: self._done(name, future))
+
+    def _disable(self, err):
+        """Stop prefetching after an unexpected error; the imports then compile as usual."""
+        logger.warning("Prefetching disabled: %s: %s", type(err).__name__, err)
+        with self._lock:
+            self._closed = True
+            self._queue.clear()
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            try:
+                pool.shutdown(wait=False)
+            except Exception:
+                pass
+
+    def _done(self, name, future):
+        imports = ()
+        try:
+            if not future.cancelled():
+                fullname, entry, imports = future.result()
+                if entry is not None:
+                    from .importer import DialectFinder
+                    origin, dialect_name, version, data = entry
+                    DialectFinder._add_compiled(fullname, origin, dialect_name, version, marshal.loads(data))
+                    logger.info("Prefetched module '%s' (dialect '%s')", fullname, dialect_name)
+        except Exception as err:  # e.g. a worker died
+            logger.debug("Prefetching '%s' failed: %s", name, err)
+        with self._lock:
+            _, ready = self._pending.pop(name)
+            ready.set()
+            for name in imports:
+                if name not in self._seen and name not in sys.modules:
+                    self._seen.add(name)
+                    self._queue.append(name)
+            self._submit()
+
+    def wait(self, fullname):
+        """If the module ``fullname`` is being prefetched, wait until it is done."""
+        with self._lock:
+            pending = self._pending.get(fullname)
+            if pending is None:
+                try:  # queued but not submitted; the caller compiles it now
+                    self._queue.remove(fullname)
+                except ValueError:
+                    pass
+                return
+        pending[1].wait()
+
+    def shutdown(self):
+        """Stop prefetching; cancel the queued jobs, and wait for the running ones."""
+        with self._lock:
+            self._closed = True
+            self._queue.clear()
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            for future, _ in list(self._pending.values()):
+                future.cancel()
+            pool.shutdown(wait=True)
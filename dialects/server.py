@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""Fork server for the ``pydialect`` bootstrapper (POSIX only).
+
+Starting a dialect program costs an interpreter startup, plus importing MacroPy,
+the dialect modules, and the macro libraries they use, before any real work
+is done. For many short-lived runs (cron jobs, test suites), start a server
+that does all that once::
+
+    pydialect --server $XDG_RUNTIME_DIR/pydialect.sock --preload unpythonic.syntax lispython
+
+and point the bootstrapper to it::
+
+    export PYDIALECT_SERVER=$XDG_RUNTIME_DIR/pydialect.sock
+    pydialect -m mymodule
+
+The client (the bootstrapper) connects to the server's Unix domain socket, and
+sends its command line, working directory, environment and ``sys.path``, and
+its standard input, output and error file descriptors (``SCM_RIGHTS``). The
+server forks; the child takes over the client's file descriptors and state,
+and runs the program as ``pydialect`` would, with everything the server has
+preloaded already in memory. The client waits for the program to finish, and
+exits with its exit status. While waiting, it forwards ``SIGINT``, ``SIGTERM``
+and ``SIGHUP`` to the child.
+
+If no server is listening at ``PYDIALECT_SERVER``, the bootstrapper runs the
+program itself, as usual.
+
+The client hands its environment and its terminal to the server, so both ends
+check that the other one runs as the same user (``SO_PEERCRED`` where
+available, else the owner of the socket file), and the socket is created with
+mode 0600. Still, put the socket in a directory only you can write to, such as
+``$XDG_RUNTIME_DIR``, not in ``/tmp``.
+
+Note the server should be started with the same Python (and versions of the
+libraries) as the client would use, and it must not start threads while
+preloading, since only the forking thread survives ``fork``. Modules loaded
+by the server are shared by all runs as they were when the server started;
+restart the server to pick up changes to them (the dialect modules of the
+programs themselves are loaded in the child, so they are always current).
+"""
+
+__all__ = ["serve", "request"]
+
+import array
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+import traceback
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!I")  # length of the request
+_INT = struct.Struct("!i")  # child pid, then exit status
+_CREDS = struct.Struct("3i")  # struct ucred
+
+def _recv_exactly(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(n)
+        if not chunk:
+            raise EOFError("Connection closed")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+def _send_request(sock, data, fds):
+    """Send ``data`` (bytes), passing the file descriptors ``fds`` along."""
+    sock.sendmsg([_HEADER.pack(len(data))],
+                 [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))])
+    sock.sendall(data)
+
+def _recv_request(sock, maxfds=3):
+    """Receive a request sent by ``_send_request``. Return ``(data, fds)``."""
+    fds = array.array("i")
+    msg, ancdata, flags, addr = sock.recvmsg(_HEADER.size, socket.CMSG_LEN(maxfds * fds.itemsize))
+    for level, kind, cdata in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cdata[:len(cdata) - (len(cdata) % fds.itemsize)])
+    if len(msg) < _HEADER.size:
+        msg += _recv_exactly(sock, _HEADER.size - len(msg))
+    (length,) = _HEADER.unpack(msg)
+    return _recv_exactly(sock, length), list(fds)
+
+def _peer_uid(sock):
+    """Return the uid of the process at the other end of the Unix domain socket ``sock``.
+
+    Return ``None`` if the platform does not tell (no ``SO_PEERCRED``).
+    """
+    if not hasattr(socket, "SO_PEERCRED"):  # Linux only
+        return None
+    creds = _CREDS.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, _CREDS.size))
+    return creds[1]  # pid, uid, gid
+
+def _is_own(sock, path):
+    """Return whether the peer of ``sock`` (connected to the socket file ``path``) runs as the current user."""
+    uid = _peer_uid(sock)
+    if uid is None:
+        try:
+            uid = os.stat(path).st_uid
+        except OSError:
+            return False
+    return uid == os.getuid()
+
+def request(path, argv):
+    """Run the program ``argv`` (the bootstrapper's command line) in the server at ``path``.
+
+    Return the exit status of the program, or ``None`` if no server (of the
+    current user) is listening at ``path``; then the caller should run the
+    program itself.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    with sock:
+        if not _is_own(sock, path):
+            print("pydialect: the server at {} belongs to another user, not using it".format(path),
+                  file=sys.stderr)
+            return None
+        data = json.dumps({"argv": argv, "cwd": os.getcwd(), "environ": dict(os.environ),
+                           "path": sys.path}).encode("utf-8")
+        _send_request(sock, data, [0, 1, 2])
+        try:
+            (pid,) = _INT.unpack(_recv_exactly(sock, _INT.size))
+        except EOFError:
+            print("pydialect: the server at {} closed the connection".format(path), file=sys.stderr)
+            return 1
+        def forward(signum, frame):
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, forward)
+        try:
+            (status,) = _INT.unpack(_recv_exactly(sock, _INT.size))
+        except EOFError:  # the child died without reporting
+            return 1
+        return status
+
+def _exit_status(err):
+    """Return the process exit status for the ``SystemExit`` exception ``err``, like Python does."""
+    if err.code is None:
+        return 0
+    if isinstance(err.code, int):
+        return err.code
+    print(err.code, file=sys.stderr)
+    return 1
+
+def _run_child(conn, data, fds, run):
+    """In the forked child: take over the client's state, run the program, report the exit status."""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    state = json.loads(data.decode("utf-8"))
+    for target, fd in enumerate(fds[:3]):
+        os.dup2(fd, target)
+        os.close(fd)
+    # The server's streams may have been set up for a log file; set them up for the client's.
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", buffering=(1 if os.isatty(1) else -1), closefd=False)
+    sys.stderr = open(2, "w", buffering=1, closefd=False)
+    os.chdir(state["cwd"])
+    os.environ.clear()
+    os.environ.update(state["environ"])
+    sys.path[:] = state["path"]
+    sys.argv[:] = state["argv"]
+    conn.sendall(_INT.pack(os.getpid()))
+
+    status = 0
+    try:
+        run()
+    except SystemExit as err:
+        status = _exit_status(err)
+    except KeyboardInterrupt:
+        traceback.print_exc()
+        status = 128 + signal.SIGINT
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    try:
+        import atexit
+        atexit._run_exitfuncs()  # we leave with os._exit, to not unwind into the server loop
+    except BaseException:
+        traceback.print_exc()
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+    try:
+        conn.sendall(_INT.pack(status))
+    except OSError:
+        pass
+    os._exit(status)
+
+def serve(path, run, preload=()):
+    """Serve ``pydialect`` runs on the Unix domain socket ``path``, until interrupted.
+
+    ``run``: function of no arguments, called in a forked child for each
+    client, with ``sys.argv`` set to the client's command line; it runs the
+    program.
+
+    ``preload``: names of modules to import before serving, e.g. dialects and
+    macro libraries. MacroPy (if installed) and the dialect import hook are
+    always loaded.
+    """
+    if not hasattr(os, "fork") or not hasattr(socket, "AF_UNIX"):
+        raise OSError("The pydialect server requires a POSIX system")
+    import importlib
+    import dialects.activate
+    dialects.activate._activate_macropy()
+    for name in preload:
+        logger.info("Preloading '%s'", name)
+        importlib.import_module(name)
+
+    if os.path.exists(path):  # a stale socket, unless some server is still listening
+        if _is_listening(path):
+            raise OSError("A server is already listening at {}".format(path))
+        os.unlink(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)  # create the socket file with mode 0600
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(128)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # no zombies; we don't need the children's status
+    print("pydialect server listening at {} (Ctrl+C to quit)".format(path), file=sys.stderr)
+    try:
+        while True:
+            conn, _ = server.accept()
+            fds = []
+            try:
+                if not _is_own(conn, path):
+                    logger.warning("Refusing a connection from another user")
+                    continue
+                data, fds = _recv_request(conn)
+                for stream in (sys.stdout, sys.stderr):
+                    stream.flush()
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        server.close()
+                        _run_child(conn, data, fds, run)  # does not return
+                    finally:  # never unwind into the server loop in the child
+                        os._exit(1)
+            except EOFError:  # e.g. a client checking whether we are up
+                pass
+            except Exception:
+                traceback.print_exc()
+            finally:
+                for fd in fds:
+                    os.close(fd)
+                conn.close()
+    finally:
+        server.close()
+        os.unlink(path)
+
+def _is_listening(path):
+    """Return whether a server is listening at ``path``."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Memory benchmark: steady-state RSS after importing a few hundred dialect modules.
+
+Not part of the test suite; run it manually::
+
+    python3 -m dialects.test.bench_memory [-n NMODULES]
+
+Each configuration runs in a fresh interpreter, and the compile cache is not
+used, so that every module is actually expanded. It asserts that, once the
+modules have run, Pydialect no longer holds their code objects (nor their
+trees, unless retained).
+"""
+
+import argparse
+import gc
+import os
+import subprocess
+import sys
+
+from dialects.test.fixtures import environment, make_fixtures, tempdir
+
+# A dialect whose AST transform does a bit of work, so that the final tree
+# is larger than the parsed source (like a template-based dialect would).
+DIALECT = '''\
+import ast
+PRELUDE = ast.parse("""
+def double(x):
+    return 2 * x
+def triple(x):
+    return 3 * x
+""").body
+def source_transformer(source):
+    return source.replace("<<<", "*")
+def ast_transformer(body):
+    return PRELUDE + body
+'''
+
+FUNCTION = '''
+def f{k}(a, b=2, *args, **kwargs):
+    """Function number {k}."""
+    x = [double(a) <<< i for i in range(b)]
+    y = {{"key{k}": triple(a), "other": (a, b, args)}}
+    if a > {k}:
+        return sum(x) + len(y)
+    return kwargs.get("z", {k})
+'''
+
+def bench_fixtures(directory, nmodules, nfunctions=100):
+    body = "".join(FUNCTION.format(k=k) for k in range(nfunctions))
+    files = {"benchdialect.py": DIALECT,
+             os.path.join("benchpkg", "__init__.py"): ""}
+    for j in range(nmodules):
+        files[os.path.join("benchpkg", "mod{}.py".format(j))] = \
+            '"""Benchmark module {}."""\nfrom __lang__ import benchdialect\n'.format(j) + body
+    make_fixtures(directory, files)
+
+def rss():
+    """Return the resident set size of this process, in bytes (``None`` if not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def child(directory, nmodules, retain):
+    """Import the fixture modules. Print the RSS, and what Pydialect still holds on to."""
+    sys.path.insert(0, directory)
+    sys.dont_write_bytecode = True  # don't use (or fill) the compile cache
+    import dialects.activate  # noqa: F401
+    from dialects.importer import DialectFinder
+    DialectFinder.retain_trees = retain
+    names = ["benchpkg.mod{}".format(j) for j in range(nmodules)]
+    before = rss()
+    for name in names:
+        __import__(name)
+    gc.collect()
+    after = rss()
+    trees = sum(1 for name in names if sys.modules[name].__spec__.loader.tree is not None)
+    print(before, after, len(DialectFinder._compiled), trees)
+
+def main():
+    parser = argparse.ArgumentParser(description="""Measure steady-state memory use after importing dialect modules.""")
+    parser.add_argument('-n', dest='nmodules', type=int, default=300, metavar='N',
+                        help='number of dialect modules to import (default 300)')
+    parser.add_argument('--child', dest='child', default=None, type=str, metavar='dir',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--retain', dest='retain', action="store_true", default=False,
+                        help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.child:
+        child(opts.child, opts.nmodules, opts.retain)
+        return
+
+    env = environment()
+    with tempdir() as directory:
+        bench_fixtures(directory, opts.nmodules)
+        for retain in (False, True):
+            command = [sys.executable, "-m", "dialects.test.bench_memory",
+                       "-n", str(opts.nmodules), "--child", directory]
+            if retain:
+                command.append("--retain")
+            output = subprocess.check_output(command, env=env, universal_newlines=True)
+            before, after, compiled, trees = output.split()
+            assert compiled == "0", "{} code objects still held".format(compiled)
+            assert trees == (str(opts.nmodules) if retain else "0"), "{} trees held".format(trees)
+            if before == "None":
+                print("RSS not available on this platform")
+                return
+            print("{:d} modules, trees {}: RSS {:0.1f} MiB (+{:0.1f} MiB for the modules)".format(
+                  opts.nmodules, "retained" if retain else "dropped ",
+                  int(after) / 2**20, (int(after) - int(before)) / 2**20))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Benchmark: importing many small dialect modules, with a template-based dialect.
+
+Not a test (it asserts nothing); run it manually::
+
+    python3 -m dialects.test.bench_template [-n NMODULES]
+
+Compares a dialect that builds its template for every module and splices it
+with ``splice_ast`` (as a dialect using MacroPy's ``with q as template:`` in
+its ``ast_transformer`` does), to one that uses a ``dialects.util.Template``.
+Each configuration runs in a fresh interpreter, and the compile cache is not
+used, so that every module is actually transformed.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+from dialects.test.fixtures import environment, make_fixtures, tempdir
+
+# The template is built by parsing, so that the benchmark needs no macro library.
+# It imports plenty of names, like a real dialect does to provide its builtins.
+TEMPLATE = '''\
+TEMPLATE = """
+from operator import add, sub, mul, truediv, floordiv, mod, pow, neg, pos, abs, \\\\
+                     eq, ne, lt, le, gt, ge, and_, or_, xor, not_, truth, \\\\
+                     itemgetter, attrgetter, methodcaller
+from functools import reduce, partial, wraps, lru_cache
+from itertools import chain, count, cycle, repeat, islice, starmap, tee, \\\\
+                      takewhile, dropwhile, groupby, product, permutations
+from collections import deque, defaultdict, namedtuple, OrderedDict, Counter
+if True:
+    if True:
+        __paste_here__
+"""
+def make_template():
+    template = ast.parse(TEMPLATE).body
+    for node in ast.walk(ast.Module(body=template)):  # like a quasiquoted template, no source locations
+        for attr in ("lineno", "col_offset", "end_lineno", "end_col_offset"):
+            if hasattr(node, attr):
+                delattr(node, attr)
+    return template
+'''
+
+DIALECTS = {"rebuild": '''\
+import ast
+from dialects.util import splice_ast
+{template}
+def ast_transformer(module_body):
+    return splice_ast(module_body, make_template(), "__paste_here__")
+''', "template": '''\
+import ast
+from dialects.util import Template
+{template}
+template = Template(make_template(), "__paste_here__")
+def ast_transformer(module_body):
+    return template.splice(module_body)
+'''}
+
+MODULE = '''\
+"""Benchmark module {k}."""
+from __lang__ import {dialect}
+def f(x):
+    return reduce(add, islice(count(x), 10))
+assert f({k}) == 10 * {k} + 45
+'''
+
+def bench_fixtures(directory, nmodules):
+    files = {}
+    for kind, dialect in DIALECTS.items():
+        package = "bench_{}".format(kind)
+        files[os.path.join(package, "__init__.py")] = ""
+        files["benchdialect_{}.py".format(kind)] = dialect.format(template=TEMPLATE)
+        for k in range(nmodules):
+            files[os.path.join(package, "mod{}.py".format(k))] = MODULE.format(k=k, dialect="benchdialect_{}".format(kind))
+    make_fixtures(directory, files)
+
+def child(directory, nmodules, kind):
+    """Import the fixture modules, and print the time taken."""
+    import time
+    sys.path.insert(0, directory)
+    sys.dont_write_bytecode = True  # don't use (or fill) the compile cache
+    import dialects.activate  # noqa: F401
+    __import__("benchdialect_{}".format(kind))  # not part of the measurement
+    t0 = time.perf_counter()
+    for k in range(nmodules):
+        __import__("bench_{}.mod{}".format(kind, k))
+    print(time.perf_counter() - t0)
+
+def main():
+    parser = argparse.ArgumentParser(description="""Measure the import time of many small template-based dialect modules.""")
+    parser.add_argument('-n', dest='nmodules', type=int, default=500, metavar='N',
+                        help='number of dialect modules to import (default 500)')
+    parser.add_argument('--child', dest='child', default=None, type=str, metavar='dir',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--kind', dest='kind', default=None, type=str,
+                        help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.child:
+        child(opts.child, opts.nmodules, opts.kind)
+        return
+
+    env = environment()
+    with tempdir() as directory:
+        bench_fixtures(directory, opts.nmodules)
+        for kind in ("rebuild", "template"):
+            command = [sys.executable, "-m", "dialects.test.bench_template",
+                       "-n", str(opts.nmodules), "--child", directory, "--kind", kind]
+            dt = float(subprocess.check_output(command, env=env, universal_newlines=True))
+            print("{:d} modules, {:8s}: {:0.3f} s ({:0.2f} ms per module)".format(
+                  opts.nmodules, kind, dt, 1000 * dt / opts.nmodules))
+
+if __name__ == '__main__':
+    main()
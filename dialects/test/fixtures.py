@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Helpers for the tests: temporary module trees, and test dialects.
+
+Not a test module itself. The tests import it as ``dialects.test.fixtures``.
+"""
+
+import contextlib
+import importlib
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+
+import dialects
+
+# The directory that contains the ``dialects`` package, the example dialects and ``pydialect``.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(dialects.__file__)))
+PYDIALECT = os.path.join(ROOT, "pydialect")
+
+# A dialect whose definition uses macros at module level (like the example dialects do).
+# ``<<<`` means ``*``, and ``answer`` is defined at the start of each module.
+MACRO_DIALECT = '''\
+import ast
+from macropy.core.quotes import macros, q
+with q as template:
+    answer = 21
+def source_transformer(source):
+    return source.replace("<<<", "*")
+def ast_transformer(body):
+    return ast.fix_missing_locations(ast.Module(body=template + body)).body
+'''
+
+# Without MacroPy, a pure source-transform dialect that does the same (keeping the line numbers).
+SOURCE_DIALECT = '''\
+import re
+def source_transformer(source):
+    source = source.replace("<<<", "*")
+    return re.sub(r"^(from __lang__ import \\w+)", r"\\1; answer = 21", source, count=1, flags=re.M)
+'''
+
+def have(module):
+    """Return whether the top-level module ``module`` is installed, without importing it."""
+    return importlib.util.find_spec(module) is not None
+
+def dialect_source():
+    """Return the source of ``MACRO_DIALECT`` if MacroPy is installed, else that of ``SOURCE_DIALECT``."""
+    return MACRO_DIALECT if have("macropy") else SOURCE_DIALECT
+
+def write(path, text, mtime=None):
+    """Write ``text`` into the file ``path``, creating its directory if needed.
+
+    ``mtime``: if given, set the modification time, so that a change is seen
+    even with a coarse mtime resolution.
+    """
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, "w") as f:
+        f.write(text)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+def make_fixtures(directory, files):
+    """Write ``files``, a dict ``{path relative to directory: text}``."""
+    for filename, text in files.items():
+        write(os.path.join(directory, filename), text)
+    importlib.invalidate_caches()
+
+@contextlib.contextmanager
+def tempdir(on_path=False):
+    """Make a temporary directory, removed at exit; if ``on_path``, put it at the start of ``sys.path`` meanwhile."""
+    directory = tempfile.mkdtemp()
+    if on_path:
+        sys.path.insert(0, directory)
+    try:
+        yield directory
+    finally:
+        if on_path:
+            sys.path.remove(directory)
+        shutil.rmtree(directory)
+
+@contextlib.contextmanager
+def dont_write_bytecode(value):
+    """Set ``sys.dont_write_bytecode`` (which also controls the compile cache) to ``value`` meanwhile."""
+    old, sys.dont_write_bytecode = sys.dont_write_bytecode, value
+    try:
+        yield
+    finally:
+        sys.dont_write_bytecode = old
+
+def forget(names):
+    """Make the next import of the modules ``names`` load them again."""
+    from dialects.importer import DialectFinder
+    for name in names:
+        sys.modules.pop(name, None)
+    DialectFinder.invalidate(names)
+
+def environment(*directories):
+    """Return the environment for running a test program in a fresh interpreter.
+
+    ``directories`` and ``ROOT`` are prepended to ``PYTHONPATH``; a fork server
+    the tests themselves may be run with is not used.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(list(directories) + [ROOT] +
+                                        ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    env.pop("PYDIALECT_SERVER", None)
+    return env
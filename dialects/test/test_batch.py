@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Test importing a batch of dialect modules, expanding them in parallel (``dialects.import_many``)."""
+
+import concurrent.futures
+import importlib
+import os
+import sys
+
+from dialects import cache, import_many
+from dialects.test.fixtures import make_fixtures, tempdir, dont_write_bytecode, forget, write
+
+NMODULES = 6
+
+DIALECT = '''\
+def source_transformer(source):
+    return source.replace("<<<", "*")
+'''
+
+# Module k imports module k + 1 at module level, and records the order of execution.
+MODULE = '''\
+"""Batch test module {k}."""
+from __lang__ import batchdialect
+import batchlog
+{imports}
+batchlog.order.append({k})
+value = {k} <<< 2
+'''
+
+def batch_fixtures(directory):
+    files = {"batchdialect.py": DIALECT,
+             "batchlog.py": "order = []\n",
+             os.path.join("batchpkg", "__init__.py"): ""}
+    for k in range(NMODULES):
+        imports = "import batchpkg.mod{}".format(k + 1) if k + 1 < NMODULES else ""
+        files[os.path.join("batchpkg", "mod{}.py".format(k))] = MODULE.format(k=k, imports=imports)
+    make_fixtures(directory, files)
+    return ["batchpkg.mod{}".format(k) for k in range(NMODULES)]
+
+class RecordingPool(concurrent.futures.ProcessPoolExecutor):
+    """A process pool that records how it was started."""
+    started = []
+    def __init__(self, max_workers=None, **kwargs):
+        RecordingPool.started.append(max_workers)
+        super().__init__(max_workers=max_workers, **kwargs)
+
+def main():
+    with tempdir(on_path=True) as directory, dont_write_bytecode(False):  # the warm runs use the compile cache
+        check_batch(directory)
+
+    print("All tests PASSED")
+
+def check_batch(directory):
+    old_backend = cache.backend
+    old_pool = concurrent.futures.ProcessPoolExecutor
+    concurrent.futures.ProcessPoolExecutor = RecordingPool
+    try:
+        import dialects.activate  # noqa: F401
+        names = batch_fixtures(directory)
+        batchlog = importlib.import_module("batchlog")
+
+        # Cold: everything is expanded in the workers, none in this process.
+        modules = import_many(names, workers=2)
+        assert [m.__name__ for m in modules] == names
+        assert [m.value for m in modules] == [2 * k for k in range(NMODULES)]
+        assert batchlog.order == list(reversed(range(NMODULES))), batchlog.order
+        assert RecordingPool.started == [2], RecordingPool.started
+        assert "batchdialect" not in sys.modules  # the dialect was only needed in the workers
+
+        # Warm: all in the compile cache, so no workers are started.
+        forget(names)
+        batchlog.order.clear()
+        modules = import_many(list(reversed(names)), workers=2)
+        assert [m.__name__ for m in modules] == list(reversed(names))
+        assert [m.value for m in modules] == [2 * k for k in reversed(range(NMODULES))]
+        assert batchlog.order == list(reversed(range(NMODULES))), batchlog.order
+        assert RecordingPool.started == [2], RecordingPool.started
+
+        # Only the changed module is sent to a worker.
+        forget(names)
+        write(os.path.join(directory, "batchpkg", "mod3.py"), MODULE.format(k=3, imports="import batchpkg.mod4") +
+              "value = value + 1\n", mtime=2e9)
+        modules = import_many(names, workers=2)
+        assert [m.value for m in modules] == [2 * k + (k == 3) for k in range(NMODULES)]
+        assert RecordingPool.started == [2, 1], RecordingPool.started
+
+        # With a pack file backend: the parent maps the pack to load the hits,
+        # and the backend is then sent to the workers for the misses.
+        cache.backend = cache.PackStore(os.path.join(directory, "cache.pack"))
+        forget(names)
+        modules = import_many(names, workers=2)
+        assert [m.value for m in modules] == [2 * k + (k == 3) for k in range(NMODULES)]
+        assert RecordingPool.started == [2, 1, 2], RecordingPool.started
+        forget(names)
+        write(os.path.join(directory, "batchpkg", "mod4.py"), MODULE.format(k=4, imports="import batchpkg.mod5") +
+              "value = value + 1\n", mtime=2e9)
+        modules = import_many(names, workers=2)
+        assert cache.backend._map is not None
+        assert [m.value for m in modules] == [2 * k + (k in (3, 4)) for k in range(NMODULES)]
+        assert RecordingPool.started == [2, 1, 2, 1], RecordingPool.started
+    finally:
+        cache.backend = old_backend
+        concurrent.futures.ProcessPoolExecutor = old_pool
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Test bundling a program into a zipapp (``pydialect --bundle``, ``dialects.bundle``)."""
+
+import os
+import subprocess
+import sys
+
+from dialects.bundle import find_closure
+from dialects.test.fixtures import PYDIALECT, dialect_source, environment, make_fixtures, tempdir
+
+HELPER = '''\
+"""Helper module."""
+from __lang__ import bnddialect
+import json  # stdlib; not bundled
+def double(x):
+    return x <<< 2
+'''
+
+# Reports where it runs.
+MAIN = '''\
+"""Main module."""
+from __lang__ import bnddialect
+import sys
+from bndpkg import helper, plain
+print("name", __name__)
+print("values", helper.double(answer), plain.value)
+print("dialects", "dialects" in sys.modules or "bnddialect" in sys.modules)
+print("argv", " ".join(sys.argv[1:]))
+'''
+
+FILES = {"bnddialect.py": dialect_source(),
+         os.path.join("bndpkg", "__init__.py"): "",
+         os.path.join("bndpkg", "__main__.py"): MAIN,
+         os.path.join("bndpkg", "helper.py"): HELPER,
+         os.path.join("bndpkg", "plain.py"): "value = 42\n",
+         "script.py": MAIN}
+
+def run_bundle(archive, cwd):
+    """Run the bundle ``archive`` under plain Python; return its output as a dict."""
+    env = dict(os.environ)
+    env.pop("PYTHONPATH", None)  # neither Pydialect nor the sources are needed
+    output = subprocess.check_output([sys.executable, archive, "some", "args"], env=env, cwd=cwd,
+                                     universal_newlines=True)
+    return dict(line.split(" ", 1) for line in output.splitlines())
+
+def main():
+    with tempdir() as directory, tempdir() as elsewhere:
+        make_fixtures(directory, FILES)
+
+        # The closure: the non-stdlib modules of the program, expanded.
+        sys.path.insert(0, directory)
+        try:
+            entry, modules = find_closure("bndpkg")
+        finally:
+            sys.path.remove(directory)
+        assert entry == "bndpkg.__main__"
+        assert sorted(modules) == ["bndpkg", "bndpkg.__main__", "bndpkg.helper", "bndpkg.plain"], sorted(modules)
+        assert modules["bndpkg"][0] and not modules["bndpkg.helper"][0]  # is_package
+        assert modules["bndpkg.helper"][1] == os.path.join(directory, "bndpkg", "helper.py")
+
+        env = environment()
+        for archive, args in (("app.pyz", ["-m", "bndpkg"]), ("script.pyz", ["script.py"])):
+            output = subprocess.check_output([sys.executable, PYDIALECT, "--bundle", archive] + args,
+                                             env=env, cwd=directory, universal_newlines=True)
+            assert output.startswith("Wrote {} (4 modules)".format(archive)), output
+            archive = os.path.join(directory, archive)
+            assert os.access(archive, os.X_OK)
+
+            # The bundle runs under plain Python, from anywhere.
+            output = run_bundle(archive, elsewhere)
+            assert output["name"] == "__main__", output
+            assert output["values"] == "42 42", output
+            assert output["dialects"] == "False", output
+            assert output["argv"] == "some args", output
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
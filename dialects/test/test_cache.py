@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Test the compile cache backends."""
+
+import importlib.machinery
+import os
+import shutil
+import sys
+
+from dialects import cache
+from dialects.importer import DialectFinder
+from dialects.test.fixtures import dont_write_bytecode, make_fixtures, tempdir, write
+
+# The transformer lives in a helper module, which is thus a dependency of
+# the cache entries, but not part of the content key.
+DIALECT = '''\
+from cachehelper import source_transformer
+'''
+
+HELPER = '''\
+def source_transformer(source):
+    return source.replace("<<<", "{op}")
+'''
+
+MODULE = '''\
+"""Test module."""
+from __lang__ import cachedialect
+value = 6 <<< 7
+'''
+
+def spec_of(name, directory):
+    return importlib.machinery.PathFinder.find_spec(name, [directory])
+
+def value_of(code):
+    namespace = {}
+    exec(code, namespace)
+    return namespace["value"]
+
+def check_backend(directory, backend):
+    """Run a module through the cache of ``backend``, changing a dependency in between."""
+    src = os.path.join(directory, "src")
+    helper = os.path.join(directory, "cachehelper.py")
+    make_fixtures(directory, {"cachedialect.py": DIALECT,
+                              os.path.join("src", "cachemod.py"): MODULE})
+    write(helper, HELPER.format(op="*"), mtime=1e9)
+    spec = spec_of("cachemod", src)
+
+    old_backend, cache.backend = cache.backend, backend
+    try:
+        assert cache.load(spec.origin, "cachedialect", "cachemod") is None
+        assert DialectFinder.compile_module(spec) == "compiled"
+        assert DialectFinder.compile_module(spec) == "cached"
+        assert value_of(cache.load(spec.origin, "cachedialect", "cachemod")) == 42
+
+        # A dependency that is not part of the key changes. The entry is stale,
+        # and compiling the module again must replace it.
+        write(helper, HELPER.format(op="+"), mtime=2e9)
+        assert cache.load(spec.origin, "cachedialect", "cachemod") is None
+        sys.modules.pop("cachehelper")  # the dialect is reloaded below, as by a fresh process
+        sys.modules.pop("cachedialect")
+        assert DialectFinder.compile_module(spec) == "compiled"
+        assert DialectFinder.compile_module(spec) == "cached"
+        assert value_of(cache.load(spec.origin, "cachedialect", "cachemod")) == 13
+
+        if not isinstance(backend, cache.PycacheStore):
+            # The entry does not depend on the location of the source file.
+            moved = os.path.join(directory, "moved")
+            os.makedirs(moved)
+            shutil.copy(os.path.join(src, "cachemod.py"), moved)
+            code = cache.load(os.path.join(moved, "cachemod.py"), "cachedialect", "cachemod")
+            assert code is not None and value_of(code) == 13
+            if sys.version_info >= (3, 8):
+                assert code.co_filename == os.path.join(moved, "cachemod.py")
+            # It does depend on the name of the module; the same source may expand
+            # differently in another package (e.g. with relative macro-imports).
+            assert cache.load(os.path.join(moved, "cachemod.py"), "cachedialect", "otherpkg.cachemod") is None
+
+        if isinstance(backend, cache.PackStore):
+            # Compacting drops the replaced data, and keeps the current entry.
+            size = os.path.getsize(backend.path)
+            assert backend.compact() == 1
+            assert os.path.getsize(backend.path) < size
+            assert value_of(cache.load(spec.origin, "cachedialect", "cachemod")) == 13
+    finally:
+        cache.backend = old_backend
+        sys.modules.pop("cachehelper", None)
+        sys.modules.pop("cachedialect", None)
+
+def main():
+    with dont_write_bytecode(False):  # this test is about the compile cache
+        for make_backend in (lambda directory: cache.PycacheStore(),
+                             lambda directory: cache.ContentStore(os.path.join(directory, "cache")),
+                             lambda directory: cache.PackStore(os.path.join(directory, "cache.pack"), slots=16)):
+            with tempdir(on_path=True) as directory:
+                check_backend(directory, make_backend(directory))
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Test exporting dialect modules as plain Python source (``python3 -m dialects.export``)."""
+
+import ast
+import json
+import os
+import subprocess
+import sys
+
+from dialects.test.fixtures import dialect_source, environment, have, make_fixtures, tempdir
+
+MODULE = '''\
+"""Export test module."""
+from __lang__ import expdialect
+value = 6 <<< 7
+
+def fail():
+    raise ValueError("boom")
+'''
+
+# Run under plain Python, against the exported tree only.
+CHECK = '''\
+import sys, traceback
+import exppkg.mod, exppkg.plain
+print("value", exppkg.mod.value)
+print("answer", exppkg.mod.answer)
+print("lang", exppkg.mod.__lang__)
+print("doc", exppkg.mod.__doc__)
+print("dialects", "dialects" in sys.modules)
+try:
+    exppkg.mod.fail()
+except ValueError:
+    print("line", traceback.extract_tb(sys.exc_info()[2])[-1].lineno)
+'''
+
+FILES = {"expdialect.py": dialect_source(),
+         os.path.join("src", "exppkg", "__init__.py"): "",
+         os.path.join("src", "exppkg", "mod.py"): MODULE,
+         os.path.join("src", "exppkg", "plain.py"): "value = 42\n",
+         os.path.join("src", "exppkg", "data.txt"): "some data\n",
+         os.path.join("src", "exppkg", "__pycache__", "junk.pyc"): "",
+         os.path.join("src", "badpkg", "__init__.py"): "",
+         os.path.join("src", "badpkg", "bad.py"): "from __lang__ import expdialect\nvalue = (\n"}
+
+def main():
+    if not hasattr(ast, "unparse") and not have("macropy"):
+        print("Needs Python 3.9+ or MacroPy, skipping")
+        return
+    with tempdir() as directory:
+        make_fixtures(directory, FILES)
+        out = os.path.join(directory, "out")
+        env = environment(directory)
+        def export(path):
+            return subprocess.run([sys.executable, "-m", "dialects.export", "-o", out, path], env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+        process = export(os.path.join(directory, "src", "exppkg"))
+        assert process.returncode == 0, process.stdout
+        assert "exported  exppkg.mod (expdialect)" in process.stdout, process.stdout
+        exported = os.path.join(out, "exppkg")
+        assert sorted(os.listdir(exported)) == ["__init__.py", "data.txt", "mod.py", "mod.py.linemap.json", "plain.py"]
+        with open(os.path.join(exported, "plain.py")) as f:
+            assert f.read() == "value = 42\n"  # copied as-is
+
+        # The exported tree runs without Pydialect (nor the dialect definition).
+        plain_env = dict(os.environ)
+        plain_env["PYTHONPATH"] = out
+        output = subprocess.check_output([sys.executable, "-c", CHECK], env=plain_env, cwd=out,
+                                         universal_newlines=True)
+        output = dict(line.split(" ", 1) for line in output.splitlines())
+        assert output["value"] == "42", output
+        assert output["answer"] == "21", output
+        assert output["lang"] == "expdialect", output
+        assert output["doc"] == "Export test module.", output
+        assert output["dialects"] == "False", output
+
+        # The line map takes a line of the exported code back to the original source.
+        with open(os.path.join(exported, "mod.py.linemap.json")) as f:
+            linemap = json.load(f)
+        assert linemap["source"] == os.path.join(directory, "src", "exppkg", "mod.py")
+        assert linemap["lines"][int(output["line"]) - 1] == 6, (output["line"], linemap)
+
+        # Failures are reported, and give a nonzero exit status.
+        process = export(os.path.join(directory, "src", "badpkg"))
+        assert process.returncode == 1, process.stdout
+        assert "FAILED    badpkg.bad" in process.stdout, process.stdout
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Test incremental expansion of dialect modules (``dialects.incremental``)."""
+
+import importlib
+import os
+import sys
+import traceback
+
+from dialects import incremental
+from dialects.importer import DialectFinder
+from dialects.test.fixtures import dont_write_bytecode, make_fixtures, tempdir, write
+
+# A statement-local AST dialect, which also injects an import: ``a ^ b`` means ``mul(a, b)``.
+# It records the number of statements it was run on, each time.
+DIALECT = '''\
+import ast
+incremental = True
+calls = []
+class _Mul(ast.NodeTransformer):
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if type(node.op) is not ast.BitXor:
+            return node
+        func = ast.Name(id="mul", ctx=ast.Load())
+        return ast.copy_location(ast.Call(func=func, args=[node.left, node.right], keywords=[]), node)
+def ast_transformer(body):
+    calls.append(len(body))
+    header = ast.parse("from operator import mul").body
+    return ast.fix_missing_locations(ast.Module(body=header + [_Mul().visit(stmt) for stmt in body])).body
+'''
+
+VERSION1 = '''\
+"""Test module."""
+from __lang__ import incdialect
+def f(x):
+    return x ^ 3
+y = f(2)
+def g():
+    raise ValueError("boom")
+'''
+
+# Only ``f`` changes; ``y`` and ``g`` are reused, and ``g`` moves down a line.
+VERSION2 = '''\
+"""Test module."""
+from __lang__ import incdialect
+def f(x):
+    # now times four
+    return x ^ 4
+y = f(2)
+def g():
+    raise ValueError("boom")
+'''
+
+# A ``Template`` dialect, like ``lispython``. Its template binds a name that the user code redefines.
+# Without MacroPy, the dialect removes the macro-import itself (as MacroPy would).
+TEMPLATE_DIALECT = '''\
+import ast
+import importlib.util
+from dialects.util import Template
+incremental = True
+template = Template(ast.parse("from macropy.core.quotes import macros, q\\n"
+                              "from operator import add as plus\\n"
+                              "__paste_here__\\n").body, "__paste_here__")
+def ast_transformer(body):
+    body = template.splice(body)
+    if importlib.util.find_spec("macropy") is None:
+        body = [stmt for stmt in body if not (type(stmt) is ast.ImportFrom and stmt.names[0].name == "macros")]
+    return body
+'''
+
+TEMPLATE_MODULE = '''\
+"""Template test module."""
+from __lang__ import inctdialect
+def plus(a, b):
+    return "user plus"
+value = plus(1, 2)
+'''
+
+def raise_line(function):
+    """Return the line number where ``function()`` raises."""
+    try:
+        function()
+    except ValueError:
+        return traceback.extract_tb(sys.exc_info()[2])[-1].lineno
+    assert False
+
+def check_incremental(directory):
+    import dialects.activate  # noqa: F401
+    make_fixtures(directory, {"incdialect.py": DIALECT})
+    path = os.path.join(directory, "incmod.py")
+
+    # Not enabled: the dialect declares support, but the module is expanded whole.
+    write(path, VERSION1, mtime=1e9)
+    importlib.invalidate_caches()
+    module = importlib.import_module("incmod")
+    calls = importlib.import_module("incdialect").calls
+    assert calls == [3], calls
+    assert module.y == 6
+    assert not incremental._segments
+    del sys.modules["incmod"]
+    DialectFinder.invalidate(["incmod"])
+
+    # Enabled: one expansion per statement.
+    DialectFinder.incremental = True
+    calls.clear()
+    module = importlib.import_module("incmod")
+    assert calls == [1, 1, 1], calls
+    assert module.y == 6
+    assert raise_line(module.g) == 7
+    # The injected import is hoisted to the start, once.
+    assert sum(1 for stmt in module.__spec__.loader.get_tree("incmod").body
+               if type(stmt).__name__ == "ImportFrom") == 1
+
+    # Only the changed statement is expanded again; the reused ones still work,
+    # and their line numbers follow the edit.
+    write(path, VERSION2, mtime=2e9)
+    calls.clear()
+    module = importlib.reload(module)
+    assert calls == [1], calls
+    assert module.y == 8
+    assert module.f(3) == 12
+    assert raise_line(module.g) == 8
+
+    # Reverting expands ``f`` again (only the latest version of each statement is kept).
+    write(path, VERSION1, mtime=3e9)
+    calls.clear()
+    module = importlib.reload(module)
+    assert calls == [1], calls
+    assert module.y == 6
+    assert raise_line(module.g) == 7
+
+    # The stored expansions are bounded, and can be released.
+    assert len(incremental._segments) == 1
+    old_max, incremental.max_modules = incremental.max_modules, 0
+    try:
+        write(path, VERSION2, mtime=4e9)
+        module = importlib.reload(module)
+        assert module.y == 8
+        assert not incremental._segments
+    finally:
+        incremental.max_modules = old_max
+    write(path, VERSION1, mtime=5e9)
+    module = importlib.reload(module)
+    assert incremental._segments
+    incremental.clear()
+    assert not incremental._segments
+
+    # The template's imports run once, before the user code, like with a whole-module expansion.
+    make_fixtures(directory, {"inctdialect.py": TEMPLATE_DIALECT, "inctmod.py": TEMPLATE_MODULE})
+    module = importlib.import_module("inctmod")
+    assert module.value == "user plus", module.value
+
+def main():
+    with tempdir(on_path=True) as directory, dont_write_bytecode(True):  # always expand; don't leave cache files behind
+        old_incremental = DialectFinder.incremental
+        try:
+            check_incremental(directory)
+        finally:
+            DialectFinder.incremental = old_incremental
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Test lazy loading of dialect modules (``dialects.activate.lazy_load``)."""
+
+import importlib
+import importlib.util
+import os
+import subprocess
+import sys
+
+import dialects.activate
+from dialects.importer import DialectFinder
+from dialects.test.fixtures import PYDIALECT, environment, make_fixtures, tempdir
+
+DIALECT = '''\
+def source_transformer(source):
+    return source.replace("<<<", "*")
+'''
+
+# Each module records when it runs.
+DIALECT_MODULE = '''\
+"""Lazy test module."""
+from __lang__ import lzdialect
+import lzlog
+lzlog.events.append(__name__)
+value = 6 <<< 7
+'''
+
+PLAIN_MODULE = '''\
+import lzlog
+lzlog.events.append(__name__)
+value = 42
+'''
+
+FILES = {"lzdialect.py": DIALECT,
+         "lzlog.py": "events = []\n",
+         "lzother.py": DIALECT_MODULE,  # not in a lazy package
+         os.path.join("lzpkg", "__init__.py"): "",
+         os.path.join("lzpkg", "mod.py"): DIALECT_MODULE,
+         os.path.join("lzpkg", "plain.py"): PLAIN_MODULE,
+         os.path.join("lzpkg", "broken.py"): "from __lang__ import lzdialect\nvalue = (\n",
+         os.path.join("lzpkg", "sub", "__init__.py"): "",
+         os.path.join("lzpkg", "sub", "mod.py"): DIALECT_MODULE,
+         # A package that makes itself lazy, with a main module in it.
+         os.path.join("lzmain", "__init__.py"): "import dialects.activate\ndialects.activate.lazy_load('lzmain')\n",
+         os.path.join("lzmain", "main.py"): DIALECT_MODULE + "print('main ran', value)\n"}
+
+def check_lazy(lzlog):
+    dialects.activate.lazy_load("lzpkg")
+
+    # Importing a dialect module in a lazy package neither expands nor runs it...
+    module = importlib.import_module("lzpkg.mod")
+    spec = object.__getattribute__(module, "__spec__")  # a plain attribute access would load it
+    assert spec.origin == os.path.join(os.path.dirname(lzlog.__file__), "lzpkg", "mod.py")
+    assert lzlog.events == []
+    assert "lzdialect" not in sys.modules
+    # ...until the first attribute access.
+    assert module.value == 42
+    assert lzlog.events == ["lzpkg.mod"]
+    assert "lzdialect" in sys.modules
+
+    # Subpackages are lazy, too.
+    assert isinstance(importlib.util.find_spec("lzpkg.sub.mod").loader, importlib.util.LazyLoader)
+    module = importlib.import_module("lzpkg.sub.mod")
+    assert lzlog.events == ["lzpkg.mod"]
+    assert module.value == 42
+    assert lzlog.events == ["lzpkg.mod", "lzpkg.sub.mod"]
+
+    # Modules that do not use a dialect, and modules in other packages, are not affected.
+    importlib.import_module("lzpkg.plain")
+    importlib.import_module("lzother")
+    assert lzlog.events[2:] == ["lzpkg.plain", "lzother"]
+
+    # Import errors surface at first use.
+    module = importlib.import_module("lzpkg.broken")
+    try:
+        module.value
+    except SyntaxError:
+        pass
+    else:
+        assert False, "expected a SyntaxError at first use"
+
+def main():
+    with tempdir(on_path=True) as directory:
+        old_lazy_packages = set(DialectFinder.lazy_packages)
+        try:
+            make_fixtures(directory, FILES)
+            check_lazy(importlib.import_module("lzlog"))
+
+            # The main module runs right away, even if it is in a lazy package.
+            output = subprocess.check_output([sys.executable, PYDIALECT, "-m", "lzmain.main"],
+                                             env=environment(directory), cwd=directory, universal_newlines=True)
+            assert output.strip() == "main ran 42", output
+        finally:
+            DialectFinder.lazy_packages.clear()
+            DialectFinder.lazy_packages.update(old_lazy_packages)
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Test installing MacroPy's import hook on demand (``dialects.activate.lazy_macropy``).
+
+Each case runs in a fresh interpreter, since MacroPy's hook, once installed,
+stays installed.
+"""
+
+import subprocess
+import sys
+
+from dialects.test.fixtures import MACRO_DIALECT, PYDIALECT, environment, have, make_fixtures, tempdir
+
+# A non-dialect module that uses macros; needs MacroPy's import hook.
+MACRO_MODULE = '''\
+from macropy.quick_lambda import macros, f, _
+double = f[_ * 2]
+'''
+
+MAIN = '''\
+"""A main program in a dialect whose definition uses macros."""
+from __lang__ import qdialect
+import macromod
+print("result", macromod.double(answer))
+'''
+
+LISPYTHON_MAIN = '''\
+from __lang__ import lispython
+def fact(n):
+    def loop(n, acc):
+        cond[n == 0, acc,
+             loop(n - 1, n * acc)]
+    loop(n, 1)
+print("result", fact(10))
+'''
+
+PROGRAM = '''\
+import sys
+import dialects.activate
+from dialects.importer import DialectFinder
+dialects.activate.lazy_macropy()
+import macropy  # MacroPy's own modules must not trigger the hook
+assert "macropy.core.import_hooks" not in sys.modules
+import {module}
+assert hasattr(macropy, "core")
+finders = [type(finder).__name__ for finder in sys.meta_path]
+assert finders.index("MacroFinder") == finders.index(type(DialectFinder).__name__) + 1, finders
+print("result", {expr})
+'''
+
+# With MacroPy's finder active, the dialect finder still hands back the spec of a
+# plain module (found by the lang-import detector, without reading the full source),
+# but not of a module that uses macros. The decision follows changes in sys.meta_path.
+HAND_BACK_PROGRAM = '''\
+import sys
+import macropy.activate
+import dialects.activate
+from dialects.importer import DialectFinder, _macro_finder
+def handed_back(name):
+    spec = DialectFinder.find_spec(name, None)
+    return spec is not None and type(spec.loader).__name__ == "SourceFileLoader"
+for _ in range(2):  # the second time from the negative cache
+    assert handed_back("plainmod")
+    assert not handed_back("macromod")
+sys.meta_path.remove(_macro_finder())
+assert handed_back("plainmod")
+assert handed_back("macromod")
+print("result ok")
+'''
+
+# What is scanned for macros. Runs with or without MacroPy.
+SCAN_PROGRAM = '''\
+import sys
+import dialects.activate
+from dialects.importer import DialectFinder
+dialects.activate.lazy_macropy()
+import json.decoder, plainmod, latemod
+def scanned(module):
+    return [mentions for key, mentions in DialectFinder._nondialect.items() if key[0] == module.__name__]
+assert scanned(json.decoder) == [None]  # the standard library is not scanned
+assert scanned(plainmod) == [False]
+assert scanned(latemod) == [None]  # only a prefix was scanned, so the result is not remembered
+assert "macropy.core.import_hooks" not in sys.modules
+print("result ok")
+'''
+
+# Mentions macros only past the part that is scanned.
+LATE_MODULE = "x = 42\n" + ("#" * 79 + "\n") * 1000 + "# macros\n"
+
+def run(directory, command):
+    """Run ``command`` in a fresh interpreter; return the result it prints."""
+    output = subprocess.check_output(command, env=environment(directory), cwd=directory,
+                                     universal_newlines=True)
+    return [line.split(None, 1)[1] for line in output.splitlines() if line.startswith("result ")][0]
+
+def main():
+    with tempdir() as directory:
+        make_fixtures(directory, {"plainmod.py": "x = 42\n", "macromod.py": MACRO_MODULE,
+                                  "qdialect.py": MACRO_DIALECT, "qmain.py": MAIN,
+                                  "lismain.py": LISPYTHON_MAIN, "latemod.py": LATE_MODULE})
+
+        assert run(directory, [sys.executable, "-c", SCAN_PROGRAM]) == "ok"
+        if not have("macropy"):
+            print("MacroPy not installed, skipping the rest")
+            return
+
+        # Activated by a plain module that uses macros...
+        program = PROGRAM.format(module="macromod", expr="macromod.double(21)")
+        assert run(directory, [sys.executable, "-c", program]) == "42"
+        # ...and by a dialect definition that uses macros, while loading a dialect module.
+        program = PROGRAM.format(module="qmain", expr="0")
+        assert run(directory, [sys.executable, "-c", program]) == "42"
+
+        assert run(directory, [sys.executable, "-c", HAND_BACK_PROGRAM]) == "ok"
+
+        # The bootstrapper loads MacroPy on demand.
+        assert run(directory, [sys.executable, PYDIALECT, "qmain.py"]) == "42"
+        assert run(directory, [sys.executable, PYDIALECT, "-m", "qmain"]) == "42"
+        if not have("unpythonic"):
+            print("unpythonic not installed, skipping the Lispython test")
+        else:
+            assert run(directory, [sys.executable, PYDIALECT, "lismain.py"]) == "3628800"
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Test that the compile cache tracks the macro modules a dialect module depends on.
+
+Each step runs in a fresh interpreter, because a macro module, once imported,
+stays loaded for the rest of the process.
+"""
+
+import os
+import subprocess
+import sys
+
+from dialects.test.fixtures import environment, have, make_fixtures, tempdir, write
+
+# A macro package in the style of ``unpythonic.syntax``: the registered macro is
+# a thin wrapper, and the actual syntax transformer lives in a submodule.
+MACROS_INIT = '''\
+from macropy.core.macros import Macros
+from .impl import transform
+macros = Macros()
+@macros.expr
+def scaled(tree, **kw):
+    return transform(tree)
+'''
+
+MACROS_IMPL = '''\
+import ast
+def transform(tree):
+    factor = ast.copy_location(ast.Num(n={factor}), tree)
+    return ast.copy_location(ast.BinOp(left=tree, op=ast.Mult(), right=factor), tree)
+'''
+
+DIALECT = '''\
+def source_transformer(source):
+    return source
+'''
+
+MODULE = '''\
+"""Uses a macro from a macro package."""
+from __lang__ import depdialect
+from depmacros import macros, scaled
+result = scaled[21]
+'''
+
+# A module in a real dialect (Lispython: autoreturn, TCO, and the macros of unpythonic.syntax).
+LISPYTHON_MODULE = '''\
+from __lang__ import lispython
+def fact(n):
+    def loop(n, acc):
+        cond[n == 0, acc,
+             loop(n - 1, n * acc)]
+    loop(n, 1)
+result = let((x, 10))[fact(x)]
+'''
+
+PROGRAM = '''\
+import logging, marshal, sys
+logging.basicConfig(level=logging.INFO, stream=sys.stdout, format="%(message)s")
+{activate}
+import dialects.activate
+from dialects import cache
+import {module}
+entry = cache.backend.get(cache.backend.key({module}.__file__, {module}.__lang__, {module}.__name__))
+tools, source, deps, code = marshal.loads(entry[len(cache._MAGIC):])
+print("result", {module}.result)
+print("deps", " ".join(name for name, path, fingerprint in deps))
+'''
+
+def run(directory, module, activate=""):
+    """Import ``module`` from ``directory`` in a fresh interpreter; return its output lines."""
+    env = environment(directory)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)  # this test is about the compile cache
+    output = subprocess.check_output([sys.executable, "-c", PROGRAM.format(module=module, activate=activate)],
+                                     env=env, cwd=directory, universal_newlines=True)
+    return output.splitlines()
+
+def result_of(lines):
+    return [line.split(None, 1)[1] for line in lines if line.startswith("result ")][0]
+
+def deps_of(lines):
+    return [line.split()[1:] for line in lines if line.startswith("deps")][0]
+
+def from_cache(lines, module):
+    return any(line.startswith("Loading module '{}'".format(module)) and line.endswith("from cache")
+               for line in lines)
+
+def check_macro_package(directory):
+    make_fixtures(directory, {os.path.join("depmacros", "__init__.py"): MACROS_INIT,
+                              "depdialect.py": DIALECT, "depmod.py": MODULE})
+    impl = os.path.join(directory, "depmacros", "impl.py")
+    write(impl, MACROS_IMPL.format(factor=2), mtime=1e9)
+
+    lines = run(directory, "depmod")
+    assert result_of(lines) == "42", lines
+    assert not from_cache(lines, "depmod"), lines
+    deps = deps_of(lines)
+    assert "depmacros" in deps and "depmacros.impl" in deps and "depdialect" in deps, deps
+
+    lines = run(directory, "depmod")
+    assert result_of(lines) == "42", lines
+    assert from_cache(lines, "depmod"), lines
+
+    # Only the helper module changes (same size, so that the contents are compared).
+    write(impl, MACROS_IMPL.format(factor=3), mtime=2e9)
+    lines = run(directory, "depmod")
+    assert result_of(lines) == "63", lines  # not a stale expansion
+    assert not from_cache(lines, "depmod"), lines
+
+def check_real_dialect(directory):
+    make_fixtures(directory, {"lismod.py": LISPYTHON_MODULE})
+    activate = "import macropy.activate"  # the dialect definition itself uses macros
+    lines = run(directory, "lismod", activate)
+    assert result_of(lines) == "3628800", lines
+    deps = deps_of(lines)
+    assert "lispython" in deps and "unpythonic.syntax" in deps, deps
+    assert "unpythonic.syntax.tailtools" in deps, deps  # where tco and autoreturn are implemented
+
+    lines = run(directory, "lismod", activate)
+    assert result_of(lines) == "3628800", lines
+    assert from_cache(lines, "lismod"), lines
+
+def main():
+    if not have("macropy"):
+        print("MacroPy not installed, skipping")
+        return
+    with tempdir() as directory:
+        check_macro_package(directory)
+        if not have("unpythonic"):
+            print("unpythonic not installed, skipping the Lispython test")
+        else:
+            check_real_dialect(directory)
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Test AST pass pipelines (``dialects.passes``)."""
+
+import ast
+import importlib
+import sys
+
+from dialects import passes
+from dialects.passes import Rewriter, Pipeline
+from dialects.test.fixtures import dont_write_bytecode, make_fixtures, tempdir
+
+def number(node):
+    """Return the value of the numeric literal ``node``, or ``None``."""
+    value = getattr(node, "value", getattr(node, "n", None))  # ast.Num before Python 3.8
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+class FoldAdd(Rewriter):
+    """``1 + 2`` -> ``3``."""
+    def visit_BinOp(self, node):
+        a, b = number(node.left), number(node.right)
+        if type(node.op) is ast.Add and a is not None and b is not None:
+            return ast.copy_location(ast.Constant(value=a + b), node)
+        return node
+
+class Rename(Rewriter):
+    """``x`` -> ``y``."""
+    def visit_Name(self, node):
+        if node.id == "x":
+            return ast.copy_location(ast.Name(id="y", ctx=node.ctx), node)
+        return node
+    def visit_arg(self, node):  # modified in place
+        if node.arg == "x":
+            node.arg = "y"
+        return node
+
+class DropPass(Rewriter):
+    """Delete ``pass`` statements; follow each ``del`` statement with ``deleted = True``."""
+    def visit_Pass(self, node):
+        return None
+    def visit_Delete(self, node):
+        return [node] + ast.parse("deleted = True").body
+
+class Recorder(Rewriter):
+    """Record the visitor calls, to check the dispatch to base classes and the order."""
+    def __init__(self):
+        self.calls = []
+    def visit_Assign(self, node):
+        self.calls.append("Assign")
+        return node
+    def visit_stmt(self, node):
+        self.calls.append("stmt")
+        return node
+    def visit_Name(self, node):
+        self.calls.append("Name " + node.id)
+        return node
+
+class CountNames(Rewriter):
+    """A whole-tree pass: count the names first, then rewrite (not local, so not fusable)."""
+    fusable = False
+    def run(self, body):
+        count = sum(isinstance(node, ast.Name) for stmt in body for node in ast.walk(stmt))
+        return body + ast.parse("names = {}".format(count)).body
+
+SOURCE = '''\
+x = 1 + 2
+def f(x, z):
+    pass
+    return (x + 1) + (2 + 3) + z
+del x
+'''
+
+def dump(body):
+    return ast.dump(ast.Module(body=body, type_ignores=[]))
+
+def sequential(body, ps):
+    for p in ps:
+        body = p.run(body)
+    return body
+
+def test_fusion():
+    ps = [FoldAdd(), Rename(), DropPass()]
+    pipeline = Pipeline(ps)
+    assert [len(group) for group in pipeline.groups] == [3]
+    fused = pipeline.run(ast.parse(SOURCE).body)
+    assert dump(fused) == dump(sequential(ast.parse(SOURCE).body, ps))
+    namespace = {}
+    exec(compile(ast.fix_missing_locations(ast.Module(body=fused, type_ignores=[])), "<test>", "exec"), namespace)
+    assert namespace["f"](10, 100) == 116
+    assert "y" not in namespace and namespace["deleted"]
+    assert not any(isinstance(node, ast.Pass) for stmt in fused for node in ast.walk(stmt))
+
+def test_groups():
+    pipeline = Pipeline([FoldAdd(), Rename(), CountNames(), DropPass(), CountNames()])
+    assert [[p.name for p in group] for group in pipeline.groups] == \
+        [["FoldAdd", "Rename"], ["CountNames"], ["DropPass"], ["CountNames"]]
+    body = pipeline.run(ast.parse("x = a + b\npass\n").body)
+    assert [number(stmt.value) for stmt in body[-2:]] == [3, 4]  # y, a, b; then also names
+    assert not any(isinstance(stmt, ast.Pass) for stmt in body)
+    assert set(pipeline.timings) == {"FoldAdd+Rename", "CountNames", "DropPass"}
+    assert "FoldAdd+Rename" in pipeline.format_timings()
+
+def test_profile():
+    old_profile, passes.profile = passes.profile, True
+    try:
+        pipeline = Pipeline([FoldAdd(), Rename()])
+        pipeline.run(ast.parse(SOURCE).body)
+        assert set(pipeline.timings) == {"FoldAdd", "Rename", "FoldAdd+Rename (traversal)"}, pipeline.timings
+    finally:
+        passes.profile = old_profile
+
+def test_dispatch():
+    recorder = Recorder()
+    recorder.run(ast.parse("a = b").body)
+    # Postorder (children first); the most specific visitor first.
+    assert recorder.calls == ["Name a", "Name b", "Assign", "stmt"], recorder.calls
+
+    # A node that is not in a list can only be replaced by a node.
+    class Bad(Rewriter):
+        def visit_Name(self, node):
+            return None
+    try:
+        Bad().run(ast.parse("a = b").body)
+    except TypeError:
+        pass
+    else:
+        assert False, "expected a TypeError"
+
+def test_deep():
+    # Deeper than the recursion limit; ``ast.parse`` itself can't do this.
+    depth = 5 * sys.getrecursionlimit()
+    tree = ast.Name(id="x", ctx=ast.Load())
+    for _ in range(depth):
+        tree = ast.BinOp(left=tree, op=ast.Add(), right=ast.Constant(value=1))
+    body = Rename().run([ast.Expr(value=tree)])
+    node = body[0].value
+    while isinstance(node, ast.BinOp):
+        node = node.left
+    assert node.id == "y"
+
+DIALECT = '''\
+import ast
+from dialects.passes import Rewriter
+class Double(Rewriter):
+    def visit_Constant(self, node):  # Python 3.8+
+        if isinstance(node.value, int) and not isinstance(node.value, bool):
+            return ast.copy_location(ast.Constant(value=2 * node.value), node)
+        return node
+    def visit_Num(self, node):  # Python 3.7
+        return ast.copy_location(ast.Num(n=2 * node.n), node)
+ast_passes = [Double()]
+def ast_transformer(body):  # runs after the passes
+    return body + ast.parse("after = value + 1").body
+'''
+
+def test_dialect():
+    """A dialect with ``ast_passes``, through the importer."""
+    with tempdir(on_path=True) as directory, dont_write_bytecode(True):  # always expand
+        import dialects.activate  # noqa: F401
+        make_fixtures(directory, {"passdialect.py": DIALECT,
+                                  "passmod.py": '"""Test module 1."""\nfrom __lang__ import passdialect\nvalue = 21\n'})
+        # The timings are formatted for the log only if it is shown.
+        formatted = []
+        old_format_timings = Pipeline.format_timings
+        Pipeline.format_timings = lambda self: formatted.append(self) or ""
+        try:
+            module = importlib.import_module("passmod")
+        finally:
+            Pipeline.format_timings = old_format_timings
+        assert not formatted
+        assert module.value == 42
+        assert module.after == 43
+        assert module.__doc__ == "Test module 1."  # not passed through the passes
+        assert "passdialect: Double" in passes.report(), passes.report()
+
+def main():
+    test_fusion()
+    test_groups()
+    test_profile()
+    test_dispatch()
+    test_deep()
+    test_dialect()
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Test ahead-of-time compilation into the compile cache (``dialects.precompile``)."""
+
+import io
+import os
+import sys
+
+from dialects import cache
+from dialects.precompile import find_modules, precompile
+from dialects.test.fixtures import ROOT, dont_write_bytecode, have, make_fixtures, tempdir
+
+DIALECT = '''\
+def source_transformer(source):
+    return source.replace("<<<", "*")
+'''
+
+FILES = {"pcdialect.py": DIALECT,
+         os.path.join("pcpkg", "__init__.py"): "",
+         os.path.join("pcpkg", "sub", "__init__.py"): '"""Subpackage."""\nfrom __lang__ import pcdialect\n',
+         os.path.join("pcpkg", "good.py"): "from __lang__ import pcdialect\nvalue = 6 <<< 7\n",
+         os.path.join("pcpkg", "plain.py"): "value = 42\n",
+         os.path.join("pcpkg", "bad.py"): "from __lang__ import pcdialect\nvalue = (\n"}
+
+def report(paths, backend, **kwargs):
+    """Run the precompiler; return ``(number of failures, {module name: status})``."""
+    out = io.StringIO()
+    fails = precompile(paths, workers=2, file=out, backend=backend, **kwargs)
+    statuses = {}
+    for line in out.getvalue().splitlines():
+        fields = line.split()
+        if len(fields) == 4 and fields[1].endswith("s"):
+            statuses[fields[2]] = fields[0]
+    return fails, statuses
+
+def check_fixtures(directory):
+    make_fixtures(directory, FILES)
+    package = os.path.join(directory, "pcpkg")
+    assert sorted((name, root) for name, _, root in find_modules([package])) == \
+        [("pcpkg", directory), ("pcpkg.bad", directory), ("pcpkg.good", directory),
+         ("pcpkg.plain", directory), ("pcpkg.sub", directory)]
+
+    backend = cache.ContentStore(os.path.join(directory, "cache"))
+    fails, statuses = report([package], backend)
+    assert fails == 1
+    assert statuses == {"pcpkg.good": "compiled", "pcpkg.sub": "compiled", "pcpkg.bad": "FAILED"}, statuses
+
+    fails, statuses = report([package], backend)
+    assert statuses["pcpkg.good"] == "cached"
+    fails, statuses = report([package], backend, force=True)
+    assert statuses["pcpkg.good"] == "compiled"
+
+    old_backend, cache.backend = cache.backend, backend
+    sys.path.insert(0, directory)  # the key depends on the dialect, found on sys.path
+    try:
+        good = os.path.join(package, "good.py")
+        namespace = {}
+        exec(cache.load(good, "pcdialect", "pcpkg.good"), namespace)
+        assert namespace["value"] == 42
+    finally:
+        sys.path.remove(directory)
+        cache.backend = old_backend
+
+def check_lispython(directory):
+    """Precompile a module of an example dialect, whose definition uses macros."""
+    # Not imported here, so that this process (and the forked workers) start without MacroPy's hook.
+    if not have("macropy") or not have("unpythonic"):
+        print("MacroPy or unpythonic not installed, skipping the Lispython test")
+        return
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)  # for the forked workers, to find the dialect
+    filename = os.path.join(ROOT, "lispython", "test", "test_lispython.py")
+    backend = cache.ContentStore(os.path.join(directory, "lispcache"))
+    fails, statuses = report([filename], backend)
+    assert fails == 0, statuses
+    assert statuses == {"test_lispython": "compiled"}, statuses
+    fails, statuses = report([filename], backend)
+    assert statuses == {"test_lispython": "cached"}, statuses
+
+def main():
+    with tempdir() as directory, dont_write_bytecode(False):  # this test is about the compile cache
+        check_fixtures(directory)
+        check_lispython(directory)
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Test speculative background compilation of the imports of dialect modules (``dialects.prefetch``)."""
+
+import importlib
+import os
+import sys
+import time
+
+from dialects import cache
+from dialects.importer import DialectFinder
+from dialects.prefetch import Prefetcher, module_imports
+from dialects.test.fixtures import dialect_source, dont_write_bytecode, forget, have, make_fixtures, tempdir
+
+NMODULES = 4
+
+# Module k imports module k + 1 at module level.
+MODULE = '''\
+"""Prefetch test module {k}."""
+from __lang__ import pfdialect
+{imports}
+value = answer + {k}
+'''
+
+def prefetch_fixtures(directory):
+    files = {"pfdialect.py": dialect_source(),
+             os.path.join("pfpkg", "__init__.py"): ""}
+    for k in range(NMODULES):
+        imports = "from . import mod{}".format(k + 1) if k + 1 < NMODULES else ""
+        files[os.path.join("pfpkg", "mod{}.py".format(k))] = MODULE.format(k=k, imports=imports)
+    make_fixtures(directory, files)
+    return ["pfpkg.mod{}".format(k) for k in range(NMODULES)]
+
+def compiled_names():
+    return {key[0] for key in DialectFinder._compiled}
+
+def wait_idle(prefetcher, timeout=120):
+    """Wait until ``prefetcher`` has no queued or running jobs."""
+    deadline = time.time() + timeout
+    while prefetcher._queue or prefetcher._pending:
+        assert time.time() < deadline, "prefetching did not finish"
+        time.sleep(0.05)
+
+def test_module_imports():
+    code = compile("import a.b\nfrom c import d, e\nfrom . import f\nfrom ..g import *\n", "<test>", "exec")
+    assert module_imports(code, "p.q") == ["a", "a.b", "c", "c.d", "c.e", "p", "p.q", "p.q.f", "p", "p.g"]
+    def function():
+        import h  # noqa: F401, not at module level
+    assert module_imports(function.__code__, None) == ["h"]
+    assert module_imports(compile("from . import x", "<test>", "exec"), "") == []  # outside a package
+
+def main():
+    test_module_imports()
+
+    with tempdir(on_path=True) as directory, dont_write_bytecode(False):  # the workers store into the compile cache
+        old_prefetcher = DialectFinder.prefetcher
+        old_backend = cache.backend
+        prefetcher = Prefetcher(workers=2)
+        try:
+            import dialects.activate  # noqa: F401
+            names = prefetch_fixtures(directory)
+            DialectFinder.prefetcher = prefetcher
+
+            # The imports of a prefetched module are followed, and all of them are
+            # expanded in the workers; the dialect is never loaded in this process.
+            prefetcher.schedule_names(names[:1])
+            wait_idle(prefetcher)
+            assert compiled_names() >= set(names), compiled_names()
+            assert "pfdialect" not in sys.modules
+
+            # The import uses the prefetched code.
+            module = importlib.import_module(names[0])
+            assert module.value == 21
+            assert [sys.modules[name].value for name in names] == [21 + k for k in range(NMODULES)]
+            assert "pfdialect" not in sys.modules
+
+            # Already loaded modules are not prefetched again.
+            prefetcher.schedule_names(names)
+            assert not prefetcher._queue and not prefetcher._pending
+
+            # The results are in the compile cache, too: with the in-memory table
+            # forgotten, another run loads them from there.
+            forget(["pfpkg"] + names)
+            prefetcher._seen.clear()
+            prefetcher.schedule_names(names[:1])
+            wait_idle(prefetcher)
+            assert not compiled_names() & set(names)  # nothing was sent back
+            module = importlib.import_module(names[0])
+            assert [sys.modules[name].value for name in names] == [21 + k for k in range(NMODULES)]
+            assert "pfdialect" not in sys.modules
+
+            # A pack file backend is sent to the workers even after it has mapped its file.
+            if have("macropy"):  # the dialect is now loaded in this process, too
+                import macropy.activate  # noqa: F401
+            cache.backend = cache.PackStore(os.path.join(directory, "cache.pack"))
+            forget(["pfpkg"] + names)
+            DialectFinder.prefetcher = None
+            importlib.import_module(names[-2])  # creates the pack, and maps it (importing the last module)
+            assert cache.backend._map is not None
+            prefetcher.shutdown()
+            prefetcher = Prefetcher(workers=2)  # new workers, with the new backend
+            DialectFinder.prefetcher = prefetcher
+            prefetcher.schedule_names(names[:1])
+            wait_idle(prefetcher)
+            assert not prefetcher._closed
+            assert compiled_names() >= set(names[:-2]), compiled_names()
+            module = importlib.import_module(names[0])
+            assert [sys.modules[name].value for name in names] == [21 + k for k in range(NMODULES)]
+
+            # If the workers can't be started, prefetching is disabled, and the imports work as usual.
+            class Unpicklable(cache.ContentStore):  # a local class can't be pickled
+                pass
+            cache.backend = Unpicklable(os.path.join(directory, "cache"))
+            forget(["pfpkg"] + names)
+            broken = Prefetcher(workers=1)
+            DialectFinder.prefetcher = broken
+            broken.schedule(compile("import pfpkg.mod0", "<test>", "exec"), None)
+            assert broken._closed and broken._pool is None
+            module = importlib.import_module(names[0])
+            assert [sys.modules[name].value for name in names] == [21 + k for k in range(NMODULES)]
+        finally:
+            prefetcher.shutdown()
+            DialectFinder.prefetcher = old_prefetcher
+            cache.backend = old_backend
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""End-to-end test of the fork server: ``pydialect --server``, and clients using it."""
+
+import os
+import signal
+import subprocess
+import sys
+
+from dialects.test.fixtures import PYDIALECT, dialect_source, environment, make_fixtures, tempdir, write
+
+MAIN = '''\
+"""Reports where it runs, echoes its input, and exits with a custom status."""
+from __lang__ import srvdialect
+import os, sys
+print("answer", 2 * answer)
+print("argv", " ".join(sys.argv[1:]))
+print("cwd", os.getcwd())
+print("env", os.environ.get("SRVTEST"))
+print("ppid", os.getppid())
+print("stdin", sys.stdin.readline().strip())
+sys.exit(3)
+'''
+
+def main():
+    if not hasattr(os, "fork"):
+        print("Not a POSIX system, skipping")
+        return
+    with tempdir() as directory:
+        workdir = os.path.join(directory, "work")
+        os.makedirs(workdir)
+        sock = os.path.join(directory, "server.sock")
+        server = None
+        try:
+            make_fixtures(directory, {"srvdialect.py": dialect_source(), "srvmain.py": MAIN})
+
+            env = environment(directory)
+            server = subprocess.Popen([sys.executable, PYDIALECT, "--server", sock, "--preload", "srvdialect"],
+                                      env=env, cwd=directory, stderr=subprocess.PIPE,
+                                      universal_newlines=True)
+            line = server.stderr.readline()
+            assert "listening" in line, (line + server.stderr.read())
+            assert os.stat(sock).st_mode & 0o777 == 0o600, oct(os.stat(sock).st_mode)  # owner only
+
+            env["PYDIALECT_SERVER"] = sock
+            env["SRVTEST"] = "hello"
+            client = subprocess.run([sys.executable, PYDIALECT, "-m", "srvmain"],
+                                    env=env, cwd=workdir, input="some input\n",
+                                    stdout=subprocess.PIPE, universal_newlines=True)
+            assert client.returncode == 3, client
+            output = dict(line.split(" ", 1) for line in client.stdout.splitlines())
+            assert output["answer"] == "42", output
+            assert output["argv"] == "-m srvmain", output
+            assert output["cwd"] == workdir, output
+            assert output["env"] == "hello", output
+            assert output["ppid"] == str(server.pid), output  # run by the server, not by the client
+            assert output["stdin"] == "some input", output
+
+            # A client does not use a server run by another user.
+            from dialects.server import request
+            getuid = os.getuid
+            os.getuid = lambda: getuid() + 1
+            try:
+                assert request(sock, ["pydialect", "-m", "srvmain"]) is None
+            finally:
+                os.getuid = getuid
+
+            # An error in the program is reported to the client.
+            client = subprocess.run([sys.executable, PYDIALECT, "-m", "nosuchmodule"], env=env, cwd=workdir,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            assert client.returncode == 1, client
+            assert "No module named nosuchmodule" in client.stderr, client.stderr
+
+            # Ctrl+C in the client interrupts the program in the server.
+            write(os.path.join(directory, "srvsleep.py"),
+                  "from __lang__ import srvdialect\nimport time\nprint('sleeping', flush=True)\ntime.sleep(30)\n")
+            client = subprocess.Popen([sys.executable, PYDIALECT, "-m", "srvsleep"], env=env, cwd=workdir,
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            assert client.stdout.readline().strip() == "sleeping"
+            client.send_signal(signal.SIGINT)
+            _, stderr = client.communicate(timeout=30)
+            assert client.returncode == 128 + signal.SIGINT, (client.returncode, stderr)
+            assert "KeyboardInterrupt" in stderr, stderr
+            assert server.poll() is None  # the server itself is still running
+
+            # Shutting down the server removes the socket; clients then run the program themselves.
+            server.send_signal(signal.SIGINT)
+            server.wait(timeout=30)
+            assert not os.path.exists(sock)
+            client = subprocess.run([sys.executable, PYDIALECT, "-m", "srvmain"], env=env, cwd=workdir,
+                                    input="\n", stdout=subprocess.PIPE, universal_newlines=True)
+            assert client.returncode == 3, client
+            output = dict(line.split(" ", 1) for line in client.stdout.splitlines())
+            assert output["answer"] == "42", output
+            assert output["ppid"] != str(server.pid), output
+        finally:
+            if server is not None and server.poll() is None:
+                server.kill()
+                server.wait()
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
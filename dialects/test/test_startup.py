@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Startup-time regression test: the import hook, with no dialect modules around."""
+
+import subprocess
+import sys
+
+from dialects.test.fixtures import environment
+
+# Importing these (and everything they import) goes through the hook,
+# but none of them uses a dialect.
+MODULES = ["argparse", "decimal", "email.message", "http.client", "json",
+           "logging.handlers", "unittest", "xml.dom.minidom"]
+
+PROGRAM = '''\
+import sys, time
+t0 = time.perf_counter()
+if {hook}:
+    import dialects.activate
+    dialects.activate.lazy_macropy()
+for name in {modules}:
+    __import__(name)
+dt = time.perf_counter() - t0
+loaded = sorted(m for m in sys.modules if m.split(".")[0] == "macropy" or m == "dialects.util")
+print(dt, ",".join(loaded))
+'''
+
+REPEATS = 5
+
+def run(hook):
+    """Run the import program in a fresh interpreter; return ``(best time, modules loaded)``."""
+    env = environment()
+    program = PROGRAM.format(hook=hook, modules=MODULES)
+    best = None
+    for _ in range(REPEATS):
+        output = subprocess.check_output([sys.executable, "-c", program], env=env,
+                                         universal_newlines=True)
+        dt, loaded = output.strip().partition(" ")[::2]
+        best = min(best, float(dt)) if best is not None else float(dt)
+    return best, loaded
+
+def main():
+    baseline, _ = run(hook=False)
+    t, loaded = run(hook=True)
+    print("without hook {:0.1f} ms, with hook {:0.1f} ms".format(1000 * baseline, 1000 * t))
+
+    # The hook must not load MacroPy (nor the dialect utilities) when no module needs them.
+    assert not loaded, loaded
+
+    # Generous bound, to avoid spurious failures on a busy machine; the point
+    # is to catch the hook doing something expensive for non-dialect modules.
+    assert t < 2 * baseline + 0.05, (t, baseline)
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Test concurrent imports of dialect modules from many threads."""
+
+import importlib
+import os
+import random
+import threading
+
+import dialects.activate  # noqa: F401
+from dialects.importer import DialectFinder
+from dialects.test.fixtures import dont_write_bytecode, make_fixtures, tempdir
+
+NMODULES = 20
+NTHREADS = 16
+
+# A pure source-transform dialect, so that this test needs no macro library.
+# It counts how many times each module has been transformed.
+DIALECT = '''\
+import threading
+counts = {}
+_lock = threading.Lock()
+def source_transformer(source):
+    name = source.split("#name ", 1)[1].split()[0]
+    with _lock:
+        counts[name] = counts.get(name, 0) + 1
+    return source.replace("<<<", "*")
+'''
+
+MODULE = '''\
+"""Test module {k}."""
+from __lang__ import {dialect}
+#name {name}
+value = {k} <<< 2
+'''
+
+def thread_fixtures(directory, prefix, dialect):
+    files = {"{}.py".format(dialect): DIALECT,
+             os.path.join(prefix, "__init__.py"): ""}
+    names = ["{}.mod{}".format(prefix, k) for k in range(NMODULES)]
+    for k, name in enumerate(names):
+        files[os.path.join(prefix, "mod{}.py".format(k))] = MODULE.format(k=k, dialect=dialect, name=name)
+    make_fixtures(directory, files)
+    return names
+
+def run_threads(work, names):
+    errors = []
+    barrier = threading.Barrier(NTHREADS)
+    def worker():
+        mynames = list(names)
+        random.shuffle(mynames)
+        barrier.wait()  # maximize contention
+        try:
+            for name in mynames:
+                work(name)
+        except Exception as err:
+            errors.append(err)
+    threads = [threading.Thread(target=worker) for _ in range(NTHREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+
+def main():
+    with tempdir(on_path=True) as directory, dont_write_bytecode(True):  # always expand; don't leave cache files behind
+        # Finder level: many threads getting the code of the same modules.
+        names = thread_fixtures(directory, "threadtest_a", "threaddialect_a")
+        path = importlib.import_module("threadtest_a").__path__
+        def get_code(name):
+            spec = DialectFinder.find_spec(name, path)
+            assert spec.loader.get_code(name) is not None
+        run_threads(get_code, names)
+        counts = importlib.import_module("threaddialect_a").counts
+        assert counts == {name: 1 for name in names}, counts  # one expansion per module
+
+        # Import level: many threads importing the same modules.
+        names = thread_fixtures(directory, "threadtest_b", "threaddialect_b")
+        def do_import(name):
+            module = importlib.import_module(name)
+            k = int(name.rsplit("mod", 1)[1])
+            assert module.value == 2 * k
+            assert module.__lang__ == "threaddialect_b"
+        run_threads(do_import, names)
+        counts = importlib.import_module("threaddialect_b").counts
+        assert counts == {name: 1 for name in names}, counts
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
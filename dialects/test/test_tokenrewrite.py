@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Test token-level rewriting for source transformers (``dialects.tokenrewrite``)."""
+
+import importlib
+import sys
+import tokenize
+import traceback
+
+from dialects.tokenrewrite import TokenRewriter
+from dialects.test.fixtures import dont_write_bytecode, make_fixtures, tempdir
+
+def test_rules():
+    rules = TokenRewriter().add("|>", ">>").add("unless", "if not")
+    assert rules.transform("a |> f\n") == "a >> f\n"
+    assert rules.transform("unless x:\n    pass\n") == "if not x:\n    pass\n"
+
+    # Not inside string literals or comments; formatting elsewhere is kept.
+    source = 's = "a |> f"  # a |> f\nt  =  (a |> f)   |>  g\n'
+    assert rules.transform(source) == 's = "a |> f"  # a |> f\nt  =  (a >> f)   >>  g\n'
+
+    # Tokens adjacent in the pattern must be adjacent in the source.
+    assert rules.transform("a | > f\n") == "a | > f\n"
+    # Tokens separated in the pattern need not be.
+    rules.add("is   not None", "is_set")
+    assert rules.transform("x is not None\n") == "x is_set\n"
+
+    # Only whole tokens match.
+    assert rules.transform("unlessx = 1\n") == "unlessx = 1\n"
+
+def test_precedence():
+    rules = TokenRewriter()
+    rules.add("<<", "SHL")
+    rules.add("<<<", "*")  # "<<" "<" as tokens; the longest match wins
+    rules.add("<<<", "never")  # earlier rules win ties
+    assert rules.transform("a <<< b << c\n") == "a * b SHL c\n"
+
+def test_function():
+    calls = []
+    def arrow(tokens):
+        calls.append(tokens)
+        return "->"
+    rules = TokenRewriter().add("-->", arrow)
+    assert rules.transform("def f() --> int: pass\n") == "def f() -> int: pass\n"
+    assert calls == [["-", "->"]], calls  # the matched token strings
+
+def test_bailout():
+    rules = TokenRewriter().add("|>", ">>")
+    # No trigger text in the source: returned as-is, without tokenizing it.
+    broken = "x = (\n"
+    assert rules.transform(broken) is broken
+    # Adding a rule recompiles the triggers.
+    rules.add("=", ":=")
+    try:
+        rules.transform(broken)
+    except (tokenize.TokenError, SyntaxError):
+        pass
+    else:
+        assert False, "expected a tokenizer error"
+
+def test_errors():
+    for pattern in ("", "  ", "# comment", "x  # comment"):
+        try:
+            TokenRewriter().add(pattern, "y")
+        except ValueError:
+            pass
+        else:
+            assert False, "expected a ValueError for {!r}".format(pattern)
+
+DIALECT = '''\
+from dialects.tokenrewrite import TokenRewriter
+rules = TokenRewriter()
+rules.add("<<<", "*")
+rules.add("unless", "if not")
+source_transformer = rules.transform
+'''
+
+MODULE = '''\
+"""Token rewriting test module."""
+from __lang__ import tokdialect
+value = 6 <<< 7
+label = "6 <<< 7"
+def check(x):
+    unless x:
+        raise ValueError("falsy")
+    return x <<< 2
+'''
+
+def test_dialect():
+    """A dialect whose source transformer is a ``TokenRewriter``, through the importer."""
+    with tempdir(on_path=True) as directory, dont_write_bytecode(True):  # always expand
+        import dialects.activate  # noqa: F401
+        make_fixtures(directory, {"tokdialect.py": DIALECT, "tokmod.py": MODULE})
+        module = importlib.import_module("tokmod")
+        assert module.value == 42
+        assert module.label == "6 <<< 7"
+        assert module.check(5) == 10
+        try:
+            module.check(0)
+        except ValueError:
+            # line numbers are preserved
+            assert traceback.extract_tb(sys.exc_info()[2])[-1].lineno == 7
+        else:
+            assert False, "expected a ValueError"
+
+def main():
+    test_rules()
+    test_precedence()
+    test_function()
+    test_bailout()
+    test_errors()
+    test_dialect()
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Test the utilities for dialect definitions (``dialects.util``)."""
+
+import ast
+import sys
+
+from dialects.util import splice_ast, Template, _copy_tree
+
+TEMPLATE = '''\
+from mymacros import macros, let, cond, block
+from othermacros import macros, forall
+from operator import add, mul
+with block:
+    __paste_here__
+'''
+
+def parse(source):
+    return ast.parse(source).body
+
+def macro_imports(body):
+    """Return the macro imports at the start of ``body``, as ``(module, [names])``."""
+    out = []
+    for stmt in body:
+        if not (type(stmt) is ast.ImportFrom and stmt.names[0].name == "macros"):
+            break
+        out.append((stmt.module, [alias.asname or alias.name for alias in stmt.names]))
+    return out
+
+def runtime_imports(body):
+    return [alias.name for stmt in body if type(stmt) is ast.ImportFrom and stmt.names[0].name != "macros"
+            for alias in stmt.names]
+
+def pasted(body):
+    """Return the user code pasted into the spliced module ``body``, found by following the first statements."""
+    for stmt in body:
+        if type(stmt) is ast.If:
+            return stmt.body
+        if type(stmt) is ast.With:
+            return pasted(stmt.body)
+    assert False, "no pasted code"
+
+def test_splice():
+    template = parse(TEMPLATE)
+    body = parse("from usermacros import macros, foo\nx = foo[1]\nfrom moremacros import macros, bar\n")
+    new = splice_ast(body, template, "__paste_here__")
+    # The macro imports of the template, then those of the user code, in order.
+    assert macro_imports(new) == [("mymacros", ["macros", "let", "cond", "block"]),
+                                  ("othermacros", ["macros", "forall"]),
+                                  ("usermacros", ["macros", "foo"]),
+                                  ("moremacros", ["macros", "bar"])], macro_imports(new)
+    # Each one leaves a ``pass`` in its place; the rest of the code is in order.
+    assert [type(stmt).__name__ for stmt in pasted(new)] == ["Pass", "Assign", "Pass"]
+    assert runtime_imports(new) == ["add", "mul"]
+    # Missing source locations are taken from the start of the user code.
+    assert all(hasattr(node, "lineno") for node in ast.walk(ast.Module(body=new))
+               if "lineno" in node._attributes)
+
+    # Only the top level of the user code is looked at; a nested macro import stays in place.
+    body = parse("if True:\n    from usermacros import macros, foo\n")
+    new = splice_ast(body, parse(TEMPLATE), "__paste_here__")
+    assert [m for m, names in macro_imports(new)] == ["mymacros", "othermacros"]
+    assert type(pasted(new)[0].body[0]) is ast.ImportFrom
+
+    # A name in the user code that looks like the marker is left alone.
+    for splice in (lambda body: splice_ast(body, parse(TEMPLATE), "__paste_here__"),
+                   lambda body: Template(parse(TEMPLATE), "__paste_here__").splice(body)):
+        new = splice(parse("__paste_here__\nx = 1\n"))
+        code = pasted(new)
+        assert type(code[0]) is ast.Expr and code[0].value.id == "__paste_here__"
+        assert type(code[1]) is ast.Assign
+
+    for bad in ([], None):
+        try:
+            splice_ast(bad or [], parse(TEMPLATE), "__paste_here__")
+        except ImportError:
+            pass
+        else:
+            assert False, "expected an ImportError for an empty module"
+    try:
+        Template(parse("x = 1\n"), "__paste_here__")
+    except ValueError:
+        pass
+    else:
+        assert False, "expected a ValueError for a template without a marker"
+
+def test_large():
+    # A large user module is not walked (only its top level is looked at).
+    n = 50000
+    body = parse("".join("x{} = {}\n".format(k, k) for k in range(n)))
+    new = splice_ast(body, parse(TEMPLATE), "__paste_here__")
+    assert len(pasted(new)) == n
+    new = Template(parse(TEMPLATE), "__paste_here__").splice(body)
+    assert len(pasted(new)) == n
+
+    # The template is processed without recursion, so its nesting depth is not limited.
+    depth = 5 * sys.getrecursionlimit()
+    def deep_template():
+        template = parse("from mymacros import macros, let\n__paste_here__\n")
+        for _ in range(depth):
+            template = [ast.If(test=ast.Name(id="x", ctx=ast.Load()), body=template, orelse=[])]
+        return template
+    for splice in (lambda body: splice_ast(body, deep_template(), "__paste_here__"),
+                   lambda body: Template(deep_template(), "__paste_here__").splice(body)):
+        new = splice(parse("y = 1\n"))
+        assert macro_imports(new) == [("mymacros", ["macros", "let"])], macro_imports(new)
+        stmt, levels = new[1], 0
+        while type(stmt) is ast.If and type(stmt.test) is ast.Name:
+            stmt, levels = stmt.body[-1], levels + 1
+        assert levels == depth
+        assert type(stmt.body[0]) is ast.Assign  # the pasted code
+
+def test_copy():
+    tree = parse("while x:\n    pass\n    break\n")
+    new = _copy_tree(tree)
+    # Nodes that only have a source location are copied; those with no data at all are shared.
+    assert new[0].body[0] is not tree[0].body[0] and new[0].body[1] is not tree[0].body[1]
+    assert new[0].test.ctx is tree[0].test.ctx
+
+    # So moving the code of one module spliced with a template (e.g. with ``ast.increment_lineno``)
+    # does not move the others, even for a ``pass`` in the template.
+    template = Template(parse("if True:\n    pass\n    __paste_here__\n"), "__paste_here__")
+    first = template.splice(parse("x = 1\n"))
+    ast.increment_lineno(ast.Module(body=first), 10)
+    second = template.splice(parse("x = 1\n"))
+    assert (first[0].body[0].lineno, second[0].body[0].lineno) == (12, 2)
+
+def test_prune():
+    for splice in (lambda body, **kw: splice_ast(body, parse(TEMPLATE), "__paste_here__", **kw),
+                   lambda body, **kw: Template(parse(TEMPLATE), "__paste_here__", **kw).splice(body)):
+        body = parse("x = cond[a, b, c]\n")
+        assert macro_imports(splice(body)) == [("mymacros", ["macros", "let", "cond", "block"]),
+                                               ("othermacros", ["macros", "forall"])]
+
+        # Only the macros the module uses, or the template itself (``block``), are bound.
+        # A macro import with no macros left is dropped.
+        body = splice(parse("x = cond[a, b, c]\n"), prune=True)
+        assert macro_imports(body) == [("mymacros", ["macros", "cond", "block"])], macro_imports(body)
+        # Runtime imports are never pruned; they are part of the module namespace.
+        assert runtime_imports(body) == ["add", "mul"]
+
+        # Macros that other macros expand into are kept if asked.
+        body = splice(parse("x = 1\n"), prune=True, keep=["forall"])
+        assert macro_imports(body) == [("mymacros", ["macros", "block"]),
+                                       ("othermacros", ["macros", "forall"])], macro_imports(body)
+
+        # Dynamic name lookups can't refer to macros, so they don't matter.
+        body = splice(parse("x = eval('let')\n"), prune=True)
+        assert macro_imports(body) == [("mymacros", ["macros", "block"])], macro_imports(body)
+
+    # Aliased macros are bound by their alias.
+    template = parse("from mymacros import macros, let as mylet, cond\n__paste_here__\n")
+    body = splice_ast(parse("x = mylet[a]\n"), template, "__paste_here__", prune=True)
+    assert macro_imports(body) == [("mymacros", ["macros", "mylet"])], macro_imports(body)
+
+def main():
+    test_splice()
+    test_large()
+    test_copy()
+    test_prune()
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
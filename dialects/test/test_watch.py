@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Test watch mode: ``pydialect --watch``, rerunning the program when its sources change."""
+
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from dialects.watch import _reload_order
+from dialects.test.fixtures import PYDIALECT, environment, tempdir, write
+
+DIALECT = '''\
+def source_transformer(source):
+    return source.replace("<<<", "{op}")
+'''
+
+LIB = '''\
+from __lang__ import wdialect
+def f(x):
+    return x <<< {k}
+'''
+
+# Uses ``wlib`` through a global name, so it depends on it.
+MAIN = '''\
+from __lang__ import wdialect
+import wlib
+print("result", wlib.f(10), flush=True)
+'''
+
+def test_reload_order():
+    deps = {"a": {"b"}, "b": {"c"}, "c": set(), "d": {"c"}, "e": set()}
+    assert _reload_order({"c"}, deps) == ["c", "b", "a", "d"]  # dependencies first
+    assert _reload_order({"b"}, deps) == ["b", "a"]
+    assert _reload_order({"e"}, deps) == ["e"]
+    assert _reload_order(set(), deps) == []
+    assert sorted(_reload_order({"x"}, {"x": {"y"}, "y": {"x"}})) == ["x", "y"]  # a loop is broken
+
+class Output:
+    """Collect the output lines of a process in the background."""
+    def __init__(self, stream):
+        self.lines = queue.Queue()
+        self.seen = []
+        threading.Thread(target=self._read, args=(stream,), daemon=True).start()
+    def _read(self, stream):
+        for line in stream:
+            self.lines.put(line.rstrip("\n"))
+    def expect(self, prefix, timeout=60):
+        """Return the next line starting with ``prefix``; fail if none appears in ``timeout`` seconds."""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                line = self.lines.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                assert False, "no line starting with {!r}; got:\n{}".format(prefix, "\n".join(self.seen))
+            self.seen.append(line)
+            if line.startswith(prefix):
+                return line
+
+def main():
+    test_reload_order()
+
+    with tempdir() as directory:
+        process = None
+        try:
+            dialect = os.path.join(directory, "wdialect.py")
+            lib = os.path.join(directory, "wlib.py")
+            write(dialect, DIALECT.format(op="*"), mtime=1e9)
+            write(lib, LIB.format(k=2), mtime=1e9)
+            write(os.path.join(directory, "wmain.py"), MAIN, mtime=1e9)
+
+            process = subprocess.Popen([sys.executable, PYDIALECT, "--watch", "wmain.py"],
+                                       env=environment(directory), cwd=directory,
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+            output = Output(process.stdout)
+            assert output.expect("result") == "result 20"
+            output.expect("Watching")
+
+            # A changed module is reloaded, and the program runs again.
+            write(lib, LIB.format(k=3), mtime=2e9)
+            assert output.expect("result") == "result 30"
+            output.expect("Watching")
+
+            # A changed dialect definition re-expands the modules that use it.
+            write(dialect, DIALECT.format(op="+"), mtime=3e9)
+            assert output.expect("result") == "result 13"
+            output.expect("Watching")
+
+            # An error does not stop the watching; fixing it runs the program again.
+            write(lib, "from __lang__ import wdialect\ndef f(x:\n", mtime=4e9)
+            output.expect("SyntaxError")
+            output.expect("Watching")
+            write(lib, LIB.format(k=5), mtime=5e9)
+            assert output.expect("result") == "result 15"
+            output.expect("Watching")
+
+            # Ctrl+C quits.
+            process.send_signal(signal.SIGINT)
+            assert process.wait(timeout=30) == 0
+        finally:
+            if process is not None and process.poll() is None:
+                process.kill()
+                process.wait()
+
+    print("All tests PASSED")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Token-level rewriting for source transformers.
+
+A ``source_transformer`` that adds a few custom operators typically tokenizes
+the source, rewrites some tokens, and untokenizes; and if done rule by rule,
+it does that once per rule. Here the rules are compiled into a dispatch table
+keyed by the first token of each pattern, and all of them are applied in a
+single streaming pass over the tokens::
+
+    from dialects.tokenrewrite import TokenRewriter
+
+    rules = TokenRewriter()
+    rules.add("|>", ">>")                  # a |> f   -->  a >> f
+    rules.add("<<<", "*")
+    rules.add("unless", "if not")
+    rules.add("-->", lambda tokens: "->")  # replacement may be computed
+
+    source_transformer = rules.transform
+
+A pattern is a snippet of (tokenizable) source text. It matches a run of
+tokens with the same types and strings; tokens that are adjacent in the
+pattern (no space between them, as in ``|>``) must also be adjacent in the
+source. Since matching is done on tokens, the insides of string literals and
+comments are never rewritten. When several patterns match at the same
+position, the longest wins; earlier-added patterns win ties.
+
+The replacement is a string, or a function that takes the list of matched
+token strings and returns a string. Everything outside the matched tokens is
+copied from the original source as-is, so formatting (and line numbers, as
+long as replacements contain no newlines) are preserved.
+
+If none of the patterns can appear in the source (checked with a single
+regular expression search for the pattern texts), the source is returned
+unchanged without tokenizing it.
+
+Note the patterns must be tokenizable by the stdlib ``tokenize`` module of
+the running Python, and so must the source; how characters that are not valid
+Python (such as ``$``) are tokenized depends on the Python version.
+"""
+
+__all__ = ["TokenRewriter"]
+
+import io
+import re
+import tokenize
+
+# These carry no text of their own.
+_skip_types = frozenset((tokenize.ENCODING, tokenize.NEWLINE, tokenize.NL, tokenize.INDENT,
+                         tokenize.DEDENT, tokenize.ENDMARKER))
+
+class _Rule:
+    def __init__(self, pattern, replacement):
+        tokens = [tok for tok in tokenize.generate_tokens(io.StringIO(pattern).readline)
+                  if tok.type not in _skip_types]
+        if not tokens:
+            raise ValueError("empty pattern {!r}".format(pattern))
+        if any(tok.type == tokenize.COMMENT for tok in tokens):
+            raise ValueError("pattern {!r} contains a comment".format(pattern))
+        self.pattern = pattern
+        self.keys = [(tok.type, tok.string) for tok in tokens]
+        # adjacent[k]: whether token k + 1 must immediately follow token k
+        self.adjacent = [a.end == b.start for a, b in zip(tokens, tokens[1:])]
+        self.replacement = replacement
+        # The text of the leading run of adjacent tokens must appear in the source for this rule to match.
+        k = 0
+        while k < len(self.adjacent) and self.adjacent[k]:
+            k += 1
+        self.trigger = "".join(tok.string for tok in tokens[:k + 1])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def matches(self, buf):
+        """Return whether the rule matches at the start of the token buffer ``buf``."""
+        if len(buf) < len(self.keys):
+            return False
+        for k, key in enumerate(self.keys):
+            tok = buf[k]
+            if (tok.type, tok.string) != key:
+                return False
+            if k > 0 and self.adjacent[k - 1] and buf[k - 1].end != tok.start:
+                return False
+        return True
+
+    def replace(self, tokens):
+        if callable(self.replacement):
+            return self.replacement([tok.string for tok in tokens])
+        return self.replacement
+
+class TokenRewriter:
+    """A set of token rewrite rules, applied in a single pass; see the module docstring."""
+
+    def __init__(self):
+        self.rules = []
+        self._table = None  # (type, string) of first token -> rules, longest first
+        self._triggers = None  # regex that finds any trigger text
+
+    def add(self, pattern, replacement):
+        """Add a rule: replace the tokens matching ``pattern`` by ``replacement``.
+
+        Returns ``self``, for chaining.
+        """
+        self.rules.append(_Rule(pattern, replacement))
+        self._table = self._triggers = None
+        return self
+
+    def _compile(self):
+        table = {}
+        for rule in self.rules:
+            table.setdefault(rule.keys[0], []).append(rule)
+        for rules in table.values():
+            rules.sort(key=len, reverse=True)  # stable, so earlier rules win ties
+        triggers = sorted(set(rule.trigger for rule in self.rules), key=len, reverse=True)
+        self._triggers = re.compile("|".join(re.escape(t) for t in triggers)) if triggers else None
+        self._table = table
+
+    def transform(self, source):
+        """Apply the rules to the source text ``source`` (a ``str``). Return the new source text.
+
+        Suitable for use as a dialect's ``source_transformer``.
+        """
+        if self._table is None:
+            self._compile()
+        if self._triggers is None or not self._triggers.search(source):  # quick bail-out
+            return source
+
+        # Absolute offsets of the line starts, to copy the text between tokens.
+        line_offsets = [0, 0]  # rows are 1-based
+        for line in io.StringIO(source):
+            line_offsets.append(line_offsets[-1] + len(line))
+        def offset(position):
+            row, col = position
+            return line_offsets[row] + col
+
+        table = self._table
+        lookahead = max(len(rule) for rule in self.rules)
+        out = []
+        copied = 0  # source[:copied] has been handled
+        buf = []
+        def process(final):
+            """Consume tokens from the start of ``buf``, while enough lookahead is buffered."""
+            nonlocal copied
+            while buf and (final or len(buf) >= lookahead):
+                tok = buf[0]
+                for rule in table.get((tok.type, tok.string), ()):
+                    if rule.matches(buf):
+                        matched = buf[:len(rule)]
+                        out.append(source[copied:offset(tok.start)])
+                        out.append(rule.replace(matched))
+                        copied = offset(matched[-1].end)
+                        del buf[:len(rule)]
+                        break
+                else:
+                    del buf[0]
+        for tok in tokenize.generate_tokens(io.StringIO(source).readline):
+            if tok.type in _skip_types or tok.type == tokenize.COMMENT:
+                continue
+            buf.append(tok)
+            process(final=False)
+        process(final=True)
+        out.append(source[copied:])
+        return "".join(out)
@@ -1,27 +1,23 @@
 # -*- coding: utf-8 -*-
 
-__all__ = ["splice_ast"]
+__all__ = ["splice_ast", "Template"]
 
-from ast import Expr, Name, If, Num, ImportFrom, Pass, copy_location
+from ast import AST, Expr, Name, If, Num, ImportFrom, Pass, copy_location, iter_fields, walk
 
-try:
-    from macropy.core.walkers import Walker
-except ImportError:
-    Walker = None
-
-def splice_ast(body, template, tag):
+def splice_ast(body, template, tag, prune=False, keep=()):
     """In an AST transformer, splice module body into template.
 
     Imports for MacroPy macros are handled specially, gathering them all at the
     front, so that MacroPy sees them. Any macro imports in the template are
     placed first (in the order they appear in the template), followed by any
     macro imports in the user code (in the order they appear in the user code).
+    Like MacroPy itself, we only look for macro imports at the top level of
+    the user code.
 
     This function is provided as a convenience for modules that define dialects.
-    We use MacroPy to perform the splicing, so this function is only available
-    when MacroPy is installed (``ImportError`` is raised if not). Installation
-    status is checked only once per session, when ``dialects.util`` is first
-    imported.
+    It works on the stdlib ``ast`` and does not need MacroPy. The template is
+    processed in a single iterative pass, so there is no recursion limit on
+    its nesting depth, and the user code (which may be large) is not walked.
 
     Parameters:
 
@@ -38,8 +34,24 @@ def splice_ast(body, template, tag):
         ``tag``: ``str``
             The value of the ``id`` attribute of the marker in ``template``.
 
+        ``prune``: ``bool``
+            If ``True``, drop from the macro imports of the template the macros
+            that neither the user code nor the rest of the template refers to,
+            so that MacroPy does not need to bind them. See below.
+
+        ``keep``: iterable of ``str``
+            With ``prune``, names of macros never to drop.
+
     Returns the new module body, i.e. ``template`` with ``body`` spliced in.
 
+    **Pruning** only touches macro imports, which do not exist at run time, so
+    the module namespace is the same either way. A macro is used if its name
+    occurs in the code; but if a macro expands into an invocation of another
+    macro imported by the template, that macro must be listed in ``keep``.
+    A macro import that has no macros left is dropped.
+
+    The nodes of ``template`` are updated in place.
+
     Example::
 
         marker = q[name["__paste_here__"]]      # MacroPy, or...
@@ -50,45 +62,220 @@ def splice_ast(body, template, tag):
         dialects.util.splice_ast(body, template, "__paste_here__")
 
     """
-    if not Walker:  # optional dependency for Pydialect, but mandatory for this util
-        raise ImportError("macropy.core.walkers.Walker not found; MacroPy likely not installed")
     if not body:  # ImportError because this occurs during the loading of a module written in a dialect.
         raise ImportError("expected at least one statement or expression in module body")
-
-    def is_paste_here(tree):
-        return type(tree) is Expr and type(tree.value) is Name and tree.value.id == tag
-    def is_macro_import(tree):
-        return type(tree) is ImportFrom and tree.names[0].name == "macros"
+    body, user_macro_imports = _extract_macro_imports(body)
 
     # XXX: MacroPy's debug logger will sometimes crash if a node is missing a source location.
     # In general, dialect templates are fully macro-generated with no source location info to start with.
     # Pretend it's all at the start of the user module.
-    locref = body[0]
-    @Walker
-    def fix_template_srcloc(tree, **kw):
-        if not all(hasattr(tree, x) for x in ("lineno", "col_offset")):
-            tree = copy_location(tree, locref)
-        return tree
-
-    @Walker
-    def extract_macro_imports(tree, *, collect, **kw):
-        if is_macro_import(tree):
-            collect(tree)
-            tree = copy_location(Pass(), tree)  # must output a node so replace by a pass stmt
-        return tree
-
-    template = fix_template_srcloc.recurse(template)
-    template, template_macro_imports = extract_macro_imports.recurse_collect(template)
-    body, user_macro_imports = extract_macro_imports.recurse_collect(body)
-
-    @Walker
-    def splice_body_into_template(tree, *, stop, **kw):
-        if not is_paste_here(tree):
-            return tree
-        stop()  # prevent infinite recursion in case the user code contains a Name that looks like the marker
-        return If(test=Num(n=1),
-                  body=body,
-                  orelse=[],
-                  lineno=tree.lineno, col_offset=tree.col_offset)
-    finalbody = splice_body_into_template.recurse(template)
-    return template_macro_imports + user_macro_imports + finalbody
+    def paste(lst, j, path):
+        lst[j] = _make_paste(lst[j], body)
+    template, template_macro_imports = _process_template(template, tag, body[0], paste)
+    if prune:
+        used = _names_used(body)
+        used.update(keep)
+        used.update(_names_used(template))
+        template_macro_imports = _prune_macro_imports(template_macro_imports, used)
+    return template_macro_imports + user_macro_imports + template
+
+def _names_used(trees):
+    """Return the set of names (``ast.Name`` identifiers) in ``trees``.
+
+    This includes all names a macro can be invoked by.
+    """
+    names = set()
+    for tree in trees:
+        names.update(node.id for node in walk(tree) if type(node) is Name)
+    return names
+
+def _prune_macro_imports(stmts, used):
+    """Drop from the macro imports ``stmts`` the macros not in the set ``used``.
+
+    Returns a new list of statements. A macro import that has only ``macros`` left is dropped.
+    """
+    out = []
+    for stmt in stmts:
+        names = stmt.names[:1] + [alias for alias in stmt.names[1:] if (alias.asname or alias.name) in used]
+        if len(names) == len(stmt.names):
+            out.append(stmt)
+        elif len(names) > 1:
+            out.append(copy_location(ImportFrom(module=stmt.module, names=names, level=stmt.level), stmt))
+    return out
+
+def _is_paste_here(tree, tag):
+    return type(tree) is Expr and type(tree.value) is Name and tree.value.id == tag
+
+def _is_macro_import(tree):
+    return type(tree) is ImportFrom and tree.names[0].name == "macros"
+
+def _extract_macro_imports(body):
+    """Return ``(body, macro_imports)`` for the top level of the module body ``body``."""
+    macro_imports = [stmt for stmt in body if _is_macro_import(stmt)]
+    if macro_imports:  # a node must remain in place, so replace by a pass stmt
+        body = [copy_location(Pass(), stmt) if _is_macro_import(stmt) else stmt for stmt in body]
+    return body, macro_imports
+
+def _make_paste(marker, body):
+    """Make the node that replaces ``marker``, containing ``body``."""
+    return If(test=copy_location(Num(n=1), marker),
+              body=body,
+              orelse=[],
+              lineno=marker.lineno, col_offset=marker.col_offset)
+
+def _process_template(template, tag, locref, paste):
+    """Prepare the dialect template ``template`` (a list of statements).
+
+    Fill in missing source locations (from ``locref``), and extract the macro
+    imports. For each marker, call ``paste(lst, index, path)``, where
+    ``lst[index]`` is the marker, and ``path`` is as in ``_follow``.
+
+    Returns ``(template, macro_imports)``. The nodes of ``template`` are updated in place.
+    """
+    # Walk the template in preorder, so that macro imports are collected in the order
+    # they appear. Each stack item is ``(node, lst, index, path)``, where ``lst[index]``
+    # is the node, if the node is an item of a list (this is where statements live).
+    template = list(template)
+    macro_imports = []
+    stack = [(node, template, j, ((None, j),)) for j, node in reversed(list(enumerate(template)))]
+    while stack:
+        tree, lst, j, path = stack.pop()
+        if "lineno" in tree._attributes and not all(hasattr(tree, x) for x in ("lineno", "col_offset")):
+            copy_location(tree, locref)
+        if lst is not None:
+            if _is_macro_import(tree):
+                macro_imports.append(tree)
+                lst[j] = copy_location(Pass(), tree)
+            elif _is_paste_here(tree, tag):
+                # Don't descend into the pasted code; the user code may contain a Name
+                # that looks like the marker.
+                paste(lst, j, path)
+                continue
+        children = []
+        for field, value in iter_fields(tree):
+            if isinstance(value, list):
+                children.extend((item, value, k, path + ((field, k),))
+                                for k, item in enumerate(value) if isinstance(item, AST))
+            elif isinstance(value, AST):
+                children.append((value, None, None, path + ((field, None),)))
+        stack.extend(reversed(children))
+    return template, macro_imports
+
+def _follow(template, path):
+    """Return ``(lst, index)`` of the node at ``path`` in ``template``.
+
+    ``path`` is a sequence of ``(field, index)``, starting from the template (a list),
+    where ``field`` is ``None`` for the first item; ``index`` is ``None`` if the
+    field is not a list.
+    """
+    (_, j), *rest = path
+    lst = template
+    for field, k in rest:
+        node = lst[j]
+        lst, j = getattr(node, field), k
+    return lst, j
+
+def _copy_tree(tree):
+    """Copy the AST ``tree`` (a node, or a list of nodes).
+
+    Much faster than ``copy.deepcopy``. Nodes that have neither fields nor
+    attributes (such as ``ast.Load()``) are not copied; they carry no data,
+    and the parser shares them, too. Nodes with only a source location (such
+    as ``ast.Pass()``) are copied, since it may be set differently in each copy.
+    """
+    root = [tree]
+    stack = [(root, 0)]
+    while stack:
+        lst, j = stack.pop()
+        old = lst[j]
+        if isinstance(old, list):
+            new = list(old)
+            stack.extend((new, k) for k, item in enumerate(new) if isinstance(item, (AST, list)))
+        elif not old._fields and not old._attributes:
+            continue
+        else:
+            new = old.__class__.__new__(old.__class__)
+            new.__dict__.update(old.__dict__)
+            for field in old._fields:
+                value = getattr(old, field, None)
+                if isinstance(value, list):
+                    value = list(value)
+                    setattr(new, field, value)
+                    stack.extend((value, k) for k, item in enumerate(value) if isinstance(item, AST))
+                elif isinstance(value, AST) and (value._fields or value._attributes):
+                    stack.append((_Slot(new, field), 0))
+        lst[j] = new
+    return root[0]
+
+class _Slot:
+    """A single-item "list" that writes through to a field of an AST node, for ``_copy_tree``."""
+    def __init__(self, node, field):
+        self.node = node
+        self.field = field
+    def __getitem__(self, j):
+        return getattr(self.node, self.field)
+    def __setitem__(self, j, value):
+        setattr(self.node, self.field, value)
+
+class Template:
+    """A dialect template, prepared once, and spliced into each module cheaply.
+
+    A dialect's ``ast_transformer`` typically builds the same template (e.g.
+    with MacroPy's ``with q as template:``) for every module it transforms, and
+    ``splice_ast`` then processes it. A ``Template`` does that work once per
+    process: the template's macro imports are extracted, missing source
+    locations are filled in, and the position of the marker is recorded.
+    Each ``splice`` then only copies the template (it must not be shared
+    between modules, since macro expansion modifies the tree in place) and
+    puts the module body where the marker was.
+
+    Missing source locations are set to line 1, instead of the location of
+    the first statement of each module (as ``splice_ast`` does).
+
+    Example::
+
+        with q as template:
+            ...
+            name["__paste_here__"]
+        template = dialects.util.Template(template, "__paste_here__")
+
+        def ast_transformer(module_body):
+            return template.splice(module_body)
+
+    Parameters as in ``splice_ast``; in particular, with ``prune=True``, the
+    macro imports of the template are pruned for each module according to the
+    names it uses.
+    """
+    def __init__(self, template, tag, prune=False, keep=()):
+        self.tag = tag
+        self.prune = prune
+        paths = []
+        def record(lst, j, path):
+            paths.append(path)
+        locref = Pass(lineno=1, col_offset=0)
+        self.template, self.macro_imports = _process_template(template, tag, locref, record)
+        if not paths:
+            raise ValueError("marker '{}' not found in template".format(tag))
+        self.paths = paths
+        # Names the template itself refers to (e.g. block macros around the marker) are always kept.
+        self.keep = set(keep)
+        self.keep.update(_names_used(self.template))
+
+    def splice(self, body):
+        """Splice the module body ``body`` into a copy of the template; see ``splice_ast``.
+
+        Returns the new module body.
+        """
+        if not body:  # ImportError because this occurs during the loading of a module written in a dialect.
+            raise ImportError("expected at least one statement or expression in module body")
+        body, user_macro_imports = _extract_macro_imports(body)
+        template = _copy_tree(self.template)
+        for path in self.paths:
+            lst, j = _follow(template, path)
+            lst[j] = _make_paste(lst[j], body)
+        macro_imports = _copy_tree(self.macro_imports)
+        if self.prune:
+            used = _names_used(body)
+            used.update(self.keep)
+            macro_imports = _prune_macro_imports(macro_imports, used)
+        return macro_imports + user_macro_imports + template
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""Watch mode: rerun a program whenever its dialect sources change.
+
+Used by ``pydialect --watch``. The program runs in this process; when it
+finishes (or fails), we wait for changes in the sources of the modules loaded
+through the dialect importer (and of the main program, and of the dialect
+definitions those modules use), reload the changed modules and their
+dependents, and run the program again. The interpreter, MacroPy, and all
+modules that did not change stay loaded, so each round only pays for
+re-expanding what changed (for dialects that support it, only the changed
+statements; see ``dialects.incremental``).
+
+The files are polled in a background thread (the standard library has no
+portable file change notification). When a changed module's source has been
+stable for one polling interval, it is expanded and compiled right away, in
+the background (into the compile cache, and the importer's in-memory table),
+even if the program is still running.
+
+A module *depends* on another one if one of its globals refers to that module,
+or to an object (function, class) defined there. Only dialect modules are
+reloaded as dependents; other modules that refer to a reloaded module keep
+the old version. Each module that uses a dialect depends on its dialect
+definition, so editing the dialect re-expands all of them.
+"""
+
+__all__ = ["watch"]
+
+import importlib
+import logging
+import os
+import sys
+import threading
+import traceback
+from types import ModuleType
+
+from .importer import DialectFinder, DialectLoader
+
+logger = logging.getLogger(__name__)
+
+def _dialect_loader(module):
+    """Return the ``DialectLoader`` that loaded ``module``, or ``None``.
+
+    Modules not yet loaded by a ``LazyLoader`` return ``None`` (there is
+    nothing to reload), and are not loaded by this.
+    """
+    try:
+        spec = object.__getattribute__(module, "__spec__")  # no attribute hooks
+    except AttributeError:
+        return None
+    loader = getattr(spec, "loader", None)
+    return loader if isinstance(loader, DialectLoader) else None
+
+def _origin(module):
+    spec = object.__getattribute__(module, "__spec__")
+    return spec.origin if getattr(spec, "has_location", False) else None
+
+def _referenced_modules(module):
+    """Return the names of the modules that the globals of ``module`` refer to."""
+    out = set()
+    for value in list(vars(module).values()):
+        try:
+            if isinstance(value, ModuleType):
+                out.add(object.__getattribute__(value, "__name__"))
+            else:
+                name = getattr(value, "__module__", None)
+                if isinstance(name, str):
+                    out.add(name)
+        except Exception:  # whatever the value does on attribute access
+            pass
+    return out
+
+def _snapshot():
+    """Scan ``sys.modules``.
+
+    Return ``(files, deps)``, where ``files`` maps the source path of each
+    watched module to its name, and ``deps`` maps each dialect module name to
+    the names of the watched modules it depends on.
+    """
+    files = {}
+    deps = {}
+    for name, module in list(sys.modules.items()):
+        loader = _dialect_loader(module)
+        if loader is None:
+            continue
+        path = _origin(module)
+        if path is None:
+            continue
+        files[path] = name
+        referenced = _referenced_modules(module)
+        referenced.add(loader.dialect_name)
+        deps[name] = referenced
+        lang_module = sys.modules.get(loader.dialect_name)
+        if lang_module is not None and getattr(lang_module, "__file__", None):
+            files[lang_module.__file__] = loader.dialect_name
+    for name in deps:
+        deps[name] = {other for other in deps[name]
+                      if other != name and other in files.values()}
+    return files, deps
+
+def _reload_order(changed, deps):
+    """Return the names of the modules to reload, dependencies first.
+
+    ``changed``: names of the modules whose sources have changed.
+    ``deps``: module name -> names of the modules it depends on.
+    """
+    dependents = {}
+    for name, names in deps.items():
+        for other in names:
+            dependents.setdefault(other, set()).add(name)
+    affected = set()
+    stack = list(changed)
+    while stack:
+        name = stack.pop()
+        if name not in affected:
+            affected.add(name)
+            stack.extend(dependents.get(name, ()))
+    order = []
+    visited = set()
+    def visit(name):  # postorder DFS; a dependency loop is broken arbitrarily
+        if name in visited:
+            return
+        visited.add(name)
+        for other in sorted(deps.get(name, ())):
+            if other in affected:
+                visit(other)
+        order.append(name)
+    for name in sorted(affected):
+        visit(name)
+    return order
+
+class _Poller(threading.Thread):
+    """Poll the watched files in the background; precompile changed dialect modules."""
+
+    def __init__(self, interval):
+        super().__init__(name="pydialect-watch", daemon=True)
+        self.interval = interval
+        self.condition = threading.Condition()
+        self.files = {}  # path -> (mtime_ns, size) when the program was (re)loaded
+        self.specs = {}  # path -> spec of the dialect module, for precompiling
+        self.changed = set()
+
+    def watch(self, files, specs):
+        """Watch the paths ``files``; ``specs`` maps paths of dialect modules to their specs."""
+        with self.condition:
+            self.files = {path: self.files.get(path) or _stat(path) for path in files}
+            self.specs = specs
+
+    def wait(self):
+        """Block until some watched files have changed; return their paths."""
+        with self.condition:
+            while not self.changed:
+                self.condition.wait()
+            changed, self.changed = self.changed, set()
+            for path in changed:  # the new version is the baseline from now on
+                self.files[path] = _stat(path)
+            return changed
+
+    def run(self):
+        previous = {}
+        while True:
+            self.condition.acquire()
+            try:
+                self.condition.wait(self.interval)
+                files = dict(self.files)
+                specs = self.specs
+                reported = set(self.changed)
+            finally:
+                self.condition.release()
+            current = {path: _stat(path) for path in files}
+            # Changed, and has stayed the same for one interval (the editor is done writing).
+            stable = {path for path, st in current.items()
+                      if st != files[path] and st == previous.get(path) and path not in reported}
+            previous = current
+            if not stable:
+                continue
+            # If a dialect definition changed, it must be reloaded before expanding its users.
+            if all(path in specs for path in stable):
+                for path in stable:
+                    self.precompile(specs[path])
+            with self.condition:
+                self.changed.update(path for path in stable if path in self.files)
+                self.condition.notify_all()
+
+    def precompile(self, spec):
+        try:
+            logger.info("Source of '%s' changed, compiling", spec.name)
+            DialectFinder.compile_module(spec)
+        except Exception as err:  # reported when the module is reloaded
+            logger.debug("Could not precompile '%s': %s", spec.name, err)
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _failed_files(exc):
+    """Return the existing source files mentioned in the traceback of ``exc``."""
+    out = set()
+    filename = getattr(exc, "filename", None)  # SyntaxError
+    if isinstance(filename, str) and os.path.isfile(filename):
+        out.add(os.path.abspath(filename))
+    for frame in traceback.extract_tb(exc.__traceback__):
+        if os.path.isfile(frame.filename):
+            out.add(os.path.abspath(frame.filename))
+    return out
+
+def watch(run, main_file=None, interval=0.5):
+    """Run ``run()``, then rerun it each time the watched sources change.
+
+    ``main_file``: the source file of the main program, if known; it is
+    watched even if it does not use a dialect.
+
+    Exceptions raised by ``run`` are printed, and do not stop the watching.
+    Enables incremental expansion (see ``dialects.incremental``).
+    Does not return; stop with Ctrl+C (``KeyboardInterrupt``).
+    """
+    DialectFinder.incremental = True  # only the changed statements are expanded again
+    poller = _Poller(interval)
+    poller.start()
+    while True:
+        extra = set()
+        if main_file:
+            extra.add(os.path.abspath(main_file))
+        try:
+            run()
+        except SystemExit as err:
+            if err.code not in (None, 0):
+                print("Program exited with status {}".format(err.code), file=sys.stderr)
+        except Exception as err:
+            traceback.print_exc()
+            extra.update(_failed_files(err))
+        while True:
+            files, deps = _snapshot()
+            specs = {}
+            for path, name in files.items():
+                loader = _dialect_loader(sys.modules[name])
+                if loader is not None:
+                    specs[path] = loader.nomacro_spec  # with the real name, also for the main module
+            poller.watch(set(files) | extra, specs)
+            print("Watching {} files for changes (Ctrl+C to quit)".format(len(set(files) | extra)),
+                  file=sys.stderr)
+            changed = poller.wait()
+            names = {files[path] for path in changed if path in files} - {"__main__"}
+            print("Changed: {}".format(", ".join(sorted(changed))), file=sys.stderr)
+            try:
+                for name in _reload_order(names, deps):
+                    module = sys.modules.get(name)
+                    if module is None:
+                        continue
+                    if _dialect_loader(module) is None:  # a dialect definition; its users expand anew
+                        DialectFinder.invalidate({_dialect_loader(sys.modules[other]).fullname
+                                                  for other, d in deps.items() if name in d})
+                    if name == "__main__":  # rerun below
+                        continue
+                    logger.info("Reloading '%s'", name)
+                    importlib.reload(module)
+            except Exception:
+                traceback.print_exc()
+                continue  # don't run the program with a half-reloaded state; wait for a fix
+            break
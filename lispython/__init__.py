@@ -7,24 +7,33 @@ __version__ = '1.0.0'
 
 from macropy.core.quotes import macros, q, name
 
-from dialects.util import splice_ast
+from dialects.util import Template
+
+# The template is the same for every module, so build it only once.
+with q as template:
+    from unpythonic.syntax import macros, tco, autoreturn, \
+                                  multilambda, quicklambda, namedlambda, \
+                                  let, letseq, letrec, do, do0, \
+                                  dlet, dletseq, dletrec, \
+                                  blet, bletseq, bletrec, \
+                                  let_syntax, abbrev, \
+                                  cond
+    # auxiliary syntax elements for the macros
+    from unpythonic.syntax import local, delete, where, block, expr, f, _
+    from unpythonic import cons, car, cdr, ll, llist, nil, prod, dyn
+    with namedlambda:  # MacroPy #21 (nontrivial two-pass macro; seems I didn't get the fix right)
+        with autoreturn, quicklambda, multilambda, tco:
+            name["__paste_here__"]
+# Bind in each module only the macros it uses.
+template = Template(template, "__paste_here__", prune=True)
+
+# The block macros transform each definition separately, so each top-level
+# statement can be expanded on its own. Used only during development, by
+# pydialect --watch (see dialects.incremental).
+incremental = True
 
 def ast_transformer(module_body):
-    with q as template:
-        from unpythonic.syntax import macros, tco, autoreturn, \
-                                      multilambda, quicklambda, namedlambda, \
-                                      let, letseq, letrec, do, do0, \
-                                      dlet, dletseq, dletrec, \
-                                      blet, bletseq, bletrec, \
-                                      let_syntax, abbrev, \
-                                      cond
-        # auxiliary syntax elements for the macros
-        from unpythonic.syntax import local, delete, where, block, expr, f, _
-        from unpythonic import cons, car, cdr, ll, llist, nil, prod, dyn
-        with namedlambda:  # MacroPy #21 (nontrivial two-pass macro; seems I didn't get the fix right)
-            with autoreturn, quicklambda, multilambda, tco:
-                name["__paste_here__"]
-    return splice_ast(module_body, template, "__paste_here__")
+    return template.splice(module_body)
 
 def rejoice():
     """**Schemers rejoice!**::
@@ -7,15 +7,19 @@ __version__ = '1.0.0'
 
 from macropy.core.quotes import macros, q, name
 
-from dialects.util import splice_ast
+from dialects.util import Template
+
+# The template is the same for every module, so build it only once.
+with q as template:
+    from unpythonic.syntax import macros, prefix, curry
+    # auxiliary syntax elements for the macros
+    from unpythonic.syntax import q, u, kw
+    from unpythonic import apply
+    from unpythonic import composerc as compose  # compose from Right, Currying
+    with prefix, curry:
+        name["__paste_here__"]
+# Bind in each module only the macros it uses.
+template = Template(template, "__paste_here__", prune=True)
 
 def ast_transformer(module_body):
-    with q as template:
-        from unpythonic.syntax import macros, prefix, curry
-        # auxiliary syntax elements for the macros
-        from unpythonic.syntax import q, u, kw
-        from unpythonic import apply
-        from unpythonic import composerc as compose  # compose from Right, Currying
-        with prefix, curry:
-            name["__paste_here__"]
-    return splice_ast(module_body, template, "__paste_here__")
+    return template.splice(module_body)